@@ -0,0 +1,14 @@
+'''
+Lets the benchmark scripts import the app from the repository. Import this
+module before anything from main.
+'''
+import os, sys
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+# The app refuses to load without these settings.
+for key, value in (
+    ("APP_SECRET_KEY", "benchmark"),
+    ("OAUTH_APP_ID", "benchmark"),
+    ("OAUTH_APP_SECRET", "benchmark"),
+    ("OAUTH_CALLBACK", "http://localhost:5000/callback"),
+):
+    os.environ.setdefault(key, value)
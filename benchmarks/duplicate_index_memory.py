@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+'''
+Compares the peak memory that duplicate_index.DuplicateIndex uses to group
+files by bucket key with that of duplicate_index.SpillingDuplicateIndex, which
+writes files without a known duplicate to disk beyond a memory budget.
+
+Usage:
+    python benchmarks/duplicate_index_memory.py [number of files] [budget]
+'''
+import hashlib, sys, time, tracemalloc
+# This makes the app importable.
+import app_environment
+from main import duplicate_index
+
+def generate_keys(count):
+    '''
+    Yields bucket keys like the ones from file_records.FileRecordStore. About
+    one in ten files is a duplicate of an earlier one.
+    '''
+    for i in range(count):
+        content = str(i - i % 10 if i % 10 == 9 else i).encode()
+        yield len(content).to_bytes(8, "little") + \
+            hashlib.sha1(content).digest()
+
+def measure(index, count):
+    tracemalloc.start()
+    time_start = time.perf_counter()
+    for i, key in enumerate(generate_keys(count)):
+        index.add(key, i)
+    index.merge()
+    elapsed = time.perf_counter() - time_start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak, elapsed, index.num_groups
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    budget = int(sys.argv[2]) if len(sys.argv) > 2 else 8 << 20
+    print("{} files, budget of {:,} bytes".format(count, budget))
+    for name, index in (
+        ("In memory:", duplicate_index.DuplicateIndex()),
+        ("Spilling: ", duplicate_index.SpillingDuplicateIndex(budget)),
+    ):
+        peak, elapsed, num_groups = measure(index, count)
+        print("{} {:>12,} bytes at peak, {:.2f} s, {} groups".format(
+            name, peak, elapsed, num_groups
+        ))
+
+if __name__ == "__main__":
+    main()
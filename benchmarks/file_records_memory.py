@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+'''
+Compares the memory that a scan uses to hold its files in the original layout
+(a list of file_tree.File objects for each (size, hash) pair) with the memory
+that it uses in file_records.FileRecordStore.
+
+Usage: python benchmarks/file_records_memory.py [number of files]
+'''
+import base64, collections, hashlib, sys, tracemalloc
+# This makes the app importable.
+import app_environment
+from main import file_records, file_tree
+
+def generate_files(count):
+    '''
+    Yields File objects that look like the ones that OneDrive returns. About
+    one in ten files is a duplicate of an earlier one.
+    '''
+    for i in range(count):
+        content = str(i - i % 10 if i % 10 == 9 else i).encode()
+        digest = hashlib.sha1(content).digest()
+        folder = i // 50
+        yield file_tree.File(
+            id="{:016X}!{}".format(0x1234ABCD, i),
+            name="IMG_{:06d}.jpg".format(i),
+            size=len(content) * 1000,
+            url="https://onedrive.live.com/redir?resid=1234ABCD!{}".format(i),
+            parent_id="1234ABCD!{}".format(folder),
+            parent_path="/drive/root:/Pictures/Camera Roll/{}".format(folder),
+            mime_type="image/jpeg",
+            hashes={
+                "sha1Hash": digest.hex().upper(),
+                "quickXorHash": base64.b64encode(digest).decode("ASCII"),
+            }
+        )
+
+def measure(build, count):
+    tracemalloc.start()
+    result = build(generate_files(count))
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del result
+    return size
+
+def build_original(files):
+    files_with_hash = collections.defaultdict(list)
+    for file in files:
+        files_with_hash[(file.size, file.hashes.get("sha1Hash"))].append(file)
+    return files_with_hash
+
+def build_compact(files):
+    records = file_records.FileRecordStore()
+    files_with_hash = collections.defaultdict(list)
+    for file in files:
+        index = records.add(file)
+        files_with_hash[records.get_bucket_key(index, "sha1Hash")] \
+            .append(index)
+    return records, files_with_hash
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    original = measure(build_original, count)
+    compact = measure(build_compact, count)
+    print("{} files".format(count))
+    print("Original layout: {:>12,} bytes ({:.0f} per file)".format(
+        original, original / count
+    ))
+    print("Compact layout:  {:>12,} bytes ({:.0f} per file)".format(
+        compact, compact / count
+    ))
+    print("Ratio: {:.2f}".format(original / compact))
+
+if __name__ == "__main__":
+    main()
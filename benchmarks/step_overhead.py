@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+'''
+Measures how much time DuplicateFileScan.step() spends per folder apart from
+the API calls themselves. The child_yielder below returns prebuilt files
+without any I/O, so nearly all of the measured time is overhead in the scan.
+
+Usage: python benchmarks/step_overhead.py [number of folders] [files per folder]
+'''
+import sys, time
+# This makes the app importable.
+import app_environment
+from main import app, file_tree
+
+def main():
+    num_folders = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    files_per_folder = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    def child_yielder(url, add_folder_url):
+        folder = int(url)
+        for i in range(files_per_folder):
+            yield file_tree.File(
+                id="{}!{}".format(folder, i),
+                name="{}.txt".format(i),
+                size=i,
+                url="https://example.com/{}/{}".format(folder, i),
+                parent_id=str(folder),
+                parent_path="/drive/root:/{}".format(folder),
+                mime_type="text/plain",
+                hashes={"sha1Hash": "{:040X}".format(i)}
+            )
+    scan = file_tree.DuplicateFileScan("sha1Hash", child_yielder, str)
+    for folder in range(num_folders):
+        scan.add_folder_url(str(folder))
+    # Older versions of the scan read the Flask session in step().
+    with app.test_request_context():
+        time_start = time.perf_counter()
+        while not scan.complete:
+            scan.step()
+        elapsed = time.perf_counter() - time_start
+    print("{} folders with {} files each".format(num_folders, files_per_folder))
+    print("Total: {:.3f} s".format(elapsed))
+    print("Per folder: {:.1f} us".format(elapsed / num_folders * 1e6))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,516 @@
+#!/usr/bin/env python3
+'''
+Scans a synthetic drive from end to end through a fake Microsoft Graph server
+on this computer. Measures the throughput of the scan, the peak memory of the
+process, the time that saving and loading the scan take, and the time that
+exporting the results takes in each format. The results are printed as JSON
+so that runs on different commits can be compared with --compare.
+
+The drive is generated from a seed, so the same options always give the same
+drive. The server runs in another process so that it does not take time or
+memory from the scan.
+
+Usage: python benchmarks/synthetic_drive.py --help
+'''
+import argparse, hashlib, http.server, json, multiprocessing, os, platform, \
+    random, socketserver, subprocess, sys, threading, time, urllib.parse, \
+    urllib.request
+try:
+    import resource
+except ImportError:
+    # This is only available on Unix.
+    resource = None
+# This makes the app importable.
+import app_environment
+
+# The fake server listens on this address.
+_HOST = "127.0.0.1"
+# The fake server serves the API under this path, like the real one.
+_API_PATH = "/v1.0"
+# The parts of the URLs that the scan requests.
+_CHILDREN_PATH = "/children"
+_ITEMS_PATH = "/me/drive/items/"
+_ROOT_PATH = "/me/drive/root"
+
+class SyntheticDrive:
+    def __init__(
+        self,
+        num_files,
+        fan_out,
+        depth,
+        duplicate_ratio,
+        page_size,
+        seed
+    ):
+        '''
+        Generates a drive with a tree of folders and files spread evenly over
+        them, and serves its folders as pages of /children responses.
+        
+        Arguments:
+            num_files:
+                the number of files in the drive
+            fan_out:
+                the number of subfolders in each folder above the deepest
+                level
+            depth:
+                the number of levels of folders below the root
+            duplicate_ratio:
+                the chance that a file has the same content as an earlier one
+            page_size:
+                the largest number of children in each page of a response
+            seed:
+                the seed of the random numbers with which the drive is made
+        '''
+        self._page_size = page_size
+        # The server sets this to the URL of the root of the API, which is
+        # needed for the links to the next pages.
+        self.base_url = None
+        rng = random.Random(seed)
+        # This maps each folder id to its path and its children as they
+        # appear in responses.
+        self._folders = {"root": ("/drive/root:", [])}
+        # Make the folders level by level.
+        level = ["root"]
+        for _ in range(depth):
+            level_new = []
+            for parent_id in level:
+                parent_path, children = self._folders[parent_id]
+                for i in range(fan_out):
+                    folder_id = "{}.{}".format(parent_id, i)
+                    name = "Folder {}".format(i)
+                    self._folders[folder_id] = (parent_path + "/" + name, [])
+                    children.append({
+                        "id": folder_id,
+                        "name": name,
+                        "size": 0,
+                        "webUrl": "https://example.com/" + folder_id,
+                        "parentReference": {
+                            "id": parent_id,
+                            "path": urllib.parse.quote(parent_path),
+                        },
+                        "folder": {"childCount": 0},
+                    })
+                    level_new.append(folder_id)
+            level = level_new
+        # Spread the files evenly over the folders. Each file has the content
+        # of an earlier one or new content, which is identified by a number.
+        folder_ids = list(self._folders)
+        contents = []
+        num_files_with_content = {}
+        for i in range(num_files):
+            if contents and rng.random() < duplicate_ratio:
+                content = rng.choice(contents)
+            else:
+                content = (len(contents), rng.randint(1 << 10, 16 << 20))
+                contents.append(content)
+            num_files_with_content[content] = \
+                num_files_with_content.get(content, 0) + 1
+            parent_id = folder_ids[i % len(folder_ids)]
+            parent_path, children = self._folders[parent_id]
+            digest = hashlib.sha1(str(content[0]).encode()).digest()
+            children.append({
+                "id": "{}!{}".format(parent_id, i),
+                "name": "File {}.bin".format(i),
+                "size": content[1],
+                "webUrl": "https://example.com/{}!{}".format(parent_id, i),
+                "parentReference": {
+                    "id": parent_id,
+                    "path": urllib.parse.quote(parent_path),
+                },
+                "file": {
+                    "mimeType": "application/octet-stream",
+                    "hashes": {"sha1Hash": digest.hex().upper()},
+                },
+            })
+        # Fill in the sizes and numbers of children of the folders, from the
+        # deepest up.
+        for folder_id in reversed(folder_ids):
+            for child in self._folders[folder_id][1]:
+                if "folder" in child:
+                    child["folder"]["childCount"] = \
+                        len(self._folders[child["id"]][1])
+                    child["size"] = sum(
+                        grandchild["size"]
+                        for grandchild in self._folders[child["id"]][1]
+                    )
+        self.summary = {
+            "numFiles": num_files,
+            "numFolders": len(self._folders) - 1,
+            "numDuplicateGroups": sum(
+                1 for count in num_files_with_content.values() if count > 1
+            ),
+            "numDuplicateFiles": sum(
+                count for count in num_files_with_content.values()
+                if count > 1
+            ),
+        }
+    def get(self, url):
+        '''
+        Returns the status code and the JSON body of the response to a GET
+        request for the given URL, relative to the root of the API.
+        '''
+        parsed = urllib.parse.urlparse(url)
+        path = urllib.parse.unquote(parsed.path)
+        query = urllib.parse.parse_qs(parsed.query)
+        if path == "/organization":
+            # This is a personal account, so the files have SHA-1 hashes.
+            return 200, {"value": []}
+        if path == _ROOT_PATH + "/delta":
+            # Only the latest delta link is needed for a scan folder by
+            # folder.
+            return 200, {
+                "value": [],
+                "@odata.deltaLink":
+                    self.base_url + _ROOT_PATH + "/delta?token=latest",
+            }
+        if path == _ROOT_PATH + _CHILDREN_PATH:
+            folder_id = "root"
+        elif path.startswith(_ITEMS_PATH) and path.endswith(_CHILDREN_PATH):
+            folder_id = path[len(_ITEMS_PATH):-len(_CHILDREN_PATH)]
+        else:
+            return 400, {"error": {"code": "invalidRequest"}}
+        try:
+            children = self._folders[folder_id][1]
+        except KeyError:
+            return 404, {"error": {"code": "itemNotFound"}}
+        start = int(query.get("$skiptoken", ["0"])[0])
+        end = start + self._page_size
+        body = {"value": children[start:end]}
+        if end < len(children):
+            body["@odata.nextLink"] = "{}{}?{}".format(
+                self.base_url,
+                parsed.path,
+                urllib.parse.urlencode({"$skiptoken": end})
+            )
+        return 200, body
+
+class _FakeGraphServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+    def __init__(self, drive, latency, throttle_ratio, retry_after, seed):
+        '''
+        Serves the given SyntheticDrive like the Microsoft Graph API, with
+        the given number of seconds of latency per request. The given ratio
+        of requests, including requests within batches, is throttled with a
+        429 response and the given Retry-After header.
+        '''
+        super().__init__((_HOST, 0), _FakeGraphRequestHandler)
+        self.drive = drive
+        self.drive.base_url = "http://{}:{}{}".format(
+            _HOST,
+            self.server_address[1],
+            _API_PATH
+        )
+        self.latency = latency
+        self.throttle_ratio = throttle_ratio
+        self.retry_after = retry_after
+        self.rng = random.Random(seed)
+        self.stats = {"numRequests": 0, "numThrottledRequests": 0}
+        self.stats_lock = threading.Lock()
+    def is_throttled(self):
+        # Count the request at the same time.
+        with self.stats_lock:
+            self.stats["numRequests"] += 1
+            if self.rng.random() < self.throttle_ratio:
+                self.stats["numThrottledRequests"] += 1
+                return True
+            return False
+
+class _FakeGraphRequestHandler(http.server.BaseHTTPRequestHandler):
+    # Keep connections alive, as the API does.
+    protocol_version = "HTTP/1.1"
+    def log_message(self, format, *args):
+        pass
+    def do_GET(self):
+        if self.path == "/stats":
+            with self.server.stats_lock:
+                self._respond(200, self.server.stats)
+            return
+        time.sleep(self.server.latency)
+        if self.server.is_throttled():
+            self._respond(*self._get_throttled_response())
+        else:
+            self._respond(*self.server.drive.get(self._get_api_path()))
+    def do_POST(self):
+        body = json.loads(
+            self.rfile.read(int(self.headers["Content-Length"]))
+        )
+        time.sleep(self.server.latency)
+        if self.server.is_throttled():
+            self._respond(*self._get_throttled_response())
+            return
+        if self._get_api_path() != "/$batch":
+            self._respond(400, {"error": {"code": "invalidRequest"}})
+            return
+        responses = []
+        for request in body["requests"]:
+            if self.server.is_throttled():
+                status, response_body = self._get_throttled_response()
+                headers = {"Retry-After": str(self.server.retry_after)}
+            else:
+                status, response_body = \
+                    self.server.drive.get(request["url"])
+                headers = {}
+            responses.append({
+                "id": request["id"],
+                "status": status,
+                "headers": headers,
+                "body": response_body,
+            })
+        self._respond(200, {"responses": responses})
+    def _get_api_path(self):
+        return self.path[len(_API_PATH):]
+    def _get_throttled_response(self):
+        return 429, {"error": {"code": "activityLimitReached"}}
+    def _respond(self, status, body):
+        content = json.dumps(body).encode("UTF-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        if status == 429:
+            self.send_header("Retry-After", str(self.server.retry_after))
+        self.end_headers()
+        self.wfile.write(content)
+
+def _serve(options, connection):
+    # This runs in the server process.
+    drive = SyntheticDrive(
+        options["files"],
+        options["fan_out"],
+        options["depth"],
+        options["duplicate_ratio"],
+        options["page_size"],
+        options["seed"]
+    )
+    server = _FakeGraphServer(
+        drive,
+        options["latency"] / 1000,
+        options["throttle_ratio"],
+        options["retry_after"],
+        options["seed"]
+    )
+    connection.send((drive.base_url, drive.summary))
+    server.serve_forever()
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Measures a scan of a synthetic drive through a fake "
+            "Microsoft Graph server."
+    )
+    drive = parser.add_argument_group("drive")
+    drive.add_argument(
+        "--files",
+        type=int,
+        default=100000,
+        help="the number of files (default: %(default)s)"
+    )
+    drive.add_argument(
+        "--fan-out",
+        type=int,
+        default=8,
+        help="the number of subfolders in each folder above the deepest level "
+            "(default: %(default)s)"
+    )
+    drive.add_argument(
+        "--depth",
+        type=int,
+        default=3,
+        help="the number of levels of folders below the root (default: "
+            "%(default)s)"
+    )
+    drive.add_argument(
+        "--duplicate-ratio",
+        type=float,
+        default=0.1,
+        help="the chance that a file has the same content as an earlier one "
+            "(default: %(default)s)"
+    )
+    drive.add_argument(
+        "--seed",
+        type=int,
+        default=0,
+        help="the seed of the generated drive (default: %(default)s)"
+    )
+    server = parser.add_argument_group("server")
+    server.add_argument(
+        "--page-size",
+        type=int,
+        default=200,
+        help="the largest number of children in each response (default: "
+            "%(default)s)"
+    )
+    server.add_argument(
+        "--latency",
+        type=float,
+        default=20.0,
+        help="the number of milliseconds of latency per request (default: "
+            "%(default)s)"
+    )
+    server.add_argument(
+        "--throttle-ratio",
+        type=float,
+        default=0.0,
+        help="the ratio of requests, including requests in batches, that are "
+            "throttled with 429 responses (default: %(default)s)"
+    )
+    server.add_argument(
+        "--retry-after",
+        type=int,
+        default=0,
+        help="the Retry-After header of the throttled responses (default: "
+            "%(default)s)"
+    )
+    scan = parser.add_argument_group("scan")
+    scan.add_argument(
+        "--concurrency",
+        type=int,
+        default=16,
+        help="the highest number of API calls in flight (default: %(default)s)"
+    )
+    scan.add_argument(
+        "--memory-budget",
+        type=int,
+        default=0,
+        help="the MEMORY_BUDGET setting of the scan (default: %(default)s)"
+    )
+    output = parser.add_argument_group("output")
+    output.add_argument(
+        "--output",
+        default="-",
+        help="the file to which to write the results as JSON (default: "
+            "standard output)"
+    )
+    output.add_argument(
+        "--compare",
+        help="a file with the results of an earlier run; the changes since "
+            "then are printed on standard error"
+    )
+    return parser.parse_args()
+
+def get_commit():
+    try:
+        return subprocess.check_output(
+            ("git", "rev-parse", "HEAD"),
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL,
+            universal_newlines=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def get_peak_memory():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kibibytes, and macOS reports bytes.
+    return peak if sys.platform == "darwin" else peak * 1024
+
+def run(args):
+    # Import the app only now that the settings point at the fake server.
+    from main import file_tree, onedrive, results_export, scan_runner, \
+        scheduler
+    scheduler.configure(args.concurrency, args.concurrency)
+    client = onedrive.GraphClient(
+        {"access_token": "benchmark", "token_type": "Bearer"},
+        args.concurrency
+    )
+    token = ("benchmarks/synthetic_drive.py", os.getpid())
+    file_tree.DuplicateFileScan.delete_save(token)
+    results = {}
+    time_start = time.perf_counter()
+    scan = scan_runner.load_or_create_scan(token, client)
+    while not scan.complete:
+        scan.step()
+    scan.close()
+    elapsed = time.perf_counter() - time_start
+    results["scanSeconds"] = elapsed
+    results["filesPerSecond"] = scan.num_scanned_files / elapsed
+    results["foldersPerSecond"] = scan.num_discovered_folders / elapsed
+    results["numScannedFiles"] = scan.num_scanned_files
+    results["numDuplicateGroups"] = scan.num_duplicate_groups
+    results["peakMemoryBytes"] = get_peak_memory()
+    # The first save of a scan writes all of it.
+    time_start = time.perf_counter()
+    scan.save(token)
+    results["saveSeconds"] = time.perf_counter() - time_start
+    time_start = time.perf_counter()
+    scan_loaded = scan_runner.load_or_create_scan(token, client)
+    results["loadSeconds"] = time.perf_counter() - time_start
+    if scan_loaded.num_scanned_files != scan.num_scanned_files:
+        raise AssertionError("The loaded scan is different.")
+    scan_loaded.close()
+    file_tree.DuplicateFileScan.delete_save(token)
+    for format, (_, iter_export) in sorted(results_export.FORMATS.items()):
+        time_start = time.perf_counter()
+        num_characters = 0
+        for chunk in iter_export(
+            scan.get_duplicates(collapse_folders=True),
+            scan.hash_type,
+            scan.get_duplicate_folders()
+        ):
+            num_characters += len(chunk)
+        results[format + "ExportSeconds"] = time.perf_counter() - time_start
+    client.close()
+    return results
+
+def compare(results_old, results_new):
+    print("{:<24} {:>16} {:>16} {:>8}".format(
+        "", "before", "after", "change"
+    ), file=sys.stderr)
+    for key, value_new in results_new.items():
+        value_old = results_old.get(key)
+        if not isinstance(value_new, (int, float)) or \
+                not isinstance(value_old, (int, float)):
+            continue
+        print("{:<24} {:>16,.3f} {:>16,.3f} {:>8}".format(
+            key,
+            value_old,
+            value_new,
+            "{:+.1%}".format(value_new / value_old - 1) if value_old else ""
+        ), file=sys.stderr)
+
+def main():
+    args = parse_args()
+    # Generate the drive and start the server in another process.
+    connection, connection_server = multiprocessing.Pipe()
+    server = multiprocessing.Process(
+        target=_serve,
+        args=(vars(args), connection_server),
+        daemon=True
+    )
+    server.start()
+    try:
+        base_url, drive_summary = connection.recv()
+        os.environ["GRAPH_API_URL"] = base_url
+        os.environ["MEMORY_BUDGET"] = str(args.memory_budget)
+        # The fake server does not use HTTPS.
+        os.environ["OAUTHLIB_INSECURE_TRANSPORT"] = "1"
+        results = run(args)
+        if results["numDuplicateGroups"] != \
+                drive_summary["numDuplicateGroups"]:
+            raise AssertionError("The scan found the wrong duplicates.")
+        with urllib.request.urlopen(
+            base_url[:-len(_API_PATH)] + "/stats"
+        ) as response:
+            results.update(json.load(response))
+    finally:
+        server.terminate()
+    document = {
+        "benchmark": "synthetic_drive",
+        "commit": get_commit(),
+        "python": platform.python_version(),
+        "options": vars(args),
+        "drive": drive_summary,
+        "results": results,
+    }
+    if args.output == "-":
+        json.dump(document, sys.stdout, indent=4)
+        print()
+    else:
+        with open(args.output, "w") as f:
+            json.dump(document, f, indent=4)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f)["results"], results)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+import collections, hashlib
+
+# The number of bytes of each file that are compared first. Each range after
+# that is twice as large as the one before it, up to MAX_RANGE_SIZE.
+FIRST_RANGE_SIZE = 64 << 10
+MAX_RANGE_SIZE = 4 << 20
+
+def get_content_digests(
+    file_ids,
+    size,
+    read_range,
+    map_function=map,
+    errors=()
+):
+    '''
+    Works out which of the given files have the same content. Returns a
+    dictionary that maps each file id to a digest. Two files have the same
+    digest exactly when they have the same content. The digest of a file that
+    could not be read is None.
+    
+    The content is read range by range from the start of the files. A file is
+    not read any further once its content so far differs from that of every
+    other file, so the files without a duplicate are usually only read in
+    part, and their digests only cover the part that was read.
+    
+    Arguments:
+        file_ids:
+            the ids of files that all have the given size
+        size:
+            the size of each file in bytes
+        read_range:
+            a function that takes a file id and the offsets of the first byte
+            and of the byte after the last byte of a range and returns that
+            range of the file's content as bytes
+        map_function:
+            a function like map() with which read_range is called for the
+            files that are still being compared; use the map method of a
+            thread pool to read several files at once
+        errors:
+            a tuple of the types of exceptions that read_range raises if a
+            file cannot be read (e.g. because it was deleted); such a file is
+            left out of the comparison, and the others are still compared
+    '''
+    hashers = {file_id: hashlib.sha256() for file_id in file_ids}
+    groups = [list(hashers)] if len(hashers) > 1 else []
+    start = 0
+    range_size = FIRST_RANGE_SIZE
+    while groups and start < size:
+        end = min(size, start + range_size)
+        def read(file_id):
+            # Hash each range as soon as it arrives so that only one range
+            # per thread is held in memory.
+            hasher = hashers[file_id]
+            try:
+                hasher.update(read_range(file_id, start, end))
+            except errors:
+                return None
+            return hasher.digest()
+        file_ids_to_read = [file_id for group in groups for file_id in group]
+        digests = dict(
+            zip(file_ids_to_read, map_function(read, file_ids_to_read))
+        )
+        # Split the groups by the content so far, and stop reading the files
+        # that are left on their own.
+        groups_new = []
+        for group in groups:
+            file_ids_with_digest = collections.defaultdict(list)
+            for file_id in group:
+                if digests[file_id] is None:
+                    # Stop comparing this file.
+                    hashers[file_id] = None
+                    continue
+                file_ids_with_digest[digests[file_id]].append(file_id)
+            groups_new.extend(
+                group_new for group_new in file_ids_with_digest.values()
+                if len(group_new) > 1
+            )
+        groups = groups_new
+        start = end
+        range_size = min(MAX_RANGE_SIZE, range_size * 2)
+    return {
+        file_id: hasher.digest() if hasher is not None else None
+        for file_id, hasher in hashers.items()
+    }
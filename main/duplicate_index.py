@@ -0,0 +1,229 @@
+import heapq, itertools, struct, sys, tempfile
+
+def _key_size(key):
+    # Bucket keys start with the file size, as from
+    # file_records.FileRecordStore.get_bucket_key().
+    return int.from_bytes(key[:8], "little")
+
+class DuplicateIndex:
+    def __init__(self):
+        '''
+        Groups the indices of files by bucket key and keeps running totals
+        about the groups that have at least two files. Every file is kept in
+        memory: files without a duplicate are kept in a dictionary of single
+        indices, and the others are kept in lists.
+        
+        Bucket keys are bytes objects that start with the size of the file as
+        8 little-endian bytes, as from file_records.FileRecordStore.
+        '''
+        # This is an ordered dictionary of the keys that have at least two
+        # files. It maps each key to a list of the indices of the files.
+        self._groups = {}
+        self._num_duplicate_files = 0
+        self._reclaimable_bytes = 0
+        self._singles = {}
+        self._version = 0
+    @property
+    def groups(self):
+        '''
+        A dictionary that maps each key that has at least two files to a list
+        of the indices of the files, in the order in which the groups formed.
+        It must not be modified.
+        '''
+        return self._groups
+    @property
+    def version(self):
+        '''
+        A number that changes whenever groups changes.
+        '''
+        return self._version
+    @property
+    def num_groups(self):
+        return len(self._groups)
+    @property
+    def num_duplicate_files(self):
+        return self._num_duplicate_files
+    @property
+    def reclaimable_bytes(self):
+        return self._reclaimable_bytes
+    def add(self, key, index):
+        '''
+        Adds the file with the given index under the given bucket key.
+        '''
+        group = self._groups.get(key)
+        if group is not None:
+            group.append(index)
+            self._version += 1
+            self._num_duplicate_files += 1
+            self._reclaimable_bytes += _key_size(key)
+            return
+        index_other = self._pop_single(key)
+        if index_other is None:
+            self._add_single(key, index)
+        else:
+            self._add_group(key, [index_other, index])
+    def remove(self, key, index):
+        '''
+        Removes the file with the given index, which must have been added
+        under the given bucket key.
+        '''
+        group = self._groups.get(key)
+        if group is None:
+            self._remove_single(key, index)
+            return
+        group.remove(index)
+        self._version += 1
+        if len(group) == 1:
+            del self._groups[key]
+            self._num_duplicate_files -= 2
+            self._reclaimable_bytes -= _key_size(key)
+            self._add_single(key, group[0])
+        else:
+            self._num_duplicate_files -= 1
+            self._reclaimable_bytes -= _key_size(key)
+    def merge(self):
+        '''
+        Makes sure that groups contains every group of duplicates. All of the
+        groups are always known in memory, so there is nothing to do.
+        '''
+    def _add_group(self, key, index_list):
+        self._groups[key] = index_list
+        self._version += 1
+        self._num_duplicate_files += len(index_list)
+        self._reclaimable_bytes += _key_size(key) * (len(index_list) - 1)
+    def _add_single(self, key, index):
+        self._singles[key] = index
+    def _pop_single(self, key):
+        # Returns the index of the one file with the given key, or None.
+        return self._singles.pop(key, None)
+    def _remove_single(self, key, index):
+        if self._singles.get(key) == index:
+            del self._singles[key]
+
+class SpillingDuplicateIndex(DuplicateIndex):
+    # When there are more than this many sorted runs on disk, they are merged.
+    MAX_RUNS = 16
+    # Each entry in a run is prefixed with its length in this format.
+    _LENGTH = struct.Struct("<I")
+    def __init__(self, memory_budget):
+        '''
+        Works like DuplicateIndex, but files without a known duplicate are not
+        kept in memory. They are collected in a buffer that is sorted and
+        written to a temporary file (a run) whenever it grows beyond the
+        memory budget. merge() reads the runs back in one k-way merge, moves
+        the files that share a key into groups, and writes the rest to a
+        single run again. Until then, a file whose only duplicates have been
+        written to disk is not in groups.
+        
+        Groups of duplicates always stay in memory, so files that are added
+        under the key of a known group are grouped at once.
+        
+        Arguments:
+            memory_budget:
+                the largest number of bytes that the buffer may take up
+        '''
+        super().__init__()
+        self._memory_budget = memory_budget
+        # Each entry is a bytes object that sorts by key first. See
+        # _encode_entry().
+        self._buffer = []
+        self._buffer_size = 0
+        self._runs = []
+        # These are the entries of files that were removed but may still be
+        # in the buffer or the runs. They are dropped at the next merge().
+        # Entries are used rather than indices because a file may be removed
+        # and added again under another key.
+        self._removed_entries = set()
+        # Whether there may be groups or removed files in the buffer or the
+        # runs.
+        self._dirty = False
+    @property
+    def num_runs(self):
+        return len(self._runs)
+    def merge(self):
+        '''
+        Finds the groups of duplicates among the files in the buffer and the
+        runs. Afterward, groups contains every group of duplicates, and the
+        files without a duplicate are in one run.
+        '''
+        if not self._dirty:
+            return
+        self._buffer.sort()
+        streams = [self._read_run(run) for run in self._runs]
+        streams.append(iter(self._buffer))
+        run_new = tempfile.TemporaryFile(prefix="duplicate_index-")
+        for key, entries in itertools.groupby(
+            heapq.merge(*streams),
+            key=self._decode_key
+        ):
+            entries = [
+                entry for entry in entries
+                if entry not in self._removed_entries
+            ]
+            if len(entries) > 1:
+                self._add_group(
+                    key,
+                    [self._decode_index(entry) for entry in entries]
+                )
+            elif entries:
+                self._write_entry(run_new, entries[0])
+        for run in self._runs:
+            run.close()
+        self._runs = [run_new]
+        self._buffer = []
+        self._buffer_size = 0
+        self._removed_entries.clear()
+        self._dirty = False
+    def _add_single(self, key, index):
+        entry = self._encode_entry(key, index)
+        if entry in self._removed_entries:
+            # The file was removed and added again before merge(), so the
+            # entry that is still in the buffer or the runs is kept.
+            self._removed_entries.discard(entry)
+            return
+        self._buffer.append(entry)
+        # Count the list's pointer to the entry, too.
+        self._buffer_size += sys.getsizeof(entry) + 8
+        self._dirty = True
+        if self._buffer_size > self._memory_budget:
+            self._spill()
+    def _pop_single(self, key):
+        # Files without a known duplicate are only matched by merge().
+        return None
+    def _remove_single(self, key, index):
+        self._removed_entries.add(self._encode_entry(key, index))
+        self._dirty = True
+    def _spill(self):
+        # Write the buffer to a new run.
+        self._buffer.sort()
+        run = tempfile.TemporaryFile(prefix="duplicate_index-")
+        for entry in self._buffer:
+            self._write_entry(run, entry)
+        self._runs.append(run)
+        self._buffer = []
+        self._buffer_size = 0
+        if len(self._runs) > self.MAX_RUNS:
+            self.merge()
+    @staticmethod
+    def _encode_entry(key, index):
+        # The length of the key comes first so that the entries of equal keys
+        # sort next to each other even if one key is a prefix of another.
+        return len(key).to_bytes(2, "big") + key + index.to_bytes(8, "big")
+    @staticmethod
+    def _decode_key(entry):
+        return entry[2:-8]
+    @staticmethod
+    def _decode_index(entry):
+        return int.from_bytes(entry[-8:], "big")
+    @classmethod
+    def _write_entry(cls, f, entry):
+        f.write(cls._LENGTH.pack(len(entry)))
+        f.write(entry)
+    @classmethod
+    def _read_run(cls, f):
+        f.seek(0)
+        while True:
+            length = f.read(cls._LENGTH.size)
+            if not length:
+                break
+            yield f.read(cls._LENGTH.unpack(length)[0])
@@ -0,0 +1,335 @@
+import array, base64, binascii, tempfile, threading
+from . import file_tree
+
+class _ByteBuffer:
+    # A buffer that has been written to disk is pickled in pieces of this
+    # many bytes so that pickling it does not read it all into memory.
+    PICKLE_CHUNK_SIZE = 1 << 14
+    # Reads from disk are made in blocks of this many bytes, and the last
+    # block is kept, so that reading neighboring bytes is quick.
+    READ_BLOCK_SIZE = 1 << 16
+    def __init__(self, memory_limit=None):
+        '''
+        A sequence of bytes that only grows. If memory_limit is given, the
+        bytes are written to a temporary file whenever more than that many of
+        them are in memory, and they are read back from it as needed.
+        
+        Arguments:
+            memory_limit:
+                optional; the largest number of bytes to keep in memory
+        '''
+        self._memory_limit = memory_limit
+        # The first _file_size bytes are in _file, and the rest are in _tail.
+        self._file = None
+        self._file_size = 0
+        self._tail = bytearray()
+        self._lock = threading.Lock()
+        self._block_start = None
+        self._block = b""
+    def __len__(self):
+        return self._file_size + len(self._tail)
+    def append(self, data):
+        '''
+        Adds the given bytes to the end.
+        '''
+        self._tail += data
+        if self._memory_limit is not None and \
+                len(self._tail) > self._memory_limit:
+            # Other threads may be reading.
+            with self._lock:
+                if self._file is None:
+                    self._file = tempfile.TemporaryFile(prefix="file_records-")
+                self._file.seek(self._file_size)
+                self._file.write(self._tail)
+                self._file_size += len(self._tail)
+                self._tail = bytearray()
+                # The last block that was read may have been cut short.
+                self._block_start = None
+    def extend(self, pieces):
+        for piece in pieces:
+            self.append(piece)
+    def read(self, start, end):
+        '''
+        Returns the bytes from the offset start up to the offset end.
+        '''
+        with self._lock:
+            if start >= self._file_size:
+                return bytes(
+                    self._tail[start - self._file_size:end - self._file_size]
+                )
+            result = bytearray()
+            position = start
+            while position < min(end, self._file_size):
+                block_start = position - position % self.READ_BLOCK_SIZE
+                if block_start != self._block_start:
+                    self._file.seek(block_start)
+                    self._block = self._file.read(self.READ_BLOCK_SIZE)
+                    self._block_start = block_start
+                piece = self._block[
+                    position - block_start:end - block_start
+                ]
+                result += piece
+                position += len(piece)
+            if end > self._file_size:
+                result += self._tail[:end - self._file_size]
+            return bytes(result)
+    def __reduce__(self):
+        # The pieces are passed to extend() when the buffer is unpickled.
+        return (
+            _ByteBuffer,
+            (self._memory_limit,),
+            None,
+            (
+                self.read(start, start + self.PICKLE_CHUNK_SIZE)
+                for start in range(0, len(self), self.PICKLE_CHUNK_SIZE)
+            )
+        )
+
+class _StringColumn:
+    def __init__(self, memory_limit=None):
+        '''
+        Stores many strings in one buffer. This takes much less memory than a
+        list of str objects. Only the offsets of the strings have to stay in
+        memory.
+        
+        Arguments:
+            memory_limit:
+                as for _ByteBuffer
+        '''
+        self._data = _ByteBuffer(memory_limit)
+        self._offsets = array.array("Q", (0,))
+    def __len__(self):
+        return len(self._offsets) - 1
+    def append(self, value):
+        self._data.append(value.encode("UTF-8", "surrogatepass"))
+        self._offsets.append(len(self._data))
+    def __getitem__(self, index):
+        return self._data.read(
+            self._offsets[index],
+            self._offsets[index + 1]
+        ).decode("UTF-8", "surrogatepass")
+
+class _InternColumn:
+    def __init__(self, typecode="L"):
+        '''
+        Stores many strings, most of which repeat (e.g. MIME types or parent
+        folders), as indices into a table of distinct values.
+        '''
+        self._values = []
+        self._value_to_index = {}
+        self._indices = array.array(typecode)
+    def __len__(self):
+        return len(self._indices)
+    def append(self, value):
+        index = self._value_to_index.get(value)
+        if index is None:
+            index = self._value_to_index[value] = len(self._values)
+            self._values.append(value)
+        self._indices.append(index)
+    def __getitem__(self, index):
+        return self._values[self._indices[index]]
+    def map_values(self, function):
+        '''
+        Replaces every distinct value with the result of passing it to the
+        given function. The function must not map two values to the same one.
+        '''
+        self._values = [function(value) for value in self._values]
+        self._value_to_index = {
+            value: index for index, value in enumerate(self._values)
+        }
+
+# Ways in which the API encodes hashes as text. Each item is a pair of
+# functions: one that decodes text to bytes and one that does the opposite.
+_HASH_CODECS = (
+    (bytes.fromhex, lambda digest: digest.hex().upper()),
+    (bytes.fromhex, bytes.hex),
+    (
+        lambda text: base64.b64decode(text, validate=True),
+        lambda digest: base64.b64encode(digest).decode("ASCII")
+    ),
+)
+
+class _HashColumn:
+    def __init__(self, length, memory_limit=None):
+        '''
+        Stores one type of hash for many files as fixed-width binary digests.
+        Hashes that cannot be stored in binary are kept as text on the side.
+        
+        Arguments:
+            length: the number of files that have already been stored
+            memory_limit: as for _ByteBuffer
+        '''
+        self._codec = None
+        self._width = None
+        self._data = _ByteBuffer(memory_limit)
+        # For each file, 1 if the digest is in _data and 0 otherwise.
+        self._present = bytearray(length)
+        self._text = {}
+    def append(self, text):
+        index = len(self._present)
+        digest = self._decode(text) if text is not None else None
+        if digest is None:
+            self._present.append(0)
+            if text is not None:
+                self._text[index] = text
+        else:
+            self._present.append(1)
+            self._data.append(digest)
+        if self._width is not None and digest is None:
+            self._data.append(bytes(self._width))
+    def get_digest(self, index):
+        '''
+        Returns the binary digest of the file at the given index. Returns a
+        str if the hash could not be stored in binary. Returns None if the file
+        has no hash of this type.
+        '''
+        if self._present[index]:
+            start = index * self._width
+            return self._data.read(start, start + self._width)
+        return self._text.get(index)
+    def get_text(self, index):
+        digest = self.get_digest(index)
+        if isinstance(digest, bytes):
+            return _HASH_CODECS[self._codec][1](digest)
+        return digest
+    def _decode(self, text):
+        if self._codec is None:
+            # Find the codec that this hash type uses. Remember its index
+            # rather than the codec itself so that this object can be pickled.
+            for codec_index, codec in enumerate(_HASH_CODECS):
+                try:
+                    digest = codec[0](text)
+                except (ValueError, binascii.Error):
+                    continue
+                if digest and codec[1](digest) == text:
+                    self._codec = codec_index
+                    self._width = len(digest)
+                    # Pad the digests of the files before this one.
+                    self._data.append(bytes(self._width * len(self._present)))
+                    return digest
+            return None
+        codec = _HASH_CODECS[self._codec]
+        try:
+            digest = codec[0](text)
+        except (ValueError, binascii.Error):
+            return None
+        if len(digest) != self._width or codec[1](digest) != text:
+            return None
+        return digest
+
+class FileRecordStore:
+    # If there is a memory budget, each of the buffers of the ids, names,
+    # URLs, and hashes may keep this fraction of it in memory.
+    BUFFER_SHARE = 0.2
+    def __init__(self, memory_budget=None):
+        '''
+        Stores the file_tree.File objects that a scan finds in a compact,
+        column-oriented form. Each file gets an integer index, and a full File
+        object is only built again when get() is called.
+        
+        Parent folders are interned, sizes are kept in an array, strings are
+        packed into shared buffers, and hashes are stored as binary digests.
+        
+        Arguments:
+            memory_budget:
+                optional; if given, the ids, names, URLs, and hashes of the
+                files, which take up most of the memory, are written to
+                temporary files as they grow, so that about this many bytes of
+                them stay in memory; the sizes, parent folders, and MIME types
+                and the offsets of the strings stay in memory
+        '''
+        self._buffer_limit = int(memory_budget * self.BUFFER_SHARE) \
+            if memory_budget else None
+        self._ids = _StringColumn(self._buffer_limit)
+        self._names = _StringColumn(self._buffer_limit)
+        self._urls = _StringColumn(self._buffer_limit)
+        self._sizes = array.array("Q")
+        self._parents = _InternColumn()
+        self._mime_types = _InternColumn()
+        self._hashes = {}
+    def __len__(self):
+        return len(self._sizes)
+    def add(self, file):
+        '''
+        Stores a file_tree.File object and returns its index.
+        '''
+        index = len(self._sizes)
+        self._ids.append(file.id)
+        self._names.append(file.name)
+        self._urls.append(file.url)
+        self._sizes.append(file.size)
+        self._parents.append((file.parent_id, file.parent_path))
+        self._mime_types.append(file.mime_type)
+        for hash_type in file.hashes:
+            if hash_type not in self._hashes:
+                self._hashes[hash_type] = \
+                    _HashColumn(index, self._buffer_limit)
+        for hash_type, column in self._hashes.items():
+            column.append(file.hashes.get(hash_type))
+        return index
+    def get(self, index):
+        '''
+        Returns a file_tree.File object for the file at the given index.
+        '''
+        parent_id, parent_path = self._parents[index]
+        hashes = {}
+        # Another thread may be adding a file with a new type of hash.
+        for hash_type, column in list(self._hashes.items()):
+            text = column.get_text(index)
+            if text is not None:
+                hashes[hash_type] = text
+        return file_tree.File(
+            id=self._ids[index],
+            name=self._names[index],
+            size=self._sizes[index],
+            url=self._urls[index],
+            parent_id=parent_id,
+            parent_path=parent_path,
+            mime_type=self._mime_types[index],
+            hashes=hashes
+        )
+    def get_id(self, index):
+        return self._ids[index]
+    def get_size(self, index):
+        return self._sizes[index]
+    def get_name(self, index):
+        return self._names[index]
+    def get_parent_path(self, index):
+        return self._parents[index][1]
+    def map_parent_paths(self, function):
+        '''
+        Replaces the parent path of every file with the result of passing it
+        to the given function. This is quick because parent folders are
+        interned.
+        '''
+        self._parents.map_values(
+            lambda parent: (parent[0], function(parent[1]))
+        )
+    @property
+    def hash_types(self):
+        '''
+        A list of the types of hashes that any of the files have.
+        '''
+        return list(self._hashes)
+    def get_hash(self, index, hash_type):
+        '''
+        Returns the hash of the given type of the file at the given index as
+        given by the API, or None if the file has no hash of that type.
+        '''
+        column = self._hashes.get(hash_type)
+        return column.get_text(index) if column else None
+    def get_bucket_key(self, index, hash_type):
+        '''
+        Returns a bytes object that is equal for two files exactly when they
+        have the same size and the same hash of the given type. For files
+        without that hash, the key is just the size, which is 8 bytes long.
+        '''
+        key = self._sizes[index].to_bytes(8, "little")
+        column = self._hashes.get(hash_type)
+        digest = column.get_digest(index) if column else None
+        if isinstance(digest, str):
+            # Keep text hashes apart from binary digests.
+            return key + b"\0" + digest.encode("UTF-8", "surrogatepass")
+        if digest is not None:
+            return key + digest
+        return key
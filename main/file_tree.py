@@ -1,6 +1,28 @@
-import attr, base64, collections, flask, hashlib, humanfriendly, json, \
-    multiprocessing.pool, os.path, pickle, re, tempfile, threading
-from . import app
+import attr, base64, cProfile, collections, hashlib, humanfriendly, json, \
+    multiprocessing.pool, os.path, pickle, re, tempfile, threading, time
+from . import content_verify, duplicate_index, file_records, folder_index, \
+    folder_queue, metrics, scan_scope, scan_store
+
+_STEP_SECONDS = metrics.Histogram(
+    "duplicate_finder_scan_step_seconds",
+    "The time that each step of a scan took, by what the step did.",
+    ("phase",)
+)
+_LOCK_WAIT_SECONDS = metrics.Histogram(
+    "duplicate_finder_scan_lock_wait_seconds",
+    "The time that worker threads waited for a scan's lock to add the "
+        "children of the folders that they listed.",
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+)
+_SAVE_SECONDS = metrics.Histogram(
+    "duplicate_finder_scan_save_seconds",
+    "The time that saving a scan took, by whether all of it was written.",
+    ("record_type",)
+)
+_LOAD_SECONDS = metrics.Histogram(
+    "duplicate_finder_scan_load_seconds",
+    "The time that loading a saved scan took."
+)
 
 @attr.s(frozen=True)
 class Item:
@@ -24,37 +46,112 @@ class File(Item):
 class Folder(Item):
     child_count = attr.ib(validator=attr.validators.instance_of(int))
 
+@attr.s(frozen=True)
+class Subtree:
+    # This is a folder and everything under it, as found by a scan, that is
+    # a copy of another.
+    id = attr.ib(validator=attr.validators.instance_of(str))
+    name = attr.ib(validator=attr.validators.instance_of(str))
+    size = attr.ib(validator=attr.validators.instance_of(int))
+    parent_path = attr.ib(validator=attr.validators.instance_of(str))
+    # This is the number of files under the folder, at any depth.
+    num_files = attr.ib(validator=attr.validators.instance_of(int))
+
+@attr.s(frozen=True)
+class DeletedItem:
+    # This is the id of a File or Folder that no longer exists.
+    id = attr.ib(validator=attr.validators.instance_of(str))
+
 class JSONEncoder(json.JSONEncoder):
     '''
     Helps encode the above types into JSON.
     '''
     _RE_SNAKE = re.compile("_([a-z])")
+    # This maps each of the above types to pairs of attribute names and JSON
+    # keys so that the keys only need to be converted once.
+    _keys = {}
     @staticmethod
     def _camel(match):
         return match.group(1).upper()
+    @classmethod
+    def get_keys(cls, item_type):
+        '''
+        Returns a tuple of pairs. Each pair has the name of an attribute of the
+        given subclass of Item (or Subtree) and the camel case key for it in
+        JSON.
+        '''
+        keys = cls._keys.get(item_type)
+        if keys is None:
+            keys = cls._keys[item_type] = tuple(
+                (field.name, cls._RE_SNAKE.sub(cls._camel, field.name))
+                for field in attr.fields(item_type)
+            )
+        return keys
     def default(self, obj):
-        if isinstance(obj, Item):
-            # Convert the object to a dictionary.
-            d = attr.asdict(obj)
-            # Convert from snake case to camel case.
-            keys = [
-                (key_old, self._RE_SNAKE.sub(self._camel, key_old))
-                for key_old in d
-            ]
-            for key_old, key_new in keys:
-                d[key_new] = d.pop(key_old)
-            return d
+        if isinstance(obj, (Item, Subtree)):
+            # Convert the object to a dictionary with camel case keys.
+            return {
+                key: getattr(obj, name)
+                for name, key in self.get_keys(type(obj))
+            }
         return super().default(obj)
 
 class DuplicateFileScan:
     class NoSuchSave(Exception): pass
-    def __init__(self, hash_type, child_yielder, folder_url_getter):
+    class DeltaExpired(Exception): pass
+    class ContentUnavailable(Exception): pass
+    # The ways in which get_duplicates_page() can sort groups of duplicates.
+    # Each function takes the size of each file and the number of files.
+    SORT_KEYS = {
+        "reclaimable": lambda size, count: size * (count - 1),
+        "size": lambda size, count: size,
+        "count": lambda size, count: count,
+    }
+    # This is the largest number of orders of groups that
+    # get_duplicates_page() keeps, e.g. for different sorts or filters.
+    MAX_PAGE_ORDERS = 4
+    # Scores by which folders can be ordered for listing. Each function takes
+    # a Folder object. Folders with higher scores are listed first.
+    FOLDER_SCORES = {
+        # This is the total size of everything in the folder.
+        "size": lambda folder: folder.size,
+        # This favors folders with a few large files over folders with many
+        # small ones.
+        "average_size":
+            lambda folder: folder.size / max(1, folder.child_count),
+    }
+    # The default number of threads that step() uses to make API calls.
+    NUM_THREADS = 16
+    def __init__(
+        self,
+        hash_type,
+        child_yielder,
+        folder_url_getter,
+        batch_child_yielder=None,
+        batch_size=20,
+        num_threads=NUM_THREADS,
+        delta_yielder=None,
+        memory_budget=None,
+        content_reader=None,
+        folder_score=None,
+        scope=None,
+        pool=None
+    ):
         '''
         Scans for files that have the same hash. You must call step()
-        repeatedly until complete is True. The stepped nature of the scan
-        allows the scan to be saved via the save() method and resumed later via
-        the load() method. After initializing the object, call add_folder_url()
-        to add the first folder to scan.
+        repeatedly until complete is True, and then call close() to stop the
+        worker threads. The stepped nature of the scan allows the scan to be
+        saved via the save() method and resumed later via the load() method.
+        Each save only writes what was discovered since the previous save.
+        After initializing the object, call add_folder_url() to add the first
+        folder to scan.
+        
+        To be able to bring the results up to date later with rescan(), pass
+        delta_yielder and call set_delta_link() before the scan starts.
+        Alternatively, to list the whole drive in flat pages from the delta
+        feed instead of folder by folder, pass delta_yielder and call
+        add_delta_url() instead of add_folder_url(). The delta link that the
+        last page gives is then kept for rescan().
         
         Arguments:
             hash_type:
@@ -64,23 +161,160 @@ class DuplicateFileScan:
                 a callback function:
                     Arguments:
                         1. a folder URL
-                        2. this object's add_folder_url method
+                        2. a function to call with the URL of the next page
+                           of a folder, if there is one
                     Returns:
                         generator of Folder and File objects that represent the
                         specified folder's children
             folder_url_getter:
                 a function that, given the id attribute from a Folder object,
                 returns a full URL that will be passed to child_yielder
+            batch_child_yielder:
+                optional; if given, it is used instead of child_yielder to list
+                several folders with one call:
+                    Arguments:
+                        1. a list of folder URLs
+                        2. a function to call with the URL of the next page
+                           of a folder, if there is one
+                    Returns:
+                        generator of Folder and File objects that represent the
+                        children of all the specified folders
+            batch_size:
+                the largest number of folder URLs to pass to
+                batch_child_yielder at once
+            num_threads:
+                the number of threads that step() uses, or the number of
+                pieces of work that it gives the pool at once; the callbacks
+                above may limit how many of them make API calls at once
+            delta_yielder:
+                optional; a callback function that lists changes to the drive
+                for rescan() and add_delta_url():
+                    Arguments:
+                        1. a delta URL
+                        2. a function to call with the URL of the next page of
+                           changes, if there is one
+                        3. this object's set_delta_link method, to call with
+                           the URL for the next rescan after the last page
+                    Returns:
+                        generator of Folder, File, and DeletedItem objects
+                        that represent the changed items; folders and files
+                        may have an empty parent_path if it is unknown
+                    Raises:
+                        DeltaExpired if the delta URL can no longer be used
+            memory_budget:
+                optional; if given, files without a known duplicate are
+                written to disk whenever they take up more than this many
+                bytes, and the groups of duplicates among them are only found
+                when the scan becomes complete or when enough of them have
+                been written; the ids, names, URLs, and hashes of all the
+                files are written to disk as well, as described in
+                file_records.FileRecordStore
+            content_reader:
+                optional; if given, files that are only grouped by size
+                because they have no hash of hash_type are compared by their
+                content before the scan is complete:
+                    Arguments:
+                        1. the id attribute from a File object
+                        2. the offset of the first byte to read
+                        3. the offset of the byte after the last byte to read
+                    Returns:
+                        the bytes in that range of the file's content
+                    Raises:
+                        ContentUnavailable if the file cannot be read (e.g.
+                        because it was deleted or is not shared anymore);
+                        the file is then left out of its group
+            folder_score:
+                optional; a function that takes a Folder object and returns
+                a number (e.g. a value of FOLDER_SCORES); if given, the
+                folders with the highest scores are listed first so that
+                large duplicates are found early, and otherwise folders are
+                listed in the order in which they are found
+            scope:
+                optional; a scan_scope.ScanScope object that limits which
+                files are added to the scan; the files outside it are only
+                counted, and the folders that cannot contain files in it are
+                not listed
+            pool:
+                optional; a scheduler.TenantPool in which to do the work of
+                step(), shared with other scans; by default, the scan starts
+                its own pool of num_threads threads
         '''
         self._lock = threading.Lock()
         self._child_yielder = child_yielder
+        self._batch_child_yielder = batch_child_yielder
+        self._batch_size = batch_size
+        self._num_threads = num_threads
+        self._pool = None
+        self._shared_pool = pool
         self._folder_url_getter = folder_url_getter
+        self._delta_yielder = delta_yielder
+        self._content_reader = content_reader
+        self._folder_score = folder_score
+        self._scope = scope if scope is not None else scan_scope.ScanScope()
         self._hash_type = hash_type
         self._num_discovered_folders = 0
+        self._num_skipped_files = 0
         self._num_scanned_files = 0
         self._total_bytes_scanned_files = 0
-        self._folder_urls_to_scan = collections.deque()
-        self._files_with_hash = collections.defaultdict(list)
+        # Each entry in this queue is a tuple of a folder URL and its score,
+        # which is None if there is no score.
+        if folder_score is not None:
+            self._folder_urls_to_scan = folder_queue.PriorityFolderQueue()
+        else:
+            self._folder_urls_to_scan = folder_queue.FolderQueue()
+        # This counts the entries that were taken from the queue and are
+        # being listed.
+        self._folder_entries_in_flight = collections.Counter()
+        # The files are kept in _records. _duplicates groups the indices of
+        # the files by their bucket keys.
+        self._records = file_records.FileRecordStore(memory_budget)
+        if memory_budget:
+            self._duplicates = \
+                duplicate_index.SpillingDuplicateIndex(memory_budget)
+        else:
+            self._duplicates = duplicate_index.DuplicateIndex()
+        # Files without a hash are grouped by size alone until their content
+        # has been compared. Then they are grouped by the bucket keys in this
+        # dictionary, which maps sizes to dictionaries that map indices in
+        # _records to keys.
+        self._content_keys = {}
+        # Whether there may be groups that are only grouped by size.
+        self._needs_verification = False
+        # Files that were removed stay in _records but are not indexed.
+        self._removed_records = set()
+        # This maps file ids to indices in _records. It is only built when it
+        # is first needed.
+        self._index_by_id = None
+        # This maps folder ids to folder paths. Items from the delta feed have
+        # no paths, so they are looked up here by their parents' ids.
+        self._folder_paths = {}
+        # These are the paths of the folders that have files or subfolders
+        # that the scope left out, so their content is not fully known.
+        self._incomplete_paths = set()
+        # This is a folder_index.FolderDuplicateIndex of the complete scan.
+        # It is only built when it is first needed, and any change to the
+        # scan drops it.
+        self._folder_duplicates = None
+        # This maps the arguments of get_duplicates_page() other than the
+        # page to the state of the groups that the order was found for and to
+        # the keys of the matching groups in order. Any change to the scan
+        # drops the orders.
+        self._page_orders = {}
+        # This is the URL with which to list the changes since the scan
+        # started, and the URLs of the pages of changes still to be listed.
+        self._delta_link = None
+        self._delta_urls_to_scan = collections.deque()
+        # These hold what has changed since the last save. The operations are
+        # tuples that are passed to _apply().
+        self._journal = None
+        self._unsaved_operations = []
+        # A scan that was loaded read-only keeps the journal from which it
+        # was loaded and the counts of the queued folder entries, so that it
+        # can read the checkpoints that are saved later.
+        self._journal_read = None
+        self._folder_url_counts = None
+        self._unsaved_folder_urls_added = []
+        self._unsaved_folder_urls_done = []
     def add_folder_url(self, folder_url):
         '''
         Adds a folder to the scan.
@@ -90,7 +324,61 @@ class DuplicateFileScan:
                 a URL that can be passed to child_yielder
         '''
         with self._lock:
-            self._folder_urls_to_scan.append(folder_url)
+            # Folders that are added this way (e.g. the next page of a folder
+            # that is being listed) have no score, so they are listed first.
+            self._folder_urls_to_scan.append((folder_url, None))
+            self._unsaved_folder_urls_added.append((folder_url, None))
+    def add_delta_url(self, delta_url):
+        '''
+        Adds a page of the delta feed to the scan. The pages are listed in
+        the order in which they are added, before any folders.
+        
+        Arguments:
+            delta_url:
+                a URL that can be passed to delta_yielder
+        '''
+        with self._lock:
+            self._delta_urls_to_scan.append(delta_url)
+    def set_delta_link(self, delta_link):
+        '''
+        Sets the URL that delta_yielder will be given to list the changes to
+        the drive since the URL was obtained. Call this before the scan starts
+        so that changes during the scan are picked up by rescan().
+        '''
+        with self._lock:
+            self._delta_link = delta_link
+    def rescan(self):
+        '''
+        Starts to bring a complete scan up to date by listing only the changes
+        since the delta link was set. Call step() repeatedly until complete is
+        True again. Returns False, and does nothing, if the scan is not
+        complete or there is no delta link.
+        '''
+        with self._lock:
+            if not self._can_rescan():
+                return False
+            self._delta_urls_to_scan.append(self._delta_link)
+            return True
+    def resync(self, delta_url):
+        '''
+        Starts the scan over after DeltaExpired was raised: drops every file
+        and folder, and lists the whole drive again from the delta feed. The
+        last page of the feed sets a new delta link. Call step() repeatedly
+        until complete is True again.
+        
+        Arguments:
+            delta_url:
+                the URL that delta_yielder will be given to list every item in
+                the drive
+        '''
+        with self._lock:
+            # Every path starts with "/", so this removes everything.
+            self._apply(("remove_folder", ""))
+            self._num_discovered_folders = 0
+            self._num_skipped_files = 0
+            self._delta_link = None
+            self._delta_urls_to_scan.clear()
+            self._delta_urls_to_scan.append(delta_url)
     def save(self, token):
         '''
         Saves the current scan for retrieval later. Note that child_yielder
@@ -99,24 +387,60 @@ class DuplicateFileScan:
         Arguments:
             token: a unique token for this scan
         '''
-        # Stash some members temporarily.
-        child_yielder = self._child_yielder
-        self._child_yielder = None
-        folder_url_getter = self._folder_url_getter
-        self._folder_url_getter = None
-        lock = self._lock
-        self._lock = None
-        # Save the pickle.
-        with open(self._token_to_filename(token), "wb") as f:
-            pickle.dump(self, f)
-        # Restore the members.
-        self._child_yielder = child_yielder
-        self._folder_url_getter = folder_url_getter
-        self._lock = lock
+        time_start = time.perf_counter()
+        journal = scan_store.ScanJournal(self._token_to_filename(token))
+        with self._lock:
+            if self._journal is None or \
+                    self._journal.filename != journal.filename or \
+                    self._journal.needs_compaction():
+                # Write everything.
+                record_type = "snapshot"
+                self._journal = journal
+                self._journal.write_snapshot(self._get_snapshot_record())
+            else:
+                # Write only what has changed since the last save.
+                record_type = "checkpoint"
+                self._journal.append((
+                    "checkpoint",
+                    {
+                        "operations": [
+                            # Files are saved as File objects, not indices.
+                            ("add_file", self._records.get(operation[1]))
+                            if operation[0] == "add_file" else operation
+                            for operation in self._unsaved_operations
+                        ],
+                        "folder_urls_added": self._unsaved_folder_urls_added,
+                        "folder_urls_done": self._unsaved_folder_urls_done,
+                        "num_discovered_folders":
+                            self._num_discovered_folders,
+                        "num_skipped_files": self._num_skipped_files,
+                        "delta_link": self._delta_link,
+                        "delta_urls_to_scan": list(self._delta_urls_to_scan),
+                    }
+                ))
+            self._unsaved_operations = []
+            self._unsaved_folder_urls_added = []
+            self._unsaved_folder_urls_done = []
+        _SAVE_SECONDS.observe(
+            time.perf_counter() - time_start,
+            record_type=record_type
+        )
     @classmethod
-    def load(cls, token, child_yielder, folder_url_getter):
+    def load(
+        cls,
+        token,
+        child_yielder,
+        folder_url_getter,
+        read_only=False,
+        **kwargs
+    ):
         '''
-        Retrieves a scan that was saved via the save() method.
+        Retrieves a scan that was saved via the save() method. The snapshot
+        and every checkpoint after it are read, since each file has to be
+        indexed to find its duplicates anyway. Saves rewrite the snapshot
+        before the checkpoints grow much larger than it, so this takes at
+        most a few times as long as reading the snapshot. A read-only scan
+        can then be kept up to date with load_appended().
         
         Arguments:
             token:
@@ -127,17 +451,105 @@ class DuplicateFileScan:
             folder_url_getter:
                 the same function that was passed as folder_url_getter to
                 __init__()
+            read_only:
+                if True, the saved scan is left exactly as it is, because
+                another process may be saving it; the result must then not
+                be saved or advanced
+            kwargs:
+                the same keyword arguments that were passed to __init__()
         '''
+        time_start = time.perf_counter()
+        journal = scan_store.ScanJournal(cls._token_to_filename(token))
+        self = None
+        # Map each folder URL and score to scan to the number of times that it
+        # is in the queue. A URL can be queued again if listing it has to be
+        # retried.
+        folder_urls_to_scan = collections.Counter()
         try:
-            f = open(cls._token_to_filename(token), "rb")
+            for record_type, record in journal.read(not read_only):
+                if record_type == "snapshot":
+                    self = cls(
+                        record["hash_type"],
+                        child_yielder,
+                        folder_url_getter,
+                        **kwargs
+                    )
+                if self is not None:
+                    self._load_record(record_type, record, folder_urls_to_scan)
         except FileNotFoundError:
             raise cls.NoSuchSave
-        with f:
-            self = pickle.load(f)
-        self._child_yielder = child_yielder
-        self._folder_url_getter = folder_url_getter
-        self._lock = threading.Lock()
+        if self is None:
+            raise cls.NoSuchSave
+        self._folder_urls_to_scan.extend(folder_urls_to_scan.elements())
+        if read_only:
+            # Keep what is needed to read later checkpoints.
+            self._journal_read = journal
+            self._folder_url_counts = folder_urls_to_scan
+        else:
+            self._journal = journal
+        if not self._folder_urls_to_scan and not self._delta_urls_to_scan:
+            self._duplicates.merge()
+        _LOAD_SECONDS.observe(time.perf_counter() - time_start)
         return self
+    def load_appended(self):
+        '''
+        Brings a scan that was loaded with read_only=True up to date with the
+        checkpoints that were saved since, without reading the whole save
+        again. Returns False, and does nothing, if that is not possible
+        because the save was deleted or a new snapshot replaced it; call
+        load() again instead in that case.
+        '''
+        if self._journal_read is None:
+            return False
+        time_start = time.perf_counter()
+        try:
+            records = list(self._journal_read.read_appended())
+        except (FileNotFoundError, scan_store.ScanJournal.Replaced):
+            return False
+        with self._lock:
+            for record_type, record in records:
+                self._load_record(
+                    record_type,
+                    record,
+                    self._folder_url_counts
+                )
+            # Queue the folders again from their counts.
+            self._folder_urls_to_scan = type(self._folder_urls_to_scan)()
+            self._folder_urls_to_scan.extend(
+                self._folder_url_counts.elements()
+            )
+            if not self._folder_urls_to_scan and \
+                    not self._delta_urls_to_scan:
+                self._duplicates.merge()
+        _LOAD_SECONDS.observe(time.perf_counter() - time_start)
+        return True
+    @classmethod
+    def delete_save(cls, token):
+        '''
+        Deletes a scan that was saved via the save() method, if it exists.
+        
+        Arguments:
+            token: the unique token that was passed to save()
+        '''
+        scan_store.ScanJournal(cls._token_to_filename(token)).delete()
+    @classmethod
+    def get_save_filename(cls, token, extension=".journal"):
+        '''
+        Returns the path to the file in which the scan with the given token is
+        saved. With another extension, returns the path to a file next to it
+        (e.g. for a lock on the scan).
+        '''
+        return cls._token_to_filename(token, extension)
+    @staticmethod
+    def token_to_key(token):
+        '''
+        Returns a string that uniquely identifies the given token. The token
+        itself does not need to be hashable.
+        '''
+        hash = hashlib.sha256()
+        hash.update(pickle.dumps(token))
+        return \
+            base64.b32encode(hash.digest()).decode("UTF-8").replace("=", "_")
     @property
     def hash_type(self):
         return self._hash_type
@@ -148,49 +560,344 @@ class DuplicateFileScan:
     def num_discovered_folders(self):
         return self._num_discovered_folders
     @property
+    def num_skipped_files(self):
+        '''
+        The number of files that were listed but left out of the scan because
+        they are outside its scope.
+        '''
+        return self._num_skipped_files
+    @property
     def total_bytes_scanned_files(self):
         return self._total_bytes_scanned_files
     @property
+    def num_duplicate_groups(self):
+        return self._duplicates.num_groups
+    @property
+    def num_duplicate_files(self):
+        '''
+        The number of files that have at least one duplicate.
+        '''
+        return self._duplicates.num_duplicate_files
+    @property
+    def reclaimable_bytes(self):
+        '''
+        The number of bytes that would be freed if only one file from each
+        group of duplicates were kept.
+        '''
+        return self._duplicates.reclaimable_bytes
+    @property
+    def num_queued_folders(self):
+        '''
+        The number of folder URLs that are waiting to be listed.
+        '''
+        return len(self._folder_urls_to_scan)
+    @property
     def complete(self):
-        return len(self._folder_urls_to_scan) == 0
-    def step(self):
+        return not self._folder_urls_to_scan and \
+            not self._delta_urls_to_scan and \
+            not self._needs_verification
+    @property
+    def can_rescan(self):
+        '''
+        Whether rescan() can be called now.
+        '''
+        with self._lock:
+            return self._can_rescan()
+    @property
+    def rescanning(self):
+        '''
+        Whether changes from the delta feed are being applied to a scan that
+        was complete.
+        '''
+        # While the whole drive is listed from the delta feed, there is no
+        # delta link until the last page.
+        return bool(self._delta_urls_to_scan) and \
+            self._delta_link is not None
+    @property
+    def queue_position(self):
+        '''
+        If the scan has work waiting in a shared pool, the number of other
+        scans that will get a worker thread first. Otherwise, None.
+        '''
+        if self._shared_pool is None:
+            return None
+        return self._shared_pool.queue_position
+    @property
+    def verifying(self):
+        '''
+        Whether the content of files without a hash is being compared.
+        '''
+        return self._needs_verification and \
+            not self._folder_urls_to_scan and \
+            not self._delta_urls_to_scan
+    def step(self, profiles=None):
         '''
         Performs a step in the scan. The amount of work that is done in one
         step is not specified. If complete is True, nothing will be done.
+        
+        Arguments:
+            profiles:
+                if this is a list, the step is profiled, and a
+                cProfile.Profile object is appended to it for each thread
+                that did part of the step; pass them to pstats.Stats() to
+                see where the time went
         '''
-        session_pickle = pickle.dumps(dict(flask.session))
-        def process_next_folder():
-            with app.test_request_context():
-                flask.session.update(pickle.loads(session_pickle))
-                # Process the next folder in the queue.
-                try:
-                    with self._lock:
-                        next_id = self._folder_urls_to_scan.popleft()
-                except IndexError:
-                    return True
-                self._process_folder_children(
-                    self._child_yielder(next_id, self.add_folder_url)
-                )
-                return False
-        with multiprocessing.pool.ThreadPool(16) as pool:
-            # Process 32 folders.
+        def run(function):
+            if profiles is None:
+                return function()
+            profile = cProfile.Profile()
+            profiles.append(profile)
+            return profile.runcall(function)
+        time_start = time.perf_counter()
+        phase = None
+        # Pages of changes must be applied in order, so list them one at a
+        # time, but in the pool so that the API call counts against the
+        # limits of a shared pool.
+        if self._delta_urls_to_scan:
+            phase = "delta"
+            self._get_pool().apply_async(
+                run,
+                (self._process_next_delta_page,)
+            ).get()
+        elif self._folder_urls_to_scan:
+            phase = "folders"
+            # Process two folders or batches of folders per thread.
+            pool = self._get_pool()
             workers = [
-                pool.apply_async(process_next_folder, ())
-                for _ in range(32)
+                pool.apply_async(run, (self._process_next_folders,))
+                for _ in range(self._num_threads * 2)
             ]
-            # Wait for them to finish.
+            # Wait for all of them to finish, even if one of them failed, so
+            # that no folder is still being listed when this returns.
+            errors = []
             for worker in workers:
-                worker.get()
-    def get_duplicates(self):
+                try:
+                    worker.get()
+                except Exception as e:
+                    errors.append(e)
+            if errors:
+                raise errors[0]
+        elif self._needs_verification:
+            phase = "verify"
+            run(self._verify_next_group)
+        # Find the groups of duplicates that were written to disk before any
+        # of them are verified.
+        if not self._folder_urls_to_scan and not self._delta_urls_to_scan:
+            with self._lock:
+                run(self._duplicates.merge)
+        if phase is not None:
+            _STEP_SECONDS.observe(
+                time.perf_counter() - time_start,
+                phase=phase
+            )
+    def close(self):
+        '''
+        Stops the worker threads that step() started. If step() is called
+        again, new ones are started.
+        '''
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+    def get_duplicates(self, collapse_folders=False):
         '''
         Yields lists of File objects. In each list, all the File objects have
         the same hash. Until complete is True, these results will be
         incomplete.
+        
+        Arguments:
+            collapse_folders:
+                whether to leave out the groups that are only copies of files
+                in folders from get_duplicate_folders(), one in each
         '''
-        # Only yield groups that have more than one member.
-        for file_list in self._files_with_hash.values():
-            if len(file_list) >= 2:
-                yield file_list
+        # Only yield groups that have more than one member. Copy them while
+        # holding the lock because the scan may be running in another thread.
+        with self._lock:
+            folder_duplicates = \
+                self._get_folder_duplicates() if collapse_folders else None
+            index_lists = [
+                list(index_list)
+                for index_list in self._duplicates.groups.values()
+                if folder_duplicates is None or
+                    not self._is_collapsed(index_list, folder_duplicates)
+            ]
+        for index_list in index_lists:
+            yield [self._records.get(index) for index in index_list]
+    def get_duplicates_page(
+        self,
+        offset,
+        limit,
+        sort="reclaimable",
+        path_filter=None,
+        collapse_folders=False
+    ):
+        '''
+        Returns one page of the groups of duplicates as a tuple of two items:
+            1. the number of groups that match path_filter
+            2. a list of up to limit lists of File objects, as in
+               get_duplicates()
+        Only the groups on the page are converted to File objects. The order
+        of the matching groups is kept for the next pages until the scan
+        changes.
+        
+        Arguments:
+            offset:
+                the number of matching groups to skip
+            limit:
+                the largest number of groups to return
+            sort:
+                a key of SORT_KEYS; the groups are sorted in descending order
+            path_filter:
+                if given, only groups in which the path of at least one file
+                contains this string (ignoring case) are included
+            collapse_folders:
+                as in get_duplicates()
+        '''
+        sort_key = self.SORT_KEYS[sort]
+        if path_filter:
+            path_filter = path_filter.casefold()
+        def matches(index_list):
+            return any(
+                path_filter in "{}/{}".format(
+                    self._records.get_parent_path(index),
+                    self._records.get_name(index)
+                ).casefold()
+                for index in index_list
+            )
+        with self._lock:
+            order_key = (sort, path_filter or None, bool(collapse_folders))
+            # Folders are only collapsed once the scan is complete.
+            version = (self._duplicates.version, self.complete)
+            version_order, order = \
+                self._page_orders.get(order_key, (None, None))
+            if version_order != version:
+                folder_duplicates = self._get_folder_duplicates() \
+                    if collapse_folders else None
+                candidates = [
+                    (
+                        sort_key(
+                            self._records.get_size(index_list[0]),
+                            len(index_list)
+                        ),
+                        key
+                    )
+                    for key, index_list in self._duplicates.groups.items()
+                    if (not path_filter or matches(index_list)) and (
+                        folder_duplicates is None or
+                        not self._is_collapsed(index_list, folder_duplicates)
+                    )
+                ]
+                candidates.sort(reverse=True)
+                order = [key for _, key in candidates]
+                # Keep the most recently found orders.
+                self._page_orders.pop(order_key, None)
+                while len(self._page_orders) >= self.MAX_PAGE_ORDERS:
+                    del self._page_orders[next(iter(self._page_orders))]
+                self._page_orders[order_key] = (version, order)
+            # The page is small, so its File objects are made while holding
+            # the lock, when the scan cannot be changing the records.
+            groups = [
+                [
+                    self._records.get(index)
+                    for index in self._duplicates.groups[key]
+                ]
+                for key in order[offset:offset + limit]
+            ]
+        return len(order), groups
+    def get_duplicate_indices(self, content_known_only=False):
+        '''
+        Returns a list of lists of the indices of files that can be passed to
+        get_file(). There is one list for each list from get_duplicates().
+        
+        Arguments:
+            content_known_only:
+                whether to leave out the groups of files that only have their
+                size in common, i.e. that have no hash and whose content was
+                not compared
+        '''
+        with self._lock:
+            return [
+                list(index_list)
+                for key, index_list in self._duplicates.groups.items()
+                if not content_known_only or len(key) > 8
+            ]
+    def get_hash_keys(self):
+        '''
+        Returns a sorted list of pairs of a key and the index of a file. There
+        is a pair for each type of hash that each file has. A key starts with
+        the size of the file as 8 big-endian bytes, so the keys sort by size,
+        and then has the hash type and the hash. Two files, even from scans of
+        different drives, have equal keys exactly when they have the same size
+        and the same hash of the same type.
+        '''
+        keys = []
+        with self._lock:
+            for hash_type in self._records.hash_types:
+                prefix = hash_type.encode("UTF-8") + b"\0"
+                for index in range(len(self._records)):
+                    if index in self._removed_records:
+                        continue
+                    hash = self._records.get_hash(index, hash_type)
+                    if hash is not None:
+                        keys.append((
+                            self._records.get_size(index).to_bytes(8, "big") +
+                            prefix + hash.encode("UTF-8", "surrogatepass"),
+                            index
+                        ))
+        keys.sort()
+        return keys
+    def get_file(self, index):
+        '''
+        Returns the File object for the file with the given index.
+        '''
+        return self._records.get(index)
+    def get_duplicate_folders(self, path_filter=None):
+        '''
+        Returns a list of lists of Subtree objects. In each list, the folders
+        have the same files in the same structure, although the names may
+        differ, so each is a copy of the others. Folders in the same place
+        under folders that were copied are left out. The lists are sorted by
+        the number of bytes that would be freed by keeping one folder from
+        each. Until complete is True, the list is empty.
+        
+        Arguments:
+            path_filter:
+                as in get_duplicates_page()
+        '''
+        with self._lock:
+            folder_duplicates = self._get_folder_duplicates()
+            if folder_duplicates is None:
+                return []
+            groups = [
+                [
+                    Subtree(
+                        folder_duplicates.get_folder_id(path),
+                        path.rpartition("/")[2],
+                        folder_duplicates.get_size(path),
+                        path.rpartition("/")[0],
+                        folder_duplicates.get_num_files(path)
+                    )
+                    for path in paths
+                ]
+                for paths in folder_duplicates.groups
+            ]
+        if path_filter:
+            path_filter = path_filter.casefold()
+            groups = [
+                subtrees for subtrees in groups
+                if any(
+                    path_filter in "{}/{}".format(
+                        subtree.parent_path,
+                        subtree.name
+                    ).casefold()
+                    for subtree in subtrees
+                )
+            ]
+        groups.sort(
+            key=lambda subtrees: subtrees[0].size * (len(subtrees) - 1),
+            reverse=True
+        )
+        return groups
     def __str__(self):
         return "Duplicate File Scan using {!r} ({}): " \
             "{} folders discovered, {} files scanned totaling {}".format(
@@ -203,42 +910,504 @@ class DuplicateFileScan:
                     binary=True
                 )
             )
-    def _process_file(self, file):
+    def _get_snapshot_record(self):
+        # The lock must be held.
+        return (
+            "snapshot",
+            {
+                "hash_type": self._hash_type,
+                "records": self._records,
+                "removed_records": sorted(self._removed_records),
+                "content_keys": self._content_keys,
+                "folder_paths": self._folder_paths,
+                "incomplete_paths": sorted(self._incomplete_paths),
+                # Folders that are being listed are not done yet.
+                "folder_urls_to_scan": list(self._folder_urls_to_scan) +
+                    list(self._folder_entries_in_flight.elements()),
+                "num_discovered_folders": self._num_discovered_folders,
+                "num_skipped_files": self._num_skipped_files,
+                "delta_link": self._delta_link,
+                "delta_urls_to_scan": list(self._delta_urls_to_scan),
+            }
+        )
+    def _load_record(self, record_type, record, folder_urls_to_scan):
+        '''
+        Applies one record from the journal to a scan that is being loaded.
+        The snapshot replaces the files and folders, and each checkpoint
+        applies the operations that followed it.
+        
+        Arguments:
+            record_type:
+                "snapshot" or "checkpoint"; other records are ignored
+            record:
+                the record
+            folder_urls_to_scan:
+                a collections.Counter of the queued folder entries, which
+                the record updates
+        '''
+        if record_type == "snapshot":
+            folder_urls_to_scan.update(record["folder_urls_to_scan"])
+            self._records = record["records"]
+            self._removed_records = set(record["removed_records"])
+            self._content_keys = record["content_keys"]
+            for index in range(len(self._records)):
+                if index not in self._removed_records:
+                    self._index_record(index)
+            self._folder_paths = record["folder_paths"]
+            self._incomplete_paths = set(record["incomplete_paths"])
+        elif record_type == "checkpoint":
+            folder_urls_to_scan.update(record["folder_urls_added"])
+            folder_urls_to_scan.subtract(record["folder_urls_done"])
+            for operation in record["operations"]:
+                self._apply(operation, False)
+        else:
+            return
+        self._num_discovered_folders = record["num_discovered_folders"]
+        self._num_skipped_files = record["num_skipped_files"]
+        self._delta_link = record["delta_link"]
+        self._delta_urls_to_scan = \
+            collections.deque(record["delta_urls_to_scan"])
+    def _can_rescan(self):
+        # The lock must be held.
+        return self._delta_link is not None and \
+            self._delta_yielder is not None and \
+            not self._folder_urls_to_scan and \
+            not self._delta_urls_to_scan
+    def _apply(self, operation, journal=True):
+        '''
+        Changes the files and folders in the scan. The lock must be held.
+        
+        Arguments:
+            operation:
+                a tuple, the first item of which is one of these:
+                    "add_file":
+                        adds the File that is the second item, unless a file
+                        with its id is known to be in the scan already
+                    "remove_file":
+                        removes the file whose id is the second item
+                    "set_folder_path":
+                        sets the path of the folder whose id is the second item
+                        to the third item
+                    "move_folder":
+                        changes the path of every folder and file under the
+                        path in the second item to be under the third item
+                    "set_content_keys":
+                        groups the files of the size in the second item by
+                        the content digests in the third item, which is a
+                        dictionary that maps file ids to digests; a file
+                        whose digest is None could not be read, so it is
+                        put in a group of its own
+                    "remove_folder":
+                        removes every folder and file under the paths in the
+                        other items, all in one pass
+                    "mark_incomplete":
+                        records that the folder with the path in the second
+                        item has a file or subfolder that the scope left out
+            journal:
+                whether to write the operation at the next save()
+        '''
+        name = operation[0]
+        self._folder_duplicates = None
+        self._page_orders.clear()
+        if name == "add_file":
+            if self._index_by_id is not None and \
+                    operation[1].id in self._index_by_id:
+                # The file was listed already (e.g. under another folder of
+                # the scope), so do not count it twice.
+                return
+            index = self._records.add(operation[1])
+            self._index_record(index)
+            if self._index_by_id is not None:
+                self._index_by_id[operation[1].id] = index
+            # Save the index to avoid keeping the File object.
+            operation = ("add_file", index)
+        elif name == "remove_file":
+            index = self._get_index_by_id().pop(operation[1], None)
+            if index is None:
+                return
+            self._unindex_record(index)
+            self._removed_records.add(index)
+            content_keys = \
+                self._content_keys.get(self._records.get_size(index))
+            if content_keys:
+                content_keys.pop(index, None)
+        elif name == "set_folder_path":
+            if self._folder_paths.get(operation[1]) == operation[2]:
+                return
+            self._folder_paths[operation[1]] = operation[2]
+        elif name == "move_folder":
+            path_old, path_new = operation[1:]
+            def move(path):
+                if path == path_old or path.startswith(path_old + "/"):
+                    return path_new + path[len(path_old):]
+                return path
+            self._records.map_parent_paths(move)
+            for folder_id, path in self._folder_paths.items():
+                self._folder_paths[folder_id] = move(path)
+            self._incomplete_paths = set(map(move, self._incomplete_paths))
+        elif name == "set_content_keys":
+            size, digests = operation[1:]
+            index_by_id = self._get_index_by_id()
+            content_keys = self._content_keys.setdefault(size, {})
+            for file_id, digest in digests.items():
+                index = index_by_id.get(file_id)
+                if index is None:
+                    continue
+                self._unindex_record(index)
+                if digest is None:
+                    # Give a file that could not be read a key that no other
+                    # file has.
+                    content_keys[index] = size.to_bytes(8, "little") + \
+                        b"\2" + file_id.encode("UTF-8", "surrogatepass")
+                else:
+                    # Keep content digests apart from binary and text hashes.
+                    content_keys[index] = \
+                        size.to_bytes(8, "little") + b"\1" + digest
+                self._index_record(index)
+        elif name == "remove_folder":
+            paths = set(operation[1:])
+            def is_removed(path_other):
+                # Look the path and those of its parents up.
+                while path_other not in paths:
+                    cut = path_other.rfind("/")
+                    if cut < 0:
+                        return False
+                    path_other = path_other[:cut]
+                return True
+            for folder_id in [
+                folder_id
+                for folder_id, path_other in self._folder_paths.items()
+                if is_removed(path_other)
+            ]:
+                del self._folder_paths[folder_id]
+            self._incomplete_paths = set(
+                path_other for path_other in self._incomplete_paths
+                if not is_removed(path_other)
+            )
+            for file_id in [
+                file_id
+                for file_id, index in self._get_index_by_id().items()
+                if is_removed(self._records.get_parent_path(index))
+            ]:
+                self._apply(("remove_file", file_id), False)
+        elif name == "mark_incomplete":
+            if operation[1] in self._incomplete_paths:
+                return
+            self._incomplete_paths.add(operation[1])
+        else:
+            raise ValueError("Unknown operation", name)
+        if journal:
+            self._unsaved_operations.append(operation)
+    def _get_index_by_id(self):
+        # The lock must be held.
+        if self._index_by_id is None:
+            self._index_by_id = {
+                self._records.get_id(index): index
+                for index in range(len(self._records))
+                if index not in self._removed_records
+            }
+        return self._index_by_id
+    def _get_folder_duplicates(self):
+        # Folders can only be compared once all of them have been listed. The
+        # lock must be held.
+        if not self.complete:
+            return None
+        if self._folder_duplicates is None:
+            self._folder_duplicates = folder_index.FolderDuplicateIndex(
+                self._folder_paths,
+                self._incomplete_paths,
+                (
+                    (
+                        self._records.get_parent_path(index),
+                        self._get_content_key(index),
+                        self._records.get_size(index)
+                    )
+                    for index in range(len(self._records))
+                    if index not in self._removed_records
+                )
+            )
+        return self._folder_duplicates
+    def _get_content_key(self, index):
+        # Returns the bucket key of the file unless it only has its size. The
+        # lock must be held.
+        key = self._get_bucket_key(index)
+        return key if len(key) > 8 else None
+    def _is_collapsed(self, index_list, folder_duplicates):
+        # The lock must be held.
+        return folder_duplicates.covers(
+            [self._records.get_parent_path(index) for index in index_list]
+        )
+    def _get_bucket_key(self, index):
+        # The lock must be held.
+        size = self._records.get_size(index)
+        content_keys = self._content_keys.get(size)
+        if content_keys and index in content_keys:
+            return content_keys[index]
+        return self._records.get_bucket_key(index, self._hash_type)
+    def _index_record(self, index):
+        # The lock must be held.
+        size = self._records.get_size(index)
+        self._num_scanned_files += 1
+        self._total_bytes_scanned_files += size
+        # Group this file with the files with the same hash. Include the file
+        # size in the hash to reduce the chance of a collision.
+        key = self._get_bucket_key(index)
+        self._duplicates.add(key, index)
+        # A file that has only its size for a key has to be compared with
+        # every other such file of its size, including the ones that were
+        # already verified, so group those by their size again.
+        if self._content_reader is not None and len(key) == 8:
+            self._needs_verification = True
+            content_keys = self._content_keys.pop(size, None)
+            if content_keys:
+                for index_other, key_other in content_keys.items():
+                    self._duplicates.remove(key_other, index_other)
+                    self._duplicates.add(key, index_other)
+    def _unindex_record(self, index):
+        # This undoes _index_record(). The lock must be held.
+        self._num_scanned_files -= 1
+        self._total_bytes_scanned_files -= self._records.get_size(index)
+        self._duplicates.remove(self._get_bucket_key(index), index)
+    def _get_pool(self):
+        if self._shared_pool is not None:
+            return self._shared_pool
+        # Keep the worker threads between steps.
+        if self._pool is None:
+            self._pool = multiprocessing.pool.ThreadPool(self._num_threads)
+        return self._pool
+    def _verify_next_group(self):
+        # Find a group of files that are only grouped by size.
+        with self._lock:
+            key = next(
+                (key for key in self._duplicates.groups if len(key) == 8),
+                None
+            )
+            if key is None:
+                self._needs_verification = False
+                return
+            index_list = self._duplicates.groups[key]
+            size = self._records.get_size(index_list[0])
+            file_ids = [self._records.get_id(index) for index in index_list]
+        # Compare their content before taking the lock.
+        digests = content_verify.get_content_digests(
+            file_ids,
+            size,
+            self._content_reader,
+            self._get_pool().map,
+            (self.ContentUnavailable,)
+        )
+        with self._lock:
+            self._apply(("set_content_keys", size, digests))
+    def _process_next_delta_page(self):
         with self._lock:
-            self._num_scanned_files += 1
-            self._total_bytes_scanned_files += file.size
-        # Add this file to the list of files with the same hash. Include the
-        # file size in the hash to reduce the chance of a collision.
-        hash = file.hashes.get(self._hash_type)
+            if not self._delta_urls_to_scan:
+                return
+            url = self._delta_urls_to_scan[0]
+        # List the changes before taking the lock.
+        changes = list(
+            self._delta_yielder(url, self.add_delta_url, self.set_delta_link)
+        )
         with self._lock:
-            self._files_with_hash[(file.size, hash)].append(file)
-    def _process_folder_children(self, child_generator):
+            # Only now that the page has been listed is it done.
+            self._delta_urls_to_scan.popleft()
+            # Remove the deleted folders of the page together, since each
+            # removal looks at every file.
+            paths_removed = []
+            for item in self._order_delta_page(changes):
+                if isinstance(item, DeletedItem):
+                    if item.id in self._folder_paths:
+                        paths_removed.append(self._folder_paths[item.id])
+                    else:
+                        self._apply(("remove_file", item.id))
+                    continue
+                if paths_removed:
+                    self._apply(("remove_folder", *paths_removed))
+                    paths_removed = []
+                # Work out the paths that the delta feed leaves out.
+                parent_path = self._folder_paths.get(
+                    item.parent_id,
+                    item.parent_path
+                )
+                if isinstance(item, Folder):
+                    path = parent_path + "/" + item.name
+                    path_old = self._folder_paths.get(item.id)
+                    if path_old is not None and path_old != path:
+                        self._apply(("move_folder", path_old, path))
+                    elif path_old is None and item.parent_id:
+                        # Count new folders, but not the root of the drive,
+                        # which has no parent.
+                        self._num_discovered_folders += 1
+                    self._apply(("set_folder_path", item.id, path))
+                else:
+                    # A changed file replaces the old version, unless it is
+                    # no longer in the scope.
+                    self._apply(("remove_file", item.id))
+                    item = attr.evolve(item, parent_path=parent_path)
+                    if self._scope.includes_file(item):
+                        self._apply(("add_file", item))
+                    else:
+                        self._num_skipped_files += 1
+                        self._apply(("mark_incomplete", parent_path))
+            if paths_removed:
+                self._apply(("remove_folder", *paths_removed))
+    @staticmethod
+    def _order_delta_page(changes):
+        '''
+        Returns the items from one page of the delta feed in the order in
+        which they should be applied: folders, each after its parent if the
+        parent is on the same page, then deleted items, then files. Moving
+        folders before deleting items keeps a folder that was moved out of a
+        deleted folder from being deleted with it.
+        '''
+        folders = {}
+        deleted_items = []
+        files = []
+        for item in changes:
+            if isinstance(item, Folder):
+                folders[item.id] = item
+            elif isinstance(item, DeletedItem):
+                deleted_items.append(item)
+            elif isinstance(item, File):
+                files.append(item)
+            else:
+                raise TypeError("Unknown type", type(item))
+        ordered = []
+        while folders:
+            # Follow the parents of a folder up to one that is not left on
+            # this page, and then apply them from the top down.
+            chain = []
+            folder = next(iter(folders.values()))
+            while folder is not None:
+                del folders[folder.id]
+                chain.append(folder)
+                folder = folders.get(folder.parent_id)
+            ordered.extend(reversed(chain))
+        return ordered + deleted_items + files
+    def _process_next_folders(self):
+        # Process the next folder in the queue, or the next several if they
+        # can be listed together.
+        entries = []
+        with self._lock:
+            while self._folder_urls_to_scan and (
+                not entries or
+                self._batch_child_yielder and
+                len(entries) < self._batch_size
+            ):
+                entries.append(self._folder_urls_to_scan.popleft())
+            self._folder_entries_in_flight.update(entries)
+        if not entries:
+            return
+        # Hold on to the URLs of the next pages until the listing succeeds so
+        # that they are not added twice if it is retried.
+        folder_urls_next = []
+        try:
+            if len(entries) == 1:
+                children = self._child_yielder(
+                    entries[0][0],
+                    folder_urls_next.append
+                )
+            else:
+                children = self._batch_child_yielder(
+                    [url for url, _ in entries],
+                    folder_urls_next.append
+                )
+            self._process_folder_children(
+                children,
+                entries,
+                folder_urls_next
+            )
+        except:
+            # Put the folders back so that they are listed again when the
+            # scan is resumed.
+            with self._lock:
+                self._folder_entries_in_flight -= collections.Counter(entries)
+                self._folder_urls_to_scan.extend(entries)
+            raise
+    def _process_folder_children(
+        self,
+        child_generator,
+        folder_urls_done,
+        folder_urls_next
+    ):
         '''
         Arguments:
             child_generator:
                 a generator of File and Folder objects that represent the
-                files and subfolders in one folder
+                files and subfolders in one or more folders
+            folder_urls_done:
+                the entries from _folder_urls_to_scan of the folders whose
+                children these are
+            folder_urls_next:
+                a list to which the generator adds the URLs of the next pages
+                of those folders, which are added to the scan with the
+                children
         '''
+        # Collect the children first so that they can be added to the scan
+        # all at once.
+        num_folders = 0
+        num_skipped_files = 0
+        folder_urls = []
+        # Remember the path of each folder in case the scan is rescanned.
+        folder_paths = []
+        files = []
+        # These are the paths of the folders that have children that the
+        # scope leaves out.
+        incomplete_paths = set()
+        parent_ids = set()
         for child in child_generator:
+            if child.parent_id not in parent_ids:
+                parent_ids.add(child.parent_id)
+                folder_paths.append((child.parent_id, child.parent_path))
             if isinstance(child, Folder):
-                with self._lock:
-                    self._num_discovered_folders += 1
-                # Only add this folder to the queue if it has children.
+                num_folders += 1
+                folder_paths.append(
+                    (child.id, child.parent_path + "/" + child.name)
+                )
+                # Only add this folder to the queue if it has children that
+                # may be in the scope.
                 if child.child_count > 0:
-                    self.add_folder_url(self._folder_url_getter(child.id))
+                    if self._scope.includes_folder(child):
+                        folder_urls.append((
+                            self._folder_url_getter(child.id),
+                            self._folder_score(child)
+                            if self._folder_score is not None else None
+                        ))
+                    else:
+                        incomplete_paths.add(child.parent_path)
             elif isinstance(child, File):
-                self._process_file(child)
+                if self._scope.includes_file(child):
+                    files.append(child)
+                else:
+                    num_skipped_files += 1
+                    incomplete_paths.add(child.parent_path)
             else:
                 raise TypeError("Unknown type", type(child))
-    @staticmethod
-    def _token_to_filename(token):
-        # Hash the token.
-        hash = hashlib.sha256()
-        hash.update(pickle.dumps(token))
-        filename = \
-            base64.b32encode(hash.digest()).decode("UTF-8").replace("=", "_")
-        # Use the hash in the filename.
+        time_start = time.perf_counter()
+        with self._lock:
+            _LOCK_WAIT_SECONDS.observe(time.perf_counter() - time_start)
+            self._num_discovered_folders += num_folders
+            self._num_skipped_files += num_skipped_files
+            # The next pages have no score, so they are listed first.
+            folder_urls.extend((url, None) for url in folder_urls_next)
+            self._folder_urls_to_scan.extend(folder_urls)
+            self._unsaved_folder_urls_added.extend(folder_urls)
+            for folder_id, path in folder_paths:
+                self._apply(("set_folder_path", folder_id, path))
+            for path in incomplete_paths:
+                self._apply(("mark_incomplete", path))
+            if len(self._scope.folder_paths) > 1:
+                # Look up the files that were added already so that a file
+                # that is listed again is skipped.
+                self._get_index_by_id()
+            for file in files:
+                self._apply(("add_file", file))
+            self._folder_entries_in_flight -= \
+                collections.Counter(folder_urls_done)
+            self._unsaved_folder_urls_done.extend(folder_urls_done)
+    @classmethod
+    def _token_to_filename(cls, token, extension=".journal"):
+        # Use a hash of the token in the filename.
         return os.path.join(
             tempfile.gettempdir(),
-            "file_tree_dfs-" + filename + ".pickle"
+            "file_tree_dfs-" + cls.token_to_key(token) + extension
         )
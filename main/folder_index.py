@@ -0,0 +1,161 @@
+import collections, hashlib
+
+def _parent(path):
+    return path.rpartition("/")[0]
+
+class FolderDuplicateIndex:
+    def __init__(self, folder_paths, incomplete_paths, files):
+        '''
+        Finds folders whose whole subtrees have the same content. Each folder
+        gets a fingerprint that is a hash of the bucket keys of its files and
+        the fingerprints of its subfolders (i.e. a Merkle tree), which is
+        finalized once all of its subfolders have theirs. Names are left out,
+        so a copy of a folder matches it even if things in it were renamed.
+        Folders that have a file whose content is unknown, that have files or
+        subfolders that the scan left out, or that have no files under them at
+        all, match no other folder, and neither do the folders above them.
+        
+        Only the topmost folders of a copied tree are reported: a group of
+        folders whose parents are all in one group, one in each, is left out
+        because the group of the parents covers it.
+        
+        Arguments:
+            folder_paths:
+                a dictionary that maps the ids of folders to their paths
+            incomplete_paths:
+                a collection of the paths of folders that have files or
+                subfolders that the scan left out (e.g. because of its scope)
+            files:
+                an iterable of tuples of the parent path, bucket key, and size
+                of each file; the bucket key is None if the content of the
+                file is not known
+        '''
+        # These map the path of each folder to the paths of its subfolders
+        # and to the bucket keys of its files.
+        subfolders = collections.defaultdict(list)
+        file_keys = collections.defaultdict(list)
+        self._num_files = collections.Counter()
+        self._sizes = collections.Counter()
+        for parent_path, key, size in files:
+            file_keys[parent_path].append(key)
+            self._num_files[parent_path] += 1
+            self._sizes[parent_path] += size
+        self._ids = {
+            path: folder_id for folder_id, path in folder_paths.items()
+        }
+        paths = set(self._ids)
+        paths.update(file_keys)
+        paths.update(incomplete_paths)
+        for path in paths:
+            if _parent(path) in paths:
+                subfolders[_parent(path)].append(path)
+        # Finalize the deepest folders first so that the fingerprints of the
+        # subfolders of each folder are known by the time it is reached.
+        fingerprints = {}
+        by_depth = sorted(paths, key=lambda path: (path.count("/"), path))
+        for path in reversed(by_depth):
+            if path in incomplete_paths:
+                fingerprints[path] = None
+            else:
+                fingerprints[path] = self._get_fingerprint(
+                    file_keys[path],
+                    [fingerprints[subfolder] for subfolder in subfolders[path]]
+                )
+            for subfolder in subfolders[path]:
+                self._num_files[path] += self._num_files[subfolder]
+                self._sizes[path] += self._sizes[subfolder]
+        groups = collections.defaultdict(list)
+        for path in by_depth:
+            if fingerprints[path] is not None and self._num_files[path]:
+                groups[fingerprints[path]].append(path)
+        groups = [group for group in groups.values() if len(group) > 1]
+        group_by_path = {
+            path: number
+            for number, group in enumerate(groups)
+            for path in group
+        }
+        # A group whose parents are copies of each other is covered by the
+        # group of the parents.
+        self._groups = [
+            group for group in groups
+            if not self._is_covered(
+                [_parent(path) for path in group],
+                group_by_path
+            )
+        ]
+        # This maps the path of each folder that is in a reported group, or
+        # that is under one, to a dictionary that maps the number of each
+        # such group to the folder in it that is the folder or is above it.
+        # Parents come before their subfolders in by_depth.
+        self._groups_above = {}
+        group_by_path = {
+            path: number
+            for number, group in enumerate(self._groups)
+            for path in group
+        }
+        for path in by_depth:
+            groups_above = self._groups_above.get(_parent(path))
+            if path in group_by_path:
+                groups_above = dict(groups_above or {})
+                groups_above[group_by_path[path]] = path
+            if groups_above is not None:
+                self._groups_above[path] = groups_above
+    @property
+    def groups(self):
+        '''
+        A list of the groups of folders with the same content. Each group is
+        a list of folder paths, shallowest first. It must not be modified.
+        '''
+        return self._groups
+    def get_folder_id(self, path):
+        '''
+        Returns the id of the folder with the given path, or an empty string
+        if it is not known.
+        '''
+        return self._ids.get(path, "")
+    def get_num_files(self, path):
+        '''
+        Returns the number of files in the folder with the given path and in
+        all the folders under it.
+        '''
+        return self._num_files[path]
+    def get_size(self, path):
+        '''
+        Returns the total size of the files in the folder with the given path
+        and in all the folders under it.
+        '''
+        return self._sizes[path]
+    def covers(self, parent_paths):
+        '''
+        Returns True if a group of duplicate files whose parents have the
+        given paths is only a part of the copies of a group of folders: each
+        file is under a different folder of the same group.
+        '''
+        groups_above = [self._groups_above.get(path) for path in parent_paths]
+        if None in groups_above:
+            return False
+        for number in set(groups_above[0]).intersection(*groups_above[1:]):
+            folders = [groups[number] for groups in groups_above]
+            if len(set(folders)) == len(folders):
+                return True
+        return False
+    @staticmethod
+    def _is_covered(paths, group_by_path):
+        # Returns True if the given folders are all in one group, one each.
+        groups = set(group_by_path.get(path) for path in paths)
+        return len(groups) == 1 and None not in groups and \
+            len(set(paths)) == len(paths)
+    @staticmethod
+    def _get_fingerprint(file_keys, subfolder_fingerprints):
+        # Sort the entries so that the order in which the children were
+        # listed does not matter.
+        if None in file_keys or None in subfolder_fingerprints:
+            return None
+        hash = hashlib.sha256()
+        for entry in sorted(
+            [b"f" + key for key in file_keys] +
+            [b"d" + fingerprint for fingerprint in subfolder_fingerprints]
+        ):
+            hash.update(len(entry).to_bytes(4, "little"))
+            hash.update(entry)
+        return hash.digest()
@@ -0,0 +1,51 @@
+import collections, heapq, itertools
+
+class FolderQueue:
+    def __init__(self):
+        '''
+        Holds the folders that a scan still has to list, in the order in which
+        they were added. Each entry is a tuple of a folder URL and a score,
+        which this class ignores. The score may be None.
+        '''
+        self._entries = collections.deque()
+    def __len__(self):
+        return len(self._entries)
+    def __iter__(self):
+        return iter(self._entries)
+    def append(self, entry):
+        self._entries.append(entry)
+    def extend(self, entries):
+        for entry in entries:
+            self.append(entry)
+    def popleft(self):
+        '''
+        Removes and returns the entry that should be listed next.
+        '''
+        return self._entries.popleft()
+
+class PriorityFolderQueue(FolderQueue):
+    def __init__(self):
+        '''
+        Works like FolderQueue, but popleft() returns the entry with the
+        highest score first. Entries with equal scores are returned in the
+        order in which they were added. Entries with no score (e.g. the next
+        page of a folder that is being listed) come before all others.
+        '''
+        # This is a heap of tuples of the negated score, a sequence number,
+        # and the entry.
+        self._entries = []
+        self._sequence = itertools.count()
+    def __iter__(self):
+        return (entry for _, _, entry in self._entries)
+    def append(self, entry):
+        score = entry[1]
+        heapq.heappush(
+            self._entries,
+            (
+                float("-inf") if score is None else -score,
+                next(self._sequence),
+                entry
+            )
+        )
+    def popleft(self):
+        return heapq.heappop(self._entries)[2]
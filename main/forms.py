@@ -1,4 +1,70 @@
-import flask_wtf, wtforms
+import flask_wtf, humanfriendly, wtforms
+
+def _validate_size(form, field):
+    try:
+        humanfriendly.parse_size(field.data or "0", binary=True)
+    except humanfriendly.InvalidSize:
+        raise wtforms.validators.ValidationError(
+            "Please enter a size such as 500 KB or 10 MB."
+        )
 
 class AuthorizeForm(flask_wtf.FlaskForm):
+    scan_method = wtforms.RadioField(
+        "Scan method",
+        choices=(
+            ("folders", "Folder by folder"),
+            ("delta", "Whole drive at once (faster for many small folders)"),
+        ),
+        default="folders"
+    )
+    folder_order = wtforms.RadioField(
+        "Folder order",
+        choices=(
+            ("size", "Largest folders first"),
+            ("average_size", "Folders with the largest files first"),
+            ("found", "In the order in which they are found"),
+        ),
+        default="size"
+    )
+    folder_paths = wtforms.TextAreaField(
+        "Folders to scan, one per line (e.g. /Pictures); blank for all"
+    )
+    min_size = wtforms.StringField(
+        "Skip files smaller than (e.g. 1 MB)",
+        validators=(_validate_size,)
+    )
+    include_globs = wtforms.TextAreaField(
+        "Only scan files whose paths match one of these patterns, one per "
+        "line (e.g. *.jpg)"
+    )
+    exclude_globs = wtforms.TextAreaField(
+        "Skip files and folders whose paths match one of these patterns, one "
+        "per line (e.g. */node_modules)"
+    )
+    mime_types = wtforms.StringField(
+        "Only scan these MIME types, separated by commas (e.g. image/, "
+        "video/mp4)"
+    )
     authorize = wtforms.SubmitField("Authorize")
+    def get_scope_options(self):
+        '''
+        Returns the keyword arguments for scan_scope.ScanScope that the user
+        entered.
+        '''
+        min_size = humanfriendly.parse_size(
+            self.min_size.data or "0",
+            binary=True
+        )
+        return {
+            "folder_paths": self.folder_paths.data.splitlines(),
+            "min_size": min_size,
+            "include_globs": self.include_globs.data.splitlines(),
+            "exclude_globs": self.exclude_globs.data.splitlines(),
+            "mime_types": self.mime_types.data.split(","),
+        }
+
+class ScanControlForm(flask_wtf.FlaskForm):
+    pause = wtforms.SubmitField("Pause")
+    resume = wtforms.SubmitField("Resume")
+    cancel = wtforms.SubmitField("Cancel")
+    rescan = wtforms.SubmitField("Rescan")
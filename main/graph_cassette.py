@@ -0,0 +1,326 @@
+import collections, gzip, hashlib, hmac, json, os, threading, time, \
+    urllib.parse
+from . import onedrive, throttle
+
+# The version of the cassette format, which is written in its first line.
+_VERSION = 1
+# These query parameters are kept as they are. The values of others (e.g.
+# $skiptoken) are hashed.
+_KEPT_QUERY_PARAMETERS = frozenset(("select", "$select", "$top", "$expand"))
+# Path segments after these are ids, which are hashed.
+_ID_PARENT_SEGMENTS = frozenset(("items", "drives"))
+# File extensions up to this long are kept when names are hashed.
+_MAX_EXTENSION_LENGTH = 8
+
+class _Anonymizer:
+    def __init__(self):
+        '''
+        Replaces the names, ids, and opaque tokens in Microsoft Graph API
+        responses with keyed hashes. The same value always gets the same
+        hash, so ids and paths still match each other, but the key is random
+        and never saved, so the hashes cannot be reversed by guessing. Sizes,
+        hashes of file content, MIME types, and numbers of children are kept.
+        '''
+        self._key = os.urandom(32)
+    def hash(self, value):
+        if isinstance(value, str):
+            value = value.encode("UTF-8")
+        return hmac.new(self._key, value, hashlib.sha256).hexdigest()[:16]
+    def name(self, name):
+        # Keep the extension, which is part of the shape of a drive (e.g. for
+        # include patterns).
+        stem, dot, extension = name.rpartition(".")
+        if stem and len(extension) <= _MAX_EXTENSION_LENGTH:
+            return self.hash(name) + dot + extension
+        return self.hash(name)
+    def path(self, path):
+        '''
+        Hashes a path like /drive/root:/Pictures/2019 from a parentReference.
+        Each folder name gets the same hash as in the item itself.
+        '''
+        drive_path, colon, relative_path = \
+            urllib.parse.unquote(path).partition(":")
+        return urllib.parse.quote(
+            self._path_segments(drive_path) + colon + "/".join(
+                self.name(segment) if segment else segment
+                for segment in relative_path.split("/")
+            )
+        )
+    def url(self, url):
+        '''
+        Hashes the ids, paths, and opaque tokens in an API URL.
+        '''
+        parsed = urllib.parse.urlsplit(url)
+        # A path like /v1.0/me/drive/root:/Pictures:/children addresses an
+        # item by its path.
+        path_before, colon, path_after = parsed.path.partition(":")
+        path = self._path_segments(path_before)
+        if colon:
+            item_path, colon, path_after = path_after.partition(":")
+            path += ":" + urllib.parse.quote(
+                "/".join(
+                    self.name(segment) if segment else segment
+                    for segment in urllib.parse.unquote(item_path).split("/")
+                )
+            ) + colon + self._path_segments(path_after)
+        query = "&".join(
+            parameter
+            if urllib.parse.unquote(parameter.partition("=")[0]) in
+                _KEPT_QUERY_PARAMETERS or
+                parameter.partition("=")[2] == "latest"
+            else "{}={}".format(
+                parameter.partition("=")[0],
+                self.hash(urllib.parse.unquote(parameter.partition("=")[2]))
+            )
+            for parameter in parsed.query.split("&") if parameter
+        )
+        return urllib.parse.urlunsplit(
+            (parsed.scheme, parsed.netloc, path, query, "")
+        )
+    def body(self, body):
+        '''
+        Returns a copy of a parsed JSON response with only the parts that a
+        scan uses, anonymized.
+        '''
+        result = {}
+        if "error" in body:
+            result["error"] = {"code": body["error"].get("code")}
+        if "value" in body:
+            result["value"] = [self._item(item) for item in body["value"]]
+        for key in ("@odata.nextLink", "@odata.deltaLink"):
+            if key in body:
+                result[key] = self.url(body[key])
+        return result
+    def content(self, content):
+        # Equal ranges get equal digests, so comparisons of content still
+        # come out the same.
+        return [self.hash(content), len(content)]
+    def _path_segments(self, path):
+        segments = path.split("/")
+        return "/".join(
+            self.hash(urllib.parse.unquote(segment))
+            if i > 0 and segments[i - 1] in _ID_PARENT_SEGMENTS
+            else segment
+            for i, segment in enumerate(segments)
+        )
+    def _item(self, item):
+        result = {}
+        if "id" in item:
+            result["id"] = self.hash(item["id"])
+            result["webUrl"] = "https://example.com/" + result["id"]
+        if "name" in item:
+            result["name"] = self.name(item["name"])
+        if "size" in item:
+            result["size"] = item["size"]
+        parent = item.get("parentReference")
+        if parent is not None:
+            result["parentReference"] = {}
+            if "id" in parent:
+                result["parentReference"]["id"] = self.hash(parent["id"])
+            if "path" in parent:
+                result["parentReference"]["path"] = self.path(parent["path"])
+        if "file" in item:
+            result["file"] = {
+                key: item["file"][key]
+                for key in ("mimeType", "hashes") if key in item["file"]
+            }
+        if "folder" in item:
+            result["folder"] = {
+                "childCount": item["folder"].get("childCount", 0)
+            }
+        for key in ("deleted", "root"):
+            if key in item:
+                result[key] = {}
+        return result
+
+class RecordingClient:
+    def __init__(self, client, filename):
+        '''
+        Makes API calls with the given onedrive.GraphClient and writes
+        anonymized copies of the responses to a cassette file, which
+        ReplayClient can serve back later. The calls themselves get the real
+        responses. The file is gzipped JSON with one response per line.
+        
+        Arguments:
+            client:
+                the onedrive.GraphClient with which to make the calls
+            filename:
+                the cassette file to write
+        '''
+        self._client = client
+        self._anonymizer = _Anonymizer()
+        self._file = gzip.open(filename, "wt", encoding="UTF-8")
+        self._file_lock = threading.Lock()
+        self._write({"version": _VERSION})
+    @property
+    def limiter(self):
+        return self._client.limiter
+    def fetch_json(self, url):
+        time_start = time.monotonic()
+        response = self._client.fetch_json(url)
+        self._write({
+            "url": self._anonymizer.url(url),
+            "seconds": time.monotonic() - time_start,
+            "body": self._anonymizer.body(response),
+        })
+        return response
+    def fetch(self, url, headers=None, stream=False):
+        # The content is recorded, so it is always read.
+        time_start = time.monotonic()
+        response = self._client.fetch(url, headers)
+        self._write({
+            "url": self._anonymizer.url(url),
+            "range": (headers or {}).get("Range"),
+            "seconds": time.monotonic() - time_start,
+            "status": response.status_code,
+            "content": self._anonymizer.content(response.content),
+        })
+        return response
+    def post_json(self, url, body):
+        # The app only posts JSON batches. Record each response in the batch
+        # as if it had been requested on its own so that it can be replayed
+        # in any batch.
+        urls = {
+            request["id"]: onedrive.from_batch_url(request["url"])
+            for request in body["requests"]
+        }
+        time_start = time.monotonic()
+        response = self._client.post_json(url, body)
+        seconds = time.monotonic() - time_start
+        for sub_response in response.get("responses", ()):
+            if sub_response.get("id") not in urls:
+                continue
+            self._write({
+                "url": self._anonymizer.url(urls[sub_response["id"]]),
+                "seconds": seconds,
+                "status": sub_response.get("status"),
+                "retryAfter":
+                    sub_response.get("headers", {}).get("Retry-After"),
+                "body": self._anonymizer.body(sub_response.get("body", {})),
+            })
+        return response
+    def report_throttle(self, retry_after=None):
+        self._client.report_throttle(retry_after)
+    def close(self):
+        self._client.close()
+        with self._file_lock:
+            self._file.close()
+    def _write(self, record):
+        line = json.dumps(record, separators=(",", ":")) + "\n"
+        with self._file_lock:
+            self._file.write(line)
+
+class _ReplayedResponse:
+    def __init__(self, status_code, content):
+        # These are the parts of a requests.Response that the app uses.
+        self.status_code = status_code
+        self.content = content
+        self.headers = {}
+    def iter_content(self, chunk_size=1):
+        for start in range(0, len(self.content), chunk_size):
+            yield self.content[start:start + chunk_size]
+    def close(self):
+        pass
+
+class ReplayClient:
+    def __init__(self, filename, pool_size, speed=0.0):
+        '''
+        Serves the responses from a cassette file that RecordingClient wrote
+        in place of the Microsoft Graph API, so that a scan can be run again
+        offline (e.g. to profile it). It can be used wherever a
+        onedrive.GraphClient is used. Each URL gets the responses that were
+        recorded for it in order, and then the last one again. URLs that were
+        not recorded get a 404 response, and they are counted in num_misses.
+        
+        Arguments:
+            filename:
+                the cassette file to read
+            pool_size:
+                the largest number of calls in flight
+            speed:
+                how many times faster than recorded to serve the responses;
+                if 0, they are served without waiting
+        '''
+        self._responses = collections.defaultdict(collections.deque)
+        with gzip.open(filename, "rt", encoding="UTF-8") as f:
+            header = json.loads(next(f))
+            if header.get("version") != _VERSION:
+                raise ValueError("Unknown cassette version", header)
+            for line in f:
+                record = json.loads(line)
+                self._responses[(record["url"], record.get("range"))] \
+                    .append(record)
+        self._responses_lock = threading.Lock()
+        self._speed = speed
+        self._limiter = throttle.AdaptiveLimiter(pool_size)
+        self.num_misses = 0
+    @property
+    def limiter(self):
+        return self._limiter
+    def fetch_json(self, url):
+        record = self._replay([(url, None)])[0]
+        if record is None:
+            return {"error": {"code": "itemNotFound"}}
+        return record["body"]
+    def fetch(self, url, headers=None, stream=False):
+        record = self._replay([(url, (headers or {}).get("Range"))])[0]
+        if record is None:
+            return _ReplayedResponse(404, b"")
+        digest, length = record["content"]
+        # Make up content that is equal exactly when the recorded content
+        # was equal.
+        content = bytes.fromhex(digest)
+        return _ReplayedResponse(
+            record["status"],
+            (content * (length // len(content) + 1))[:length]
+        )
+    def post_json(self, url, body):
+        # The app only posts JSON batches.
+        requests = body["requests"]
+        records = self._replay([
+            (onedrive.from_batch_url(request["url"]), None)
+            for request in requests
+        ])
+        responses = []
+        for request, record in zip(requests, records):
+            if record is None:
+                record = {
+                    "status": 404,
+                    "body": {"error": {"code": "itemNotFound"}},
+                }
+            responses.append({
+                "id": request["id"],
+                "status": record["status"],
+                "headers": {"Retry-After": record["retryAfter"]}
+                    if record.get("retryAfter") else {},
+                "body": record["body"],
+            })
+        return {"responses": responses}
+    def report_throttle(self, retry_after=None):
+        self._limiter.report_throttle(retry_after)
+    def close(self):
+        pass
+    def _replay(self, keys):
+        # Take the next recorded response for each key, and wait as long as
+        # the slowest of them took.
+        records = []
+        with self._responses_lock:
+            for key in keys:
+                recorded = self._responses.get(key)
+                if not recorded:
+                    self.num_misses += 1
+                    records.append(None)
+                elif len(recorded) > 1:
+                    records.append(recorded.popleft())
+                else:
+                    records.append(recorded[0])
+        with self._limiter.slot():
+            time_start = time.monotonic()
+            if self._speed > 0:
+                time.sleep(max(
+                    (record["seconds"] for record in records if record),
+                    default=0.0
+                ) / self._speed)
+            latency = time.monotonic() - time_start
+        self._limiter.report_success(latency)
+        return records
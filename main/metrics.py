@@ -0,0 +1,155 @@
+import bisect, contextlib, threading, time
+
+# Every metric that has been created, in the order in which they were created.
+_metrics = []
+_metrics_lock = threading.Lock()
+
+def _format_labels(label_names, label_values, extra=()):
+    pairs = list(zip(label_names, label_values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(
+        '{}="{}"'.format(
+            name,
+            str(value)
+                .replace("\\", "\\\\")
+                .replace("\n", "\\n")
+                .replace('"', '\\"')
+        )
+        for name, value in pairs
+    ) + "}"
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class _Metric:
+    TYPE = None
+    def __init__(self, name, documentation, label_names=()):
+        '''
+        A metric that is kept in memory and exposed by render(). Metrics are
+        shared by every thread and every scan in this process.
+        
+        Arguments:
+            name:
+                the name of the metric in Prometheus
+            documentation:
+                a sentence that describes the metric
+            label_names:
+                the names of the labels that are passed as keyword arguments
+                when the metric is changed
+        '''
+        self._name = name
+        self._documentation = documentation
+        self._label_names = tuple(label_names)
+        self._lock = threading.Lock()
+        # This maps tuples of label values to values. A metric without labels
+        # is exposed even before it changes.
+        self._values = {} if self._label_names else {(): self._new_value()}
+        with _metrics_lock:
+            _metrics.append(self)
+    @property
+    def name(self):
+        return self._name
+    def _get_label_values(self, labels):
+        return tuple(labels[name] for name in self._label_names)
+    def render(self):
+        '''
+        Yields the lines that represent this metric in the Prometheus text
+        format.
+        '''
+        yield "# HELP {} {}".format(self._name, self._documentation)
+        yield "# TYPE {} {}".format(self._name, self.TYPE)
+        with self._lock:
+            values = sorted(self._values.items())
+        for label_values, value in values:
+            yield from self._render_value(label_values, value)
+
+class Counter(_Metric):
+    TYPE = "counter"
+    def _new_value(self):
+        return 0
+    def inc(self, amount=1, **labels):
+        key = self._get_label_values(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+    def get(self, **labels):
+        return self._values.get(self._get_label_values(labels), 0)
+    def _render_value(self, label_values, value):
+        yield "{}{} {}".format(
+            self._name,
+            _format_labels(self._label_names, label_values),
+            _format_value(value)
+        )
+
+class Histogram(_Metric):
+    TYPE = "histogram"
+    # The upper bounds of the buckets in seconds.
+    DEFAULT_BUCKETS = (
+        0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+        30.0, 60.0
+    )
+    def __init__(
+        self,
+        name,
+        documentation,
+        label_names=(),
+        buckets=DEFAULT_BUCKETS
+    ):
+        '''
+        A metric that counts observations (e.g. latencies) in buckets. The
+        arguments are the same as for the metrics above, plus the upper
+        bounds of the buckets in increasing order.
+        '''
+        self._buckets = tuple(buckets) + (float("inf"),)
+        super().__init__(name, documentation, label_names)
+    def _new_value(self):
+        # These are the count of observations in each bucket and their sum.
+        return [[0] * len(self._buckets), 0.0]
+    def observe(self, value, **labels):
+        key = self._get_label_values(labels)
+        with self._lock:
+            counts_and_sum = self._values.get(key)
+            if counts_and_sum is None:
+                counts_and_sum = self._values[key] = self._new_value()
+            counts_and_sum[0][bisect.bisect_left(self._buckets, value)] += 1
+            counts_and_sum[1] += value
+    @contextlib.contextmanager
+    def time(self, **labels):
+        '''
+        Observes the number of seconds that the body of a with statement
+        takes.
+        '''
+        time_start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - time_start, **labels)
+    def _render_value(self, label_values, value):
+        counts, total = value
+        cumulative = 0
+        for bound, count in zip(self._buckets, counts):
+            cumulative += count
+            yield "{}_bucket{} {}".format(
+                self._name,
+                _format_labels(
+                    self._label_names,
+                    label_values,
+                    (("le", _format_value(bound)),)
+                ),
+                cumulative
+            )
+        labels = _format_labels(self._label_names, label_values)
+        yield "{}_sum{} {}".format(self._name, labels, _format_value(total))
+        yield "{}_count{} {}".format(self._name, labels, cumulative)
+
+def render():
+    '''
+    Returns every metric in this process in the Prometheus text format.
+    '''
+    with _metrics_lock:
+        metrics = list(_metrics)
+    return "".join(
+        line + "\n" for metric in metrics for line in metric.render()
+    )
@@ -1,27 +1,306 @@
-import flask, requests_oauthlib, urllib.parse
-from . import file_tree, settings_loader
+import flask, oauthlib.oauth2, requests.adapters, requests_oauthlib, \
+    threading, time, urllib.parse
+from . import file_tree, metrics, settings_loader, throttle
 
 _OAUTH_AUTHORIZATION_URL = \
     "https://login.microsoftonline.com/common/oauth2/v2.0/authorize"
 _OAUTH_TOKEN_FETCH_URL = \
     "https://login.microsoftonline.com/common/oauth2/v2.0/token"
-_ORGANIZATION_PATH = "https://graph.microsoft.com/v1.0/organization"
-_ONEDRIVE_PATH_ROOT = "https://graph.microsoft.com/v1.0/me/drive/root"
-_ONEDRIVE_PATH_ITEMS = "https://graph.microsoft.com/v1.0/me/drive/items"
+_OAUTH_DEVICE_CODE_URL = \
+    "https://login.microsoftonline.com/common/oauth2/v2.0/devicecode"
+_OAUTH_DEVICE_CODE_GRANT_TYPE = "urn:ietf:params:oauth:grant-type:device_code"
+# offline_access asks for a refresh token, so that scans can outlast the
+# access token.
+_OAUTH_SCOPE = "User.Read Files.Read offline_access"
+_GRAPH_PATH = settings_loader.settings["GRAPH_API_URL"].rstrip("/")
+_BATCH_PATH = _GRAPH_PATH + "/$batch"
+_ORGANIZATION_PATH = _GRAPH_PATH + "/organization"
+_DRIVE_PATH = _GRAPH_PATH + "/me/drive?select=id"
+_ONEDRIVE_PATH_ROOT = _GRAPH_PATH + "/me/drive/root"
+_ONEDRIVE_PATH_ITEMS = _GRAPH_PATH + "/me/drive/items"
 _ONEDRIVE_PATH_SUFFIX = \
     "/children?select=id,name,size,webUrl,parentReference,file,folder"
+_ONEDRIVE_DELTA_SUFFIX = "/delta?select=" \
+    "id,name,size,webUrl,parentReference,file,folder,deleted,root"
+# These error codes mean that a delta URL can no longer be used.
+_DELTA_EXPIRED_ERROR_CODES = frozenset(("resyncRequired", "invalidDeltaToken"))
+# The number of bytes to read at a time from a download that ignored the
+# Range header.
+_DOWNLOAD_CHUNK_SIZE = 64 << 10
+# These error codes mean that a folder cannot be listed, so it is skipped.
+_SKIPPED_FOLDER_ERROR_CODES = frozenset(("itemNotFound", "accessDenied"))
+# The largest number of requests that can be combined into one batch.
+BATCH_SIZE = 20
+# If a request fails with one of these status codes, it is retried.
+_RETRY_STATUS_CODES = frozenset((429, 500, 502, 503, 504))
+# These status codes mean that the API is throttling requests.
+_THROTTLE_STATUS_CODES = frozenset((429, 503))
+
+_REQUEST_SECONDS = metrics.Histogram(
+    "duplicate_finder_graph_request_seconds",
+    "The time that each call to the Microsoft Graph API took, including "
+        "each retry.",
+    ("method",)
+)
+_RESPONSES = metrics.Counter(
+    "duplicate_finder_graph_responses_total",
+    "The number of responses from the Microsoft Graph API by status code, "
+        "including the responses within batches.",
+    ("status",)
+)
+_TOKEN_REFRESHES = metrics.Counter(
+    "duplicate_finder_oauth_token_refreshes_total",
+    "The number of times that an OAuth access token was refreshed."
+)
+_THROTTLES = metrics.Counter(
+    "duplicate_finder_graph_throttles_total",
+    "The number of calls that the Microsoft Graph API throttled."
+)
+_SKIPPED_FOLDERS = metrics.Counter(
+    "duplicate_finder_graph_skipped_folders_total",
+    "The number of folders that were skipped because they no longer existed "
+        "or could not be listed, by error code.",
+    ("code",)
+)
+_PAGES = metrics.Counter(
+    "duplicate_finder_graph_pages_total",
+    "The number of pages of folder children or changes that were listed.",
+    ("kind",)
+)
+_ITEMS = metrics.Counter(
+    "duplicate_finder_graph_items_total",
+    "The number of files, folders, and deleted items that were listed.",
+    ("kind",)
+)
 
 class NotAuthorized(Exception): pass
 class APIKeyError(KeyError): pass
+class DownloadError(file_tree.DuplicateFileScan.ContentUnavailable): pass
+class DeviceCodeError(Exception): pass
+
+class GraphClient:
+    # The number of times to retry a request that failed temporarily.
+    MAX_RETRIES = 5
+    # The access token is refreshed this many seconds before it expires.
+    REFRESH_MARGIN = 300
+    def __init__(
+        self,
+        token,
+        pool_size,
+        compress=True,
+        client_secret=None,
+        token_updater=None
+    ):
+        '''
+        Makes Microsoft Graph API calls with one OAuth token. Connections are
+        kept alive and reused across calls. An instance may be used by many
+        threads at once. The number of calls in flight is adjusted to how fast
+        the API responds and whether it throttles calls, and calls that fail
+        temporarily are retried. If the token has a refresh token, the access
+        token is refreshed shortly before it expires, or when the API rejects
+        it.
+        
+        Arguments:
+            token:
+                the OAuth token with which to authorize the calls
+            pool_size:
+                the largest number of calls in flight and of connections to
+                keep open
+            compress:
+                whether to ask the API to compress its responses
+            client_secret:
+                the OAuth app secret with which to refresh the token, or None
+                if the token was issued to a public client (e.g. by
+                get_token_by_device_code())
+            token_updater:
+                optional; a function that is called with the new token
+                whenever the token is refreshed (e.g. to save it)
+        '''
+        self._session = requests_oauthlib.OAuth2Session(
+            settings_loader.settings["OAUTH_APP_ID"],
+            token=token,
+            scope=_OAUTH_SCOPE
+        )
+        self._client_secret = client_secret
+        self._token_updater = token_updater
+        self._token_lock = threading.Lock()
+        # Besides the Graph API host, the session talks to the login host to
+        # refresh the token, and it may follow redirects to other hosts. A
+        # pool is kept for each of a few hosts so that the one for the API
+        # is not dropped, and its connections closed, whenever another host
+        # is called.
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=4,
+            pool_maxsize=pool_size
+        )
+        # Plain HTTP is only used with a fake server for testing.
+        self._session.mount("https://", adapter)
+        self._session.mount("http://", adapter)
+        self._session.headers["Accept-Encoding"] = \
+            "gzip, deflate" if compress else "identity"
+        self._diagnostics = threading.local()
+        self._limiter = throttle.AdaptiveLimiter(pool_size)
+    @property
+    def last_url(self):
+        '''
+        The URL of the last call that was made from the current thread.
+        '''
+        return getattr(self._diagnostics, "url", None)
+    @property
+    def last_status_code(self):
+        '''
+        The HTTP status code of the last call that was made from the current
+        thread.
+        '''
+        return getattr(self._diagnostics, "status_code", None)
+    @property
+    def limiter(self):
+        return self._limiter
+    @property
+    def token(self):
+        '''
+        The current OAuth token, which changes when it is refreshed.
+        '''
+        return self._session.token
+    def refresh_token(self):
+        '''
+        Refreshes the access token if it is about to expire. Raises
+        TokenExpiredError if it has expired and cannot be refreshed.
+        '''
+        self._refresh_token()
+        if self._session.token.get("expires_at", float("inf")) < time.time():
+            raise oauthlib.oauth2.rfc6749.errors.TokenExpiredError
+    def fetch_json(self, url):
+        '''
+        Makes a GET request to the given URL and returns the parsed JSON
+        response.
+        '''
+        return self._request("GET", url).json()
+    def fetch(self, url, headers=None, stream=False):
+        '''
+        Makes a GET request to the given URL with the given extra headers and
+        returns the requests.Response object. Its content has been read
+        unless stream is True, in which case the caller must close it.
+        '''
+        return self._request("GET", url, headers=headers, stream=stream)
+    def post_json(self, url, body):
+        '''
+        Makes a POST request with the given JSON body to the given URL and
+        returns the parsed JSON response.
+        '''
+        return self._request("POST", url, json=body).json()
+    def report_throttle(self, retry_after=None):
+        '''
+        Records that the API throttled a request that this client did not make
+        directly (e.g. one request within a batch).
+        '''
+        _THROTTLES.inc()
+        self._limiter.report_throttle(retry_after)
+    def _refresh_token(self, token_used=None):
+        # Refresh the access token if it is about to expire, or if the API
+        # rejected the given token. Only one thread refreshes it at a time,
+        # and the others use the new token.
+        with self._token_lock:
+            token = self._session.token
+            if token_used is not None:
+                if token.get("access_token") != token_used:
+                    # Another thread has refreshed it already.
+                    return True
+            elif "expires_at" not in token or \
+                    token["expires_at"] - time.time() > self.REFRESH_MARGIN:
+                return True
+            if not token.get("refresh_token"):
+                return False
+            kwargs = {"client_id": settings_loader.settings["OAUTH_APP_ID"]}
+            if self._client_secret is not None:
+                kwargs["client_secret"] = self._client_secret
+            try:
+                token = self._session.refresh_token(
+                    _OAUTH_TOKEN_FETCH_URL,
+                    **kwargs
+                )
+            except oauthlib.oauth2.rfc6749.errors.OAuth2Error as e:
+                raise oauthlib.oauth2.rfc6749.errors.TokenExpiredError(
+                    "The token could not be refreshed: {}".format(e)
+                )
+            _TOKEN_REFRESHES.inc()
+        if self._token_updater is not None:
+            self._token_updater(token)
+        return True
+    def _request(self, method, url, **kwargs):
+        self._diagnostics.url = url
+        attempt = 0
+        refreshed = False
+        while True:
+            self._diagnostics.status_code = None
+            self._refresh_token()
+            token_used = self._session.token.get("access_token")
+            with self._limiter.slot():
+                time_start = time.monotonic()
+                response = self._session.request(method, url, **kwargs)
+                latency = time.monotonic() - time_start
+            _REQUEST_SECONDS.observe(latency, method=method)
+            _RESPONSES.inc(status=str(response.status_code))
+            self._diagnostics.status_code = response.status_code
+            if response.status_code == 401 and not refreshed and \
+                    self._refresh_token(token_used):
+                # The token may have been revoked or expired early. Try once
+                # more with a new one.
+                refreshed = True
+                continue
+            if response.status_code in _THROTTLE_STATUS_CODES:
+                _THROTTLES.inc()
+                self._limiter.report_throttle(
+                    throttle.parse_retry_after(
+                        response.headers.get("Retry-After")
+                    )
+                )
+            elif response.status_code not in _RETRY_STATUS_CODES:
+                self._limiter.report_success(latency)
+                return response
+            if attempt >= self.MAX_RETRIES:
+                # Give up, and let the caller handle the error response.
+                return response
+            # Let the connection be reused even if the content was not read.
+            response.close()
+            time.sleep(throttle.backoff_delay(attempt))
+            attempt += 1
+    def close(self):
+        self._session.close()
 
 def _set_token(token):
     flask.session["oauth_token"] = token
 
 def get_token():
-    return flask.session.get("oauth_token")
+    token = flask.session.get("oauth_token")
+    if token is None:
+        return None
+    # If the user's client has refreshed the token, keep the new one.
+    with _clients_lock:
+        client = _clients.get(_get_client_key(token))
+    if client is not None and client.token != token:
+        token = client.token
+        _set_token(token)
+    return token
 
 def _pop_token():
-    return flask.session.pop("oauth_token", None)
+    token = flask.session.pop("oauth_token", None)
+    if token is None:
+        return None
+    # Close the client that was using this token, which is also kept under
+    # the tokens that it was refreshed from.
+    key = _get_client_key(token)
+    with _clients_lock:
+        client = _clients.pop(key, None)
+        for key_other in [
+            key_other
+            for key_other, client_other in _clients.items()
+            if client_other is client
+        ]:
+            del _clients[key_other]
+    if client is not None:
+        client.close()
+    return token
 
 def _set_state(state):
     flask.session["oauth_state"] = state
@@ -34,7 +313,7 @@ def _get_oauth_session():
         settings_loader.settings["OAUTH_APP_ID"],
         state=_pop_state(),
         token=get_token(),
-        scope="User.Read Files.Read",
+        scope=_OAUTH_SCOPE,
         redirect_uri=settings_loader.settings["OAUTH_CALLBACK"]
     )
 
@@ -51,6 +330,8 @@ def handle_callback():
     '''
     Call this in the handler for the OAuth callback.
     '''
+    # Another user may have signed in.
+    flask.session.pop("scan_token", None)
     _set_token(
         _get_oauth_session().fetch_token(
             _OAUTH_TOKEN_FETCH_URL,
@@ -59,31 +340,159 @@ def handle_callback():
         )
     )
 
+def get_token_by_device_code(show_message):
+    '''
+    Signs in with the OAuth device code flow, in which the user enters a code
+    on another device, so that no browser or callback URL is needed here.
+    Blocks until the user has signed in and returns the OAuth token. The app
+    registration must allow public client flows for this to work.
+    
+    Arguments:
+        show_message:
+            a function that takes one argument: the instructions to show to
+            the user, which include the code to enter
+    
+    Raises DeviceCodeError if the sign-in fails or is not completed in time.
+    '''
+    client_id = settings_loader.settings["OAUTH_APP_ID"]
+    api_response = requests.post(
+        _OAUTH_DEVICE_CODE_URL,
+        data={"client_id": client_id, "scope": _OAUTH_SCOPE}
+    ).json()
+    try:
+        device_code = api_response["device_code"]
+    except KeyError:
+        raise DeviceCodeError(
+            api_response.get("error_description", api_response)
+        )
+    show_message(api_response.get("message", api_response.get("user_code")))
+    interval = api_response.get("interval", 5)
+    time_end = time.monotonic() + api_response.get("expires_in", 900)
+    while time.monotonic() < time_end:
+        time.sleep(interval)
+        token = requests.post(
+            _OAUTH_TOKEN_FETCH_URL,
+            data={
+                "grant_type": _OAUTH_DEVICE_CODE_GRANT_TYPE,
+                "client_id": client_id,
+                "device_code": device_code,
+            }
+        ).json()
+        error = token.get("error")
+        if error is None:
+            # Let the OAuth session tell when the token has expired.
+            if "expires_in" in token:
+                token["expires_at"] = time.time() + float(token["expires_in"])
+            return token
+        if error == "slow_down":
+            interval += 5
+        elif error != "authorization_pending":
+            raise DeviceCodeError(token.get("error_description", error))
+    raise DeviceCodeError("The code expired before the sign-in completed.")
+
 def is_authorized():
     return get_token() is not None
 
 def deauthorize():
     _pop_token()
+    flask.session.pop("scan_token", None)
+
+def get_scan_token(client=None):
+    '''
+    Returns the token under which to save the signed-in user's scan. Unlike
+    the OAuth token, it stays the same when the OAuth token is refreshed and
+    when the user signs in again, so that the scan can continue.
+    
+    Arguments:
+        client:
+            the GraphClient to use; by default, the one for the signed-in
+            user in the Flask session
+    '''
+    scan_token = flask.session.get("scan_token")
+    if scan_token is None:
+        scan_token = flask.session["scan_token"] = \
+            ("drive", get_drive_id(client))
+    return scan_token
+
+# This maps token keys to GraphClient objects.
+_clients = {}
+_clients_lock = threading.Lock()
+
+def get_client(token=None):
+    '''
+    Returns the GraphClient for the given OAuth token, or for the signed-in
+    user if no token is given. The same client is shared by every thread that
+    works on the user's behalf.
+    '''
+    if token is None:
+        token = get_token()
+    if token is None:
+        raise NotAuthorized
+    key = _get_client_key(token)
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = _clients[key] = GraphClient(
+                token,
+                settings_loader.settings["MAX_CONCURRENCY"],
+                client_secret=settings_loader.settings["OAUTH_APP_SECRET"],
+                token_updater=lambda token_new: _add_client(token_new, client)
+            )
+    return client
+
+def _add_client(token, client):
+    # Find the client by its refreshed token too, which the Flask session
+    # holds from the next request on.
+    with _clients_lock:
+        _clients[_get_client_key(token)] = client
+
+def _get_client_key(token):
+    # The access token identifies the token, however the Flask session has
+    # reordered the rest of it.
+    return token.get("access_token")
 
-_last_result = None
-_last_url = None
+def _get_client_or_session_client(client):
+    # Use the given client, or fall back to the signed-in user's client.
+    if client is not None:
+        return client
+    if not is_authorized():
+        raise NotAuthorized
+    return get_client()
 
-def _fetch_json(url):
-    global _last_result, _last_url
-    _last_url = url
-    _last_result = _get_oauth_session().get(url).json()
-    return _last_result
+def _fetch_json(url, client=None):
+    return _get_client_or_session_client(client).fetch_json(url)
 
-def is_personal():
+def is_personal(client=None):
     '''
     Returns True if the signed-in Microsoft user is a personal Microsoft
     account (e.g. Outlook.com, Hotmail.com, Live.com, MSN.com). Returns False
     if it is a OneDrive for Business account.
+    
+    Arguments:
+        client:
+            the GraphClient to use; by default, the one for the signed-in
+            user in the Flask session
     '''
-    api_response = _fetch_json(_ORGANIZATION_PATH)
+    api_response = _fetch_json(_ORGANIZATION_PATH, client)
     return not api_response.get("value", ())
 
-def get_children(url, add_folder_url):
+def get_drive_id(client=None):
+    '''
+    Returns the id of the signed-in user's OneDrive, which stays the same
+    across sign-ins.
+    
+    Arguments:
+        client:
+            the GraphClient to use; by default, the one for the signed-in
+            user in the Flask session
+    '''
+    api_response = _fetch_json(_DRIVE_PATH, client)
+    try:
+        return api_response["id"]
+    except KeyError as e:
+        raise APIKeyError(*e.args, _DRIVE_PATH, api_response)
+
+def get_children(url, add_folder_url, client=None):
     '''
     Yields file_tree.Folder and file_tree.File objects that represent the
     contents of the given folder.
@@ -96,58 +505,127 @@ def get_children(url, add_folder_url):
         add_folder_url:
             a function that takes one argument: another URL that later should
             be passed back to get_children()
+        client:
+            the GraphClient to use; by default, the one for the signed-in
+            user in the Flask session, which is only available while handling
+            a request
+    '''
+    yield from _parse_children(url, _fetch_json(url, client), add_folder_url)
+
+def get_children_batch(urls, add_folder_url, client=None):
+    '''
+    Like get_children(), but lists the children of several folders with one
+    JSON batch request. See this link for more information:
+    https://docs.microsoft.com/graph/json-batching
+    
+    The requests in the batch that fail temporarily, or that get no response,
+    are sent again in another batch, up to GraphClient.MAX_RETRIES times, as
+    single requests are. The other folders are listed in the meantime.
+    
+    Arguments:
+        urls:
+            a list of at most BATCH_SIZE URLs that could each be passed to
+            get_children()
+        add_folder_url:
+            a function that takes one argument: another URL that later should
+            be passed back to get_children()
+        client:
+            the same as for get_children()
+    '''
+    client = _get_client_or_session_client(client)
+    attempt = 0
+    while True:
+        api_response = client.post_json(
+            _BATCH_PATH,
+            {
+                "requests": [
+                    {
+                        "id": str(i),
+                        "method": "GET",
+                        "url": _to_batch_url(url),
+                    }
+                    for i, url in enumerate(urls)
+                ]
+            }
+        )
+        try:
+            responses = api_response["responses"]
+        except KeyError as e:
+            raise APIKeyError(*e.args, _BATCH_PATH, api_response)
+        urls_unanswered = dict(enumerate(urls))
+        urls_to_retry = []
+        for response in responses:
+            try:
+                url = urls_unanswered.pop(int(response["id"]))
+            except (KeyError, ValueError):
+                continue
+            status = response.get("status")
+            _RESPONSES.inc(status=str(status))
+            if status in _RETRY_STATUS_CODES:
+                if status in _THROTTLE_STATUS_CODES:
+                    client.report_throttle(
+                        throttle.parse_retry_after(
+                            response.get("headers", {}).get("Retry-After")
+                        )
+                    )
+                if attempt < GraphClient.MAX_RETRIES:
+                    # Try this folder again in the next batch.
+                    urls_to_retry.append(url)
+                    continue
+            # A folder that cannot be listed (see _parse_children()) is
+            # skipped without keeping the others from being listed.
+            yield from _parse_children(
+                url,
+                response.get("body", {}),
+                add_folder_url
+            )
+        # Try again for any request that did not get a response.
+        urls_to_retry.extend(urls_unanswered.values())
+        if not urls_to_retry:
+            return
+        if attempt >= GraphClient.MAX_RETRIES:
+            raise APIKeyError("responses", _BATCH_PATH, api_response)
+        time.sleep(throttle.backoff_delay(attempt))
+        attempt += 1
+        urls = urls_to_retry
+
+def _to_batch_url(url):
+    # Requests in a batch use URLs that are relative to the API version.
+    if url.startswith(_GRAPH_PATH):
+        return url[len(_GRAPH_PATH):]
+    return url
+
+def from_batch_url(url):
+    '''
+    Returns the full URL of a request in a JSON batch, the URL of which is
+    relative to the API version.
+    '''
+    return _GRAPH_PATH + url
+
+def _parse_children(url, api_response, add_folder_url):
+    '''
+    Yields file_tree.Folder and file_tree.File objects from one API response
+    that lists the children of a folder.
     '''
-    if not is_authorized():
-        raise NotAuthorized
-    api_response = _fetch_json(url)
     # Check for an error state.
     try:
         error_code = api_response["error"]["code"]
     except KeyError:
         pass
     else:
-        if error_code == "itemNotFound":
-            # This folder no longer exists.
+        if error_code in _SKIPPED_FOLDER_ERROR_CODES:
+            # This folder no longer exists, or the user may not list it.
+            _SKIPPED_FOLDERS.inc(code=error_code)
             return
     # Iterate through the children.
     try:
-        for child in api_response["value"]:
-            id = child["id"]
-            name = child["name"]
-            size = child.get("size", 0)
-            url = child["webUrl"]
-            parent_id = child["parentReference"]["id"]
-            parent_path = \
-                urllib.parse.unquote(child["parentReference"]["path"])
-            folder = child.get("folder")
-            if folder:
-                # This is a folder.
-                yield file_tree.Folder(
-                    id=id,
-                    name=name,
-                    size=size,
-                    url=url,
-                    parent_id=parent_id,
-                    parent_path=parent_path,
-                    child_count=folder["childCount"]
-                )
-            else:
-                file = child.get("file")
-                if file:
-                    # This is a file.
-                    hashes = file.get("hashes")
-                    if hashes is None:
-                        hashes = {}
-                    yield file_tree.File(
-                        id=id,
-                        name=name,
-                        size=size,
-                        url=url,
-                        parent_id=parent_id,
-                        parent_path=parent_path,
-                        mime_type=file.get("mimeType", ""),
-                        hashes=hashes
-                    )
+        children = api_response["value"]
+        _PAGES.inc(kind="children")
+        _ITEMS.inc(len(children), kind="children")
+        for child in children:
+            item = _parse_item(child)
+            if item is not None:
+                yield item
     except KeyError as e:
         raise APIKeyError(*e.args, url, api_response)
     # If there are more children on another page, pass the next page's URL.
@@ -158,6 +636,189 @@ def get_children(url, add_folder_url):
     else:
         add_folder_url(next_link)
 
+def _parse_item(child):
+    '''
+    Returns a file_tree.Folder or file_tree.File object that represents the
+    given driveItem from an API response, or None if it is neither. If the
+    response does not include the parent's path, parent_path is empty.
+    
+    Raises KeyError if a required key is missing.
+    '''
+    id = child["id"]
+    name = child["name"]
+    size = child.get("size", 0)
+    web_url = child["webUrl"]
+    parent_id = child["parentReference"]["id"]
+    parent_path = urllib.parse.unquote(
+        child["parentReference"].get("path", "")
+    )
+    folder = child.get("folder")
+    if folder:
+        # This is a folder.
+        return file_tree.Folder(
+            id=id,
+            name=name,
+            size=size,
+            url=web_url,
+            parent_id=parent_id,
+            parent_path=parent_path,
+            child_count=folder.get("childCount", 0)
+        )
+    file = child.get("file")
+    if file:
+        # This is a file.
+        hashes = file.get("hashes")
+        if hashes is None:
+            hashes = {}
+        return file_tree.File(
+            id=id,
+            name=name,
+            size=size,
+            url=web_url,
+            parent_id=parent_id,
+            parent_path=parent_path,
+            mime_type=file.get("mimeType", ""),
+            hashes=hashes
+        )
+    return None
+
+def get_latest_delta_link(client=None):
+    '''
+    Returns a URL that, when passed to get_delta(), will result in the changes
+    to the drive since this function was called.
+    
+    Arguments:
+        client:
+            the same as for get_children()
+    '''
+    url = _ONEDRIVE_PATH_ROOT + _ONEDRIVE_DELTA_SUFFIX + "&token=latest"
+    api_response = _fetch_json(url, client)
+    try:
+        return api_response["@odata.deltaLink"]
+    except KeyError as e:
+        raise APIKeyError(*e.args, url, api_response)
+
+def get_root_delta_url():
+    '''
+    Returns a URL that, when passed to get_delta(), will result in every item
+    in the drive, in pages that are much larger than those from get_children().
+    After the last page, the delta link is for the changes since the listing.
+    '''
+    return _ONEDRIVE_PATH_ROOT + _ONEDRIVE_DELTA_SUFFIX
+
+def get_delta(url, add_delta_url, set_delta_link, client=None):
+    '''
+    Yields file_tree.Folder, file_tree.File, and file_tree.DeletedItem objects
+    that represent the items that changed in one page of the delta feed. The
+    parent_path of the folders and files is empty because the delta feed does
+    not include paths. The root of the drive is yielded as a folder with the
+    path /drive/root:, as in the paths from get_children(), so that the paths
+    of the other items can be worked out from their parents' ids. See this
+    link for more information:
+    https://docs.microsoft.com/graph/api/driveitem-delta
+    
+    Arguments:
+        url:
+            a delta URL from get_latest_delta_link(), get_root_delta_url(),
+            add_delta_url, or set_delta_link
+        add_delta_url:
+            a function that takes one argument: the URL of the next page of
+            changes, which later should be passed back to get_delta()
+        set_delta_link:
+            a function that takes one argument: the URL that should be passed
+            to get_delta() later to get the changes after this page
+        client:
+            the same as for get_children()
+    
+    Raises file_tree.DuplicateFileScan.DeltaExpired if the URL can no longer
+    be used and the drive needs to be scanned again in full.
+    '''
+    api_response = _fetch_json(url, client)
+    # Check for an error state.
+    try:
+        error_code = api_response["error"]["code"]
+    except KeyError:
+        pass
+    else:
+        if error_code in _DELTA_EXPIRED_ERROR_CODES:
+            raise file_tree.DuplicateFileScan.DeltaExpired(url, api_response)
+    try:
+        changes = api_response["value"]
+        _PAGES.inc(kind="delta")
+        _ITEMS.inc(len(changes), kind="delta")
+        for child in changes:
+            if "deleted" in child:
+                yield file_tree.DeletedItem(id=child["id"])
+            elif "root" in child:
+                # The root has no parent, so split its path in two.
+                yield file_tree.Folder(
+                    id=child["id"],
+                    name="root:",
+                    size=child.get("size", 0),
+                    url=child["webUrl"],
+                    parent_id="",
+                    parent_path="/drive",
+                    child_count=child.get("folder", {}).get("childCount", 0)
+                )
+            else:
+                item = _parse_item(child)
+                if item is not None:
+                    yield item
+    except KeyError as e:
+        raise APIKeyError(*e.args, url, api_response)
+    if "@odata.nextLink" in api_response:
+        add_delta_url(api_response["@odata.nextLink"])
+    elif "@odata.deltaLink" in api_response:
+        set_delta_link(api_response["@odata.deltaLink"])
+    else:
+        raise APIKeyError("@odata.deltaLink", url, api_response)
+
+def get_content_range(file_id, start, end, client=None):
+    '''
+    Returns the given range of the content of the file with the given ID as
+    bytes. See this link for more information:
+    https://docs.microsoft.com/graph/api/driveitem-get-content
+    
+    Arguments:
+        file_id:
+            the id attribute from a file_tree.File object
+        start:
+            the offset of the first byte to return
+        end:
+            the offset of the byte after the last byte to return
+        client:
+            the same as for get_children()
+    
+    Raises DownloadError if the content cannot be downloaded.
+    '''
+    url = "{}/{}/content".format(
+        _ONEDRIVE_PATH_ITEMS,
+        urllib.parse.quote(file_id)
+    )
+    # The API redirects to a download URL, which honors the Range header.
+    response = _get_client_or_session_client(client).fetch(
+        url,
+        {"Range": "bytes={}-{}".format(start, end - 1)},
+        stream=True
+    )
+    try:
+        if response.status_code == 206:
+            return response.content
+        if response.status_code != 200:
+            raise DownloadError(url, response.status_code)
+        # The whole file is being sent, so skip to the range and stop
+        # reading at its end.
+        content = bytearray()
+        position = 0
+        for chunk in response.iter_content(_DOWNLOAD_CHUNK_SIZE):
+            content += chunk[max(0, start - position):end - position]
+            position += len(chunk)
+            if position >= end:
+                break
+        return bytes(content)
+    finally:
+        response.close()
+
 def get_root_folder_url():
     '''
     Returns the full URL that, when passed to get_children(), will result in
@@ -165,6 +826,19 @@ def get_root_folder_url():
     '''
     return _ONEDRIVE_PATH_ROOT + _ONEDRIVE_PATH_SUFFIX
 
+def get_path_folder_url(path):
+    '''
+    Returns the full URL that, when passed to get_children(), will result in
+    the children of the folder at the given path, relative to the root of the
+    drive (e.g. /Pictures). See this link for more information:
+    https://docs.microsoft.com/graph/onedrive-addressing-driveitems
+    '''
+    return "{}:{}:{}".format(
+        _ONEDRIVE_PATH_ROOT,
+        urllib.parse.quote(path),
+        _ONEDRIVE_PATH_SUFFIX
+    )
+
 def get_folder_url(folder_id):
     '''
     Returns a full URL that, when passed to get_children(), will result in the
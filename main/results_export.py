@@ -0,0 +1,124 @@
+import csv, io, time
+from . import file_tree, metrics
+
+RENDER_SECONDS = metrics.Histogram(
+    "duplicate_finder_results_render_seconds",
+    "The time that rendering the results of a scan took, by format, not "
+        "counting the time spent sending them.",
+    ("format",)
+)
+
+def iter_json(duplicates, hash_type, duplicate_folders=()):
+    '''
+    Yields chunks of a JSON document of the form
+    {"duplicateFolders": [...], "duplicates": [...]}. Each item in the first
+    list is a list of folders that are copies of each other, and each item in
+    the second is a list of files that are duplicates of each other. Only one
+    group of duplicates is encoded at a time.
+    
+    Arguments:
+        duplicates:
+            an iterable of lists of file_tree.File objects, such as the result
+            of DuplicateFileScan.get_duplicates()
+        hash_type:
+            the hash type that the scan used; it is not used in this format
+        duplicate_folders:
+            optional; an iterable of lists of file_tree.Subtree objects, such
+            as the result of DuplicateFileScan.get_duplicate_folders()
+    '''
+    encoder = file_tree.JSONEncoder(indent=4)
+    def iter_list(key, item_lists):
+        yield '"{}": ['.format(key)
+        separator = "\n        "
+        for item_list in item_lists:
+            yield separator
+            yield encoder.encode(item_list).replace("\n", "\n        ")
+            separator = ",\n        "
+        yield "\n    ]"
+    yield "{\n    "
+    yield from iter_list("duplicateFolders", duplicate_folders)
+    yield ",\n    "
+    yield from iter_list("duplicates", duplicates)
+    yield "\n}"
+
+def iter_ndjson(duplicates, hash_type, duplicate_folders=()):
+    '''
+    Yields lines of newline-delimited JSON. Each line is a list of folders
+    that are copies of each other or of files that are duplicates of each
+    other. The lines of folders come first, and the objects in them have a
+    numFiles key, which files do not have. The arguments are the same as for
+    iter_json().
+    '''
+    encoder = file_tree.JSONEncoder()
+    for folder_list in duplicate_folders:
+        yield encoder.encode(folder_list) + "\n"
+    for file_list in duplicates:
+        yield encoder.encode(file_list) + "\n"
+
+def iter_csv(duplicates, hash_type, duplicate_folders=()):
+    '''
+    Yields rows of a CSV file that has one row for each file or folder. Files
+    that are duplicates of each other, or folders that are copies of each
+    other, have the same number in the first column. The rows of folders come
+    first and have the number of files under them in the last column, which
+    is empty for files. The arguments are the same as for iter_json().
+    '''
+    keys = [
+        (name, key)
+        for name, key in file_tree.JSONEncoder.get_keys(file_tree.File)
+        if name != "hashes"
+    ]
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    def get_row(row):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerow(row)
+        return buffer.getvalue()
+    yield get_row(
+        ["group"] + [key for _, key in keys] + [hash_type, "numFiles"]
+    )
+    group = 0
+    for folder_list in duplicate_folders:
+        for folder in folder_list:
+            yield get_row(
+                [group] +
+                [getattr(folder, name, "") for name, _ in keys] +
+                ["", folder.num_files]
+            )
+        group += 1
+    for file_list in duplicates:
+        for file in file_list:
+            yield get_row(
+                [group] +
+                [getattr(file, name) for name, _ in keys] +
+                [file.hashes.get(hash_type, ""), ""]
+            )
+        group += 1
+
+# This maps the name of each export format to its MIME type and the function
+# that yields the chunks of the export.
+FORMATS = {
+    "json": ("application/json", iter_json),
+    "ndjson": ("application/x-ndjson", iter_ndjson),
+    "csv": ("text/csv", iter_csv),
+}
+
+def iter_timed(format, chunks):
+    '''
+    Yields the given chunks of an export in the given format and records how
+    long it took to produce them in RENDER_SECONDS. The time that the caller
+    spends between chunks (e.g. sending them) is not counted.
+    '''
+    chunks = iter(chunks)
+    seconds = 0.0
+    while True:
+        time_start = time.perf_counter()
+        try:
+            chunk = next(chunks)
+        except StopIteration:
+            break
+        finally:
+            seconds += time.perf_counter() - time_start
+        yield chunk
+    RENDER_SECONDS.observe(seconds, format=format)
@@ -1,24 +1,28 @@
-import flask, json, oauthlib.oauth2, time
-from . import app, file_tree, forms, onedrive, settings_loader
+import flask, json, oauthlib.oauth2
+from . import app, file_tree, forms, metrics, onedrive, results_export, \
+    scan_runner, scan_scope, settings_loader
 
 def get_scan():
-    # Resume the previous scan under this access token.
-    try:
-        # Use the OneDrive access token as a unique token.
-        scan = file_tree.DuplicateFileScan.load(
-            onedrive.get_token(),
-            onedrive.get_children,
-            onedrive.get_folder_url
-        )
-    except file_tree.DuplicateFileScan.NoSuchSave:
-        # There is no previous scan; start a new one.
-        scan = file_tree.DuplicateFileScan(
-            "sha1Hash" if onedrive.is_personal() else "quickXorHash",
-            onedrive.get_children,
-            onedrive.get_folder_url
-        )
-        scan.add_folder_url(onedrive.get_root_folder_url())
-    return scan
+    # Give the scan its own API client so that it does not need the Flask
+    # session, which is only available while handling a request. Do not
+    # resume a saved scan with a token that has expired.
+    client = onedrive.get_client()
+    client.refresh_token()
+    return scan_runner.load_or_create_scan(
+        onedrive.get_scan_token(client),
+        client,
+        flask.session.get("scan_method", "folders"),
+        flask.session.get("folder_order", "size"),
+        scan_scope.ScanScope(**flask.session.get("scan_scope", {}))
+    )
+
+# The number of groups of duplicates to show on each page.
+_GROUPS_PER_PAGE = 50
+
+def get_runner():
+    # Find the runner that is advancing this user's scan, or start one. This
+    # also takes over the scan if the process that was advancing it is gone.
+    return scan_runner.start_runner(onedrive.get_scan_token(), get_scan)
 
 @app.route(settings_loader.get_oauth_callback_path())
 def handle_callback():
@@ -36,75 +40,154 @@ def handle_root():
     authorize_form=forms.AuthorizeForm()
     # If the user initiated a sign-in, redirect to the OAuth authorization URL.
     if flask.request.method == "POST" and authorize_form.validate_on_submit():
+        # Remember how to scan until the scan is started after the sign-in.
+        flask.session["scan_method"] = authorize_form.scan_method.data
+        flask.session["folder_order"] = authorize_form.folder_order.data
+        flask.session["scan_scope"] = authorize_form.get_scope_options()
         return flask.redirect(onedrive.get_authorization_url())
     # Display the form to prompt the user to initiate a sign-in. This extra
     # step helps to prevent the user from starting an OAuth authorization flow
     # by entering some URL accidentally.
-    scan = None
+    runner = None
     error = None
     error_api_url = None
     error_api_response = None
     if onedrive.is_authorized():
         try:
-            scan = get_scan()
-            # Scan for a certain amount of time and then return.
-            # TODO: consider switching to do..while style
-            time_start = time.time()
-            while (time.time() - time_start) < 1.0:
-                if scan.complete:
-                    break
-                try:
-                    scan.step()
-                except onedrive.APIKeyError as e:
-                    error = "The API response could not be parsed because " \
-                        "the {!r} key was missing.".format(e.args[0])
-                    error_api_url = e.args[1]
-                    error_api_response = e.args[2]
-                if error:
-                    break
+            runner = get_runner()
         except oauthlib.oauth2.rfc6749.errors.TokenExpiredError:
-            error = "Your session expired. " \
-                "Please restart the scan by signing out and back in."
+            # Keep the scan so that it continues after the next sign-in.
+            onedrive.deauthorize()
+            flask.flash(
+                "Your session expired. "
+                "Please sign in again to continue the scan.",
+                "warning"
+            )
+        else:
+            error = runner.error
+            error_api_url = runner.error_api_url
+            error_api_response = runner.error_api_response
         # In an error condition, show the API response to the user.
-        if error:
+        if error_api_response is not None:
             try:
                 error_api_response = json.dumps(error_api_response, indent=4)
             except:
                 pass
-        else:
-            scan.save(onedrive.get_token())
-    # Render the result.
-    result = flask.Response(
-        flask.render_template(
+    # Only show one page of the groups of duplicates.
+    page = max(1, flask.request.args.get("page", 1, type=int))
+    sort = flask.request.args.get("sort", "reclaimable")
+    if sort not in file_tree.DuplicateFileScan.SORT_KEYS:
+        sort = "reclaimable"
+    path_filter = flask.request.args.get("path", "")
+    with results_export.RENDER_SECONDS.time(format="html"):
+        num_matching_groups = 0
+        duplicates = []
+        duplicate_folders = []
+        if runner:
+            # Copied folders are shown above the first page instead of the
+            # files in them.
+            num_matching_groups, duplicates = \
+                runner.scan.get_duplicates_page(
+                    (page - 1) * _GROUPS_PER_PAGE,
+                    _GROUPS_PER_PAGE,
+                    sort,
+                    path_filter,
+                    collapse_folders=True
+                )
+            if page == 1:
+                duplicate_folders = \
+                    runner.scan.get_duplicate_folders(path_filter)
+        # Render the result. While the scan is running, the page polls
+        # handle_status() to show the progress.
+        return flask.render_template(
             "index.html",
             authorize_form=authorize_form,
+            scan_control_form=forms.ScanControlForm(),
             is_authorized=onedrive.is_authorized(),
-            scan=scan,
+            runner=runner,
+            scan=runner.scan if runner else None,
             error=error,
             error_api_url=error_api_url,
-            error_api_response=error_api_response
+            error_api_response=error_api_response,
+            duplicates=duplicates,
+            duplicate_folders=duplicate_folders,
+            num_matching_groups=num_matching_groups,
+            page=page,
+            num_pages=max(1, -(-num_matching_groups // _GROUPS_PER_PAGE)),
+            sort=sort,
+            path_filter=path_filter
         )
-    )
-    # Refresh if the scan is not complete. We need to do this because the code
-    # above only scans for a certain amount of time before returning, which may
-    # happen before the scan is complete.
-    if not error and scan and not scan.complete:
-        result.headers["Refresh"] = "1"
-    return result
+
+@app.route("/status.json")
+def handle_status():
+    # Report the progress of the user's scan without rendering the results.
+    runner = None
+    if onedrive.is_authorized():
+        runner = scan_runner.get_runner(onedrive.get_scan_token())
+    if runner is None:
+        return flask.Response(
+            '{"error": "no scan"}',
+            mimetype="application/json",
+            status=403 if not onedrive.is_authorized() else 404
+        )
+    return flask.jsonify(runner.status())
+
+@app.route("/scan", methods=("POST",))
+def handle_scan_control():
+    # Pause, resume, or cancel the user's scan.
+    scan_control_form = forms.ScanControlForm()
+    if onedrive.is_authorized() and scan_control_form.validate_on_submit():
+        runner = scan_runner.get_runner(onedrive.get_scan_token())
+        if runner is not None:
+            if scan_control_form.pause.data:
+                runner.pause()
+                flask.flash("The scan has been paused.", "info")
+            elif scan_control_form.resume.data:
+                runner.resume()
+                flask.flash("The scan has been resumed.", "info")
+            elif scan_control_form.cancel.data:
+                runner.cancel()
+                flask.flash("The scan has been canceled.", "warning")
+            elif scan_control_form.rescan.data:
+                if scan_runner.rescan_runner(
+                    onedrive.get_scan_token(),
+                    get_scan
+                ):
+                    flask.flash(
+                        "Looking for changes since the last scan.",
+                        "info"
+                    )
+                else:
+                    flask.flash("The scan cannot be rescanned now.", "danger")
+    return flask.redirect(flask.url_for(".handle_root"))
 
 @app.route("/logout")
 def handle_logout():
+    if onedrive.is_authorized():
+        scan_runner.remove_runner(onedrive.get_scan_token())
     onedrive.deauthorize()
     flask.flash("You have been signed out.", "success")
     return flask.redirect(flask.url_for(".handle_root"))
 
-@app.route("/results.json")
-def handle_results_json():
+@app.route("/results.<format>")
+def handle_results(format):
+    try:
+        mimetype, iter_export = results_export.FORMATS[format]
+    except KeyError:
+        flask.abort(404)
     if onedrive.is_authorized():
-        content = {"duplicates": list(get_scan().get_duplicates())}
+        scan = get_runner().scan
+        # Stream the results so that the download starts right away.
         result = flask.Response(
-            file_tree.JSONEncoder(indent=4).encode(content),
-            mimetype="application/json"
+            results_export.iter_timed(
+                format,
+                iter_export(
+                    scan.get_duplicates(collapse_folders=True),
+                    scan.hash_type,
+                    scan.get_duplicate_folders()
+                )
+            ),
+            mimetype=mimetype
         )
     else:
         result = flask.Response(
@@ -114,3 +197,12 @@ def handle_results_json():
         )
     result.headers["Content-Disposition"] = "attachment"
     return result
+
+@app.route("/metrics")
+def handle_metrics():
+    # Report the counters and latencies of every scan in this process in the
+    # Prometheus text format. They include no details of any user's files.
+    return flask.Response(
+        metrics.render(),
+        mimetype="text/plain; version=0.0.4"
+    )
@@ -0,0 +1,111 @@
+import collections, heapq
+
+def _tag(number, keys):
+    # Adds the number of a scan to each pair from get_hash_keys().
+    for key, index in keys:
+        yield key, number, index
+
+class MergedDuplicateIndex:
+    def __init__(self, scans):
+        '''
+        Finds the duplicates across several complete scans (e.g. of a personal
+        drive and a work drive) from the files that they saved, so no drive is
+        listed again. The files of each scan are sorted by size and hash, and
+        the sorted scans are merged. Files match if they have the same size
+        and the same hash of any type that both have, so scans that used
+        different hash types still match on the other hashes that the API
+        gave. The groups that each scan found on its own (e.g. by comparing
+        the content of files without a hash) are kept, too, but not the ones
+        of files that only have the same size, whose content is not known to
+        match.
+        
+        Arguments:
+            scans:
+                a list of file_tree.DuplicateFileScan objects whose complete
+                property is True
+        '''
+        self._scans = scans
+        # This maps files, as pairs of the number of the scan and the index of
+        # the file in it, to another file in the same group. Following them
+        # leads to a file that represents the group.
+        self._parents = {}
+        for number, scan in enumerate(scans):
+            for index_list in scan.get_duplicate_indices(True):
+                for index in index_list[1:]:
+                    self._union((number, index_list[0]), (number, index))
+        # Files that share a key are next to each other in the merged order.
+        hash_types = collections.Counter()
+        key_previous = None
+        file_previous = None
+        for key, number, index in heapq.merge(*(
+            _tag(number, scan.get_hash_keys())
+            for number, scan in enumerate(scans)
+        )):
+            hash_types[key[8:key.index(b"\0", 8)]] += 1
+            if key == key_previous:
+                self._union(file_previous, (number, index))
+            key_previous = key
+            file_previous = (number, index)
+        groups = collections.defaultdict(list)
+        for file in self._parents:
+            groups[self._find(file)].append(file)
+        self._groups = [sorted(group) for group in groups.values()]
+        self._groups.sort()
+        # Name the hash type that the most files have for exports that only
+        # have room for one.
+        if hash_types:
+            self._hash_type = \
+                hash_types.most_common(1)[0][0].decode("UTF-8")
+        else:
+            self._hash_type = scans[0].hash_type if scans else ""
+        self._num_duplicate_files = sum(len(group) for group in self._groups)
+        self._reclaimable_bytes = sum(
+            scans[group[0][0]].get_file(group[0][1]).size * (len(group) - 1)
+            for group in self._groups
+        )
+    @property
+    def hash_type(self):
+        '''
+        The type of hash that the most files in the scans have.
+        '''
+        return self._hash_type
+    @property
+    def num_groups(self):
+        return len(self._groups)
+    @property
+    def num_duplicate_files(self):
+        return self._num_duplicate_files
+    @property
+    def reclaimable_bytes(self):
+        return self._reclaimable_bytes
+    def get_duplicates(self, cross_scan_only=False):
+        '''
+        Yields lists of file_tree.File objects, as in
+        DuplicateFileScan.get_duplicates(). The files in a list may be from
+        different scans, which their URLs tell apart.
+        
+        Arguments:
+            cross_scan_only:
+                whether to only yield the groups that have files from more
+                than one scan
+        '''
+        for group in self._groups:
+            if cross_scan_only and group[0][0] == group[-1][0]:
+                continue
+            yield [
+                self._scans[number].get_file(index) for number, index in group
+            ]
+    def _find(self, file):
+        parent = self._parents.setdefault(file, file)
+        while parent != file:
+            # Point each file that is passed at its grandparent so that the
+            # next search is shorter.
+            grandparent = self._parents[parent]
+            self._parents[file] = grandparent
+            file, parent = parent, grandparent
+        return file
+    def _union(self, file, file_other):
+        root = self._find(file)
+        root_other = self._find(file_other)
+        if root != root_other:
+            self._parents[root_other] = root
@@ -0,0 +1,759 @@
+import functools, json, oauthlib.oauth2, os, pstats, threading, time
+from . import file_tree, onedrive, scan_scope, scan_store, scheduler, \
+    settings_loader
+
+# The states that a ScanRunner can be in.
+RUNNING = "running"
+PAUSED = "paused"
+CANCELLED = "cancelled"
+STOPPED = "stopped"
+COMPLETE = "complete"
+ERROR = "error"
+
+class ScanRunner:
+    # The minimum number of seconds between checkpoints of the scan.
+    CHECKPOINT_INTERVAL = 30.0
+    # If steps are profiled, one in this many is, starting with the first.
+    PROFILE_INTERVAL = 100
+    # The minimum number of seconds between updates of the status that is
+    # shared with other processes.
+    STATUS_INTERVAL = 1.0
+    # The number of seconds between checks for commands from other processes
+    # while the scan is paused.
+    COMMAND_INTERVAL = 1.0
+    # The number of seconds after a scan stopped because of an error before
+    # start_runner() tries it again, so that the error can be shown.
+    ERROR_RETRY_INTERVAL = 60.0
+    def __init__(
+        self,
+        token,
+        scan,
+        checkpoint_interval=CHECKPOINT_INTERVAL,
+        profile_dir=None,
+        lock=None
+    ):
+        '''
+        Owns a DuplicateFileScan and advances it in a background thread until
+        it is complete, cancelled, or stopped by an error. The scan is saved
+        periodically so that it can be resumed if the process restarts. Its
+        status is shared with other processes, which show it with
+        RemoteScanRunner and can pause, resume, or cancel it.
+        
+        Arguments:
+            token:
+                the unique token under which the scan is saved
+            scan:
+                the DuplicateFileScan to advance; its callbacks must not need
+                a Flask request context
+            checkpoint_interval:
+                the minimum number of seconds between saves of the scan
+            profile_dir:
+                if given, one in every PROFILE_INTERVAL steps is profiled,
+                and the profile is written to a file in this folder that can
+                be read with pstats
+            lock:
+                the scan_store.ScanLock from acquire_lock() that this
+                process holds for the scan, if any; it is released when the
+                scan is no longer advanced
+        '''
+        self._token = token
+        self._scan = scan
+        self._checkpoint_interval = checkpoint_interval
+        self._profile_dir = profile_dir
+        self._lock = lock
+        self._forget = False
+        self._finished = False
+        self._time_finished = None
+        self._condition = threading.Condition()
+        self._state = RUNNING
+        self._error = None
+        self._error_api_url = None
+        self._error_api_response = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        # These are used to work out how fast the scan is going.
+        self._time_start = time.monotonic()
+        self._num_scanned_files_start = scan.num_scanned_files
+        # These are used to work out where the time goes.
+        self._num_steps = 0
+        self._step_seconds = 0.0
+        self._num_saves = 0
+        self._save_seconds = 0.0
+        # This identifies the version of the saved scan that this runner
+        # saved last.
+        self._save_signature = _get_save_signature(token)
+    def start(self):
+        self._thread.start()
+    def is_current(self):
+        '''
+        Returns True if this runner has the latest state of the scan: either
+        it is still advancing the scan, or no other process has saved the
+        scan since this runner stopped.
+        '''
+        return self._thread.is_alive() or \
+            self._save_signature == _get_save_signature(self._token)
+    @property
+    def scan(self):
+        return self._scan
+    @property
+    def state(self):
+        return self._state
+    @property
+    def error(self):
+        return self._error
+    @property
+    def error_api_url(self):
+        return self._error_api_url
+    @property
+    def error_api_response(self):
+        return self._error_api_response
+    def pause(self):
+        '''
+        Stops advancing the scan after the current step. The scan is saved.
+        '''
+        with self._condition:
+            if self._state == RUNNING:
+                self._state = PAUSED
+                self._condition.notify_all()
+    def resume(self):
+        '''
+        Continues a scan that was paused.
+        '''
+        with self._condition:
+            if self._state == PAUSED:
+                self._state = RUNNING
+                self._condition.notify_all()
+    def stop(self):
+        '''
+        Stops advancing the scan after the current step and saves it, so that
+        it can be resumed later by another ScanRunner.
+        '''
+        with self._condition:
+            if self._state in (RUNNING, PAUSED):
+                self._state = STOPPED
+                self._condition.notify_all()
+    def join(self, timeout=None):
+        '''
+        Waits until the scan is no longer being advanced, or until the given
+        number of seconds has passed. Returns True if the scan is no longer
+        being advanced.
+        '''
+        self._thread.join(timeout)
+        return not self._thread.is_alive()
+    def cancel(self):
+        '''
+        Stops advancing the scan permanently and discards its saved copy. The
+        results so far remain available through the scan property.
+        '''
+        with self._condition:
+            if self._state in (RUNNING, PAUSED):
+                self._state = CANCELLED
+                self._condition.notify_all()
+    def forget(self):
+        '''
+        Cancels the scan and stops sharing its status once it is no longer
+        being advanced, so that the next call to start_runner() starts the
+        scan again instead of showing this one.
+        '''
+        with self._condition:
+            self._forget = True
+            self.cancel()
+            if self._thread.is_alive() and not self._finished:
+                # The thread removes the status when it ends.
+                return
+        _remove_file(_get_filename(self._token, ".status"))
+    def status(self):
+        '''
+        Returns a dictionary that summarizes the progress of the scan.
+        '''
+        elapsed = time.monotonic() - self._time_start
+        return {
+            "state": self._state,
+            "error": self._error,
+            "hashType": self._scan.hash_type,
+            "numDiscoveredFolders": self._scan.num_discovered_folders,
+            "numSkippedFiles": self._scan.num_skipped_files,
+            "numScannedFiles": self._scan.num_scanned_files,
+            "totalBytesScannedFiles": self._scan.total_bytes_scanned_files,
+            "numDuplicateGroups": self._scan.num_duplicate_groups,
+            "numDuplicateFiles": self._scan.num_duplicate_files,
+            "reclaimableBytes": self._scan.reclaimable_bytes,
+            "numQueuedFolders": self._scan.num_queued_folders,
+            "queuePosition": self._scan.queue_position,
+            "filesPerSecond":
+                (self._scan.num_scanned_files - self._num_scanned_files_start)
+                / elapsed if elapsed > 0 else 0.0,
+            "numSteps": self._num_steps,
+            "stepSeconds": self._step_seconds,
+            "numSaves": self._num_saves,
+            "saveSeconds": self._save_seconds,
+            "timeFinished": self._time_finished,
+        }
+    def _wait_while_paused(self):
+        with self._condition:
+            while self._state == PAUSED:
+                self._condition.wait(self.COMMAND_INTERVAL)
+                self._take_command()
+    def _take_command(self):
+        # Carry out a command that another process sent with
+        # RemoteScanRunner, if there is one.
+        command = _take_json(_get_filename(self._token, ".command"))
+        if command == "pause":
+            self.pause()
+        elif command == "resume":
+            self.resume()
+        elif command == "cancel":
+            self.cancel()
+        elif command == "forget":
+            self.forget()
+    def _share_status(self):
+        # Let other processes show the progress of the scan.
+        try:
+            _write_json(
+                _get_filename(self._token, ".status"),
+                {
+                    "status": self.status(),
+                    "errorApiUrl": self._error_api_url,
+                    "errorApiResponse": self._error_api_response,
+                }
+            )
+        except OSError:
+            # Try again next time.
+            pass
+    def _set_error(
+        self,
+        error,
+        api_url=None,
+        api_response=None,
+        state=ERROR
+    ):
+        with self._condition:
+            self._error = error
+            self._error_api_url = api_url
+            self._error_api_response = api_response
+            self._state = state
+    def _save(self):
+        time_start = time.monotonic()
+        self._scan.save(self._token)
+        self._save_signature = _get_save_signature(self._token)
+        self._num_saves += 1
+        self._save_seconds += time.monotonic() - time_start
+    def _step(self):
+        # Profile a step every so often if asked to.
+        if self._profile_dir is not None and \
+                self._num_steps % self.PROFILE_INTERVAL == 0:
+            profiles = []
+        else:
+            profiles = None
+        time_start = time.monotonic()
+        try:
+            self._scan.step(profiles)
+        finally:
+            self._num_steps += 1
+            self._step_seconds += time.monotonic() - time_start
+            if profiles:
+                pstats.Stats(*profiles).dump_stats(
+                    os.path.join(
+                        self._profile_dir,
+                        "{}-{:08d}.prof".format(
+                            _token_key(self._token),
+                            self._num_steps
+                        )
+                    )
+                )
+    def _run(self):
+        try:
+            self._advance()
+        except Exception as e:
+            # Stop rather than leave the scan looking like it is running.
+            self._set_error(
+                "The scan stopped because of an unexpected error: "
+                "{}".format(e or type(e).__name__)
+            )
+        finally:
+            self._finish()
+    def _advance(self):
+        # Commands that were left for a previous owner of the scan do not
+        # apply to this one.
+        _remove_file(_get_filename(self._token, ".command"))
+        # Save the scan and share its status right away so that other
+        # processes can show it.
+        self._save()
+        self._share_status()
+        time_last_save = time_last_share = time.monotonic()
+        while self._state in (RUNNING, PAUSED):
+            if self._state == PAUSED:
+                # Save the scan so that the pause survives a restart.
+                self._save()
+                self._share_status()
+                self._wait_while_paused()
+                time_last_save = time.monotonic()
+                continue
+            if self._scan.complete:
+                with self._condition:
+                    self._state = COMPLETE
+                break
+            try:
+                self._step()
+            except onedrive.APIKeyError as e:
+                self._set_error(
+                    "The API response could not be parsed because the "
+                    "{!r} key was missing.".format(e.args[0]),
+                    e.args[1],
+                    e.args[2]
+                )
+            except oauthlib.oauth2.rfc6749.errors.TokenExpiredError:
+                # The token could not be refreshed. The scan is saved, and it
+                # continues when the user signs in again.
+                self._set_error(
+                    "Your session expired. "
+                    "Please sign in again to continue the scan.",
+                    state=STOPPED
+                )
+            except file_tree.DuplicateFileScan.DeltaExpired:
+                # The changes since the last listing are no longer available,
+                # so list the whole drive again.
+                self._scan.resync(onedrive.get_root_delta_url())
+            else:
+                # Save the scan every so often.
+                if time.monotonic() - time_last_save >= \
+                        self._checkpoint_interval:
+                    self._save()
+                    time_last_save = time.monotonic()
+            if time.monotonic() - time_last_share >= self.STATUS_INTERVAL:
+                self._share_status()
+                time_last_share = time.monotonic()
+            self._take_command()
+    def _finish(self):
+        # Whatever stopped the scan, save it, share its final status, and let
+        # another process take it over.
+        try:
+            self._scan.close()
+            if self._state == CANCELLED:
+                self._scan.delete_save(self._token)
+                self._save_signature = None
+            else:
+                self._save()
+        except Exception as e:
+            # The last checkpoint is kept.
+            if self._state != ERROR:
+                self._set_error(
+                    "The scan could not be saved: {}".format(
+                        e or type(e).__name__
+                    )
+                )
+        finally:
+            # Let another process take over only after the final status is
+            # shared.
+            with self._condition:
+                self._time_finished = time.time()
+                if self._forget:
+                    _remove_file(_get_filename(self._token, ".status"))
+                else:
+                    self._share_status()
+                self._finished = True
+            if self._lock is not None:
+                self._lock.release()
+
+class RemoteScanRunner:
+    # The longest number of seconds to wait for the process that owns a new
+    # scan to share it.
+    WAIT_TIMEOUT = 30.0
+    # The number of seconds between checks while waiting.
+    WAIT_INTERVAL = 0.25
+    def __init__(self, token):
+        '''
+        Stands in for the ScanRunner of a scan that another process owns
+        (e.g. another worker process of the web app). The status is the one
+        that the owner shares, and the scan is loaded read-only from its
+        latest save whenever it has changed. Pausing, resuming, and
+        cancelling are passed on to the owner.
+        
+        Arguments:
+            token:
+                the unique token under which the scan is saved
+        '''
+        self._token = token
+        self._scan = None
+        self._scan_signature = None
+        self._scan_lock = threading.Lock()
+    @property
+    def scan(self):
+        with self._scan_lock:
+            # The owner saves the scan before it shares its status.
+            self.status()
+            signature = _get_save_signature(self._token)
+            if signature is not None and signature != self._scan_signature:
+                # Read only the checkpoints that were added since the last
+                # time if the save was not rewritten in the meantime.
+                if self._scan is not None and self._scan.load_appended():
+                    self._scan_signature = signature
+                    return self._scan
+                try:
+                    self._scan = file_tree.DuplicateFileScan.load(
+                        self._token,
+                        None,
+                        None,
+                        read_only=True
+                    )
+                except file_tree.DuplicateFileScan.NoSuchSave:
+                    # It was cancelled in the meantime.
+                    pass
+                else:
+                    self._scan_signature = signature
+            if self._scan is None:
+                # The saved copy of a cancelled scan is gone, so show an
+                # empty scan.
+                self._scan = file_tree.DuplicateFileScan(
+                    self.status()["hashType"],
+                    None,
+                    None
+                )
+            return self._scan
+    @property
+    def state(self):
+        return self.status()["state"]
+    @property
+    def error(self):
+        return self.status()["error"]
+    @property
+    def error_api_url(self):
+        return self._get_shared_status()["errorApiUrl"]
+    @property
+    def error_api_response(self):
+        return self._get_shared_status()["errorApiResponse"]
+    def pause(self):
+        self._send_command("pause")
+    def resume(self):
+        self._send_command("resume")
+    def cancel(self):
+        self._send_command("cancel")
+    def forget(self):
+        if self.state in (RUNNING, PAUSED):
+            self._send_command("forget")
+        else:
+            _remove_file(_get_filename(self._token, ".status"))
+    def status(self):
+        '''
+        Returns the dictionary that ScanRunner.status() returned the last
+        time that the owner of the scan shared it.
+        '''
+        return self._get_shared_status()["status"]
+    def _get_shared_status(self):
+        shared_status = _wait_for(
+            lambda: _read_json(_get_filename(self._token, ".status"))
+        )
+        if shared_status is None:
+            raise file_tree.DuplicateFileScan.NoSuchSave
+        return shared_status
+    def _send_command(self, command):
+        if self.state in (RUNNING, PAUSED):
+            _write_json(_get_filename(self._token, ".command"), command)
+
+def load_or_create_scan(
+    token,
+    client,
+    scan_method="folders",
+    folder_order="size",
+    scope=None
+):
+    '''
+    Resumes the scan that was saved under the given token, or starts a new
+    one if there is none. The scan makes its API calls with the given client,
+    so it does not need a Flask request context.
+    
+    Arguments:
+        token:
+            the unique token under which the scan is saved
+        client:
+            the onedrive.GraphClient with which to make API calls
+        scan_method:
+            "folders" to list the drive folder by folder, or "delta" to list
+            the whole drive from the delta feed; only used for a new scan
+        folder_order:
+            a key of file_tree.DuplicateFileScan.FOLDER_SCORES by which to
+            order folders, or anything else to list them in the order in
+            which they are found
+        scope:
+            a scan_scope.ScanScope object; by default, the whole drive
+    '''
+    if scope is None:
+        scope = scan_scope.ScanScope()
+    scan_options = {
+        # List folders in batches to save round trips.
+        "batch_child_yielder":
+            functools.partial(onedrive.get_children_batch, client=client),
+        "batch_size": onedrive.BATCH_SIZE,
+        # Give the pool as much work at once as there may be API calls in
+        # flight.
+        "num_threads": client.limiter.max_limit,
+        # Share worker threads with the other scans in this process, with a
+        # fair turn for each user.
+        "pool": scheduler.get_pool(_token_key(token)),
+        # List only the changes when the scan is rescanned.
+        "delta_yielder": functools.partial(onedrive.get_delta, client=client),
+        # Keep memory use bounded on small servers if a budget is set.
+        "memory_budget": settings_loader.settings["MEMORY_BUDGET"],
+        # Files without a hash would otherwise be grouped by size alone.
+        "content_reader": functools.partial(
+            onedrive.get_content_range,
+            client=client
+        ) if settings_loader.settings["VERIFY_CONTENT"] else None,
+        # List the folders that are likely to have the largest duplicates
+        # first, unless the user chose otherwise.
+        "folder_score":
+            file_tree.DuplicateFileScan.FOLDER_SCORES.get(folder_order),
+        # Only add the files that the user asked for.
+        "scope": scope,
+    }
+    child_yielder = functools.partial(onedrive.get_children, client=client)
+    try:
+        return file_tree.DuplicateFileScan.load(
+            token,
+            child_yielder,
+            onedrive.get_folder_url,
+            **scan_options
+        )
+    except file_tree.DuplicateFileScan.NoSuchSave:
+        pass
+    # There is no previous scan; start a new one.
+    scan = file_tree.DuplicateFileScan(
+        "sha1Hash" if onedrive.is_personal(client) else "quickXorHash",
+        child_yielder,
+        onedrive.get_folder_url,
+        **scan_options
+    )
+    if scan_method == "delta":
+        # List the whole drive from the delta feed. The last page gives the
+        # delta link for a rescan. The delta feed cannot be limited to some
+        # folders, so the scope is applied to each item instead.
+        scan.add_delta_url(onedrive.get_root_delta_url())
+    else:
+        # Get the delta link first so that changes during the scan are picked
+        # up by a rescan.
+        try:
+            scan.set_delta_link(onedrive.get_latest_delta_link(client))
+        except onedrive.APIKeyError:
+            # The scan can still be run, but it cannot be rescanned.
+            pass
+        # Only list the folders in the scope.
+        if scope.folder_paths:
+            for path in scope.folder_paths:
+                scan.add_folder_url(onedrive.get_path_folder_url(path))
+        else:
+            scan.add_folder_url(onedrive.get_root_folder_url())
+    return scan
+
+_runners = {}
+_runners_lock = threading.Lock()
+
+def acquire_lock(token):
+    '''
+    Acquires the lock that lets this process advance the scan with the given
+    token, and returns the scan_store.ScanLock object. Returns None if another
+    process holds the lock.
+    '''
+    lock = scan_store.ScanLock(_get_filename(token, ".lock"))
+    if not lock.try_acquire():
+        return None
+    return lock
+
+def get_runner(token):
+    '''
+    Returns the runner for the scan with the given token, or None if there is
+    no such scan. It is a ScanRunner if this process has the latest state of
+    the scan, or a RemoteScanRunner if another process does.
+    '''
+    with _runners_lock:
+        return _get_runner(token)
+
+def start_runner(token, get_scan):
+    '''
+    Starts advancing the scan with the given token in the background and
+    returns its runner. If a runner already exists for the token, it is
+    returned instead, unless it was stopped, it stopped because of an error
+    at least ScanRunner.ERROR_RETRY_INTERVAL seconds ago, or the process that
+    owned it has exited. In those cases, the scan is resumed from its last
+    save. A scan that was cancelled is started over once its runner has
+    finished. If another process is advancing the scan, a RemoteScanRunner
+    is returned.
+    
+    Arguments:
+        token:
+            the unique token under which the scan is saved
+        get_scan:
+            a function that returns the DuplicateFileScan to advance (e.g.
+            from load_or_create_scan()); it is only called if this process
+            takes over the scan
+    '''
+    with _runners_lock:
+        runner = _get_runner(token)
+        if runner is not None and not _can_restart(runner):
+            return runner
+    # Load the scan without holding _runners_lock, which every user's
+    # requests need, since loading may read a large save and make API calls
+    # that wait while the API throttles them. The file lock keeps other
+    # threads and processes from taking over the scan in the meantime.
+    lock = acquire_lock(token)
+    if lock is None:
+        # Another process or thread is advancing the scan.
+        return RemoteScanRunner(token)
+    try:
+        scan = get_scan()
+    except:
+        lock.release()
+        raise
+    return _publish_runner(token, runner, scan, lock)
+
+def rescan_runner(token, get_scan):
+    '''
+    If the scan with the given token is complete, starts bringing it up to
+    date in the background with a new ScanRunner, which is returned.
+    Otherwise, or if another process is advancing the scan, returns None.
+    
+    Arguments:
+        token:
+            the unique token under which the scan is saved
+        get_scan:
+            a function that returns the saved DuplicateFileScan; it is only
+            called if this process does not have the latest state of the scan
+    '''
+    with _runners_lock:
+        runner = _get_runner(token)
+        if runner is None or runner.state != COMPLETE:
+            return None
+    # As in start_runner(), the scan is loaded without holding
+    # _runners_lock.
+    lock = acquire_lock(token)
+    if lock is None:
+        return None
+    try:
+        scan = runner.scan if isinstance(runner, ScanRunner) \
+            else get_scan()
+        if not scan.rescan():
+            lock.release()
+            return None
+    except:
+        lock.release()
+        raise
+    return _publish_runner(token, runner, scan, lock)
+
+def _publish_runner(token, runner_previous, scan, lock):
+    # Starts a ScanRunner for the given scan, which the given lock lets this
+    # thread advance, unless another thread started one since
+    # runner_previous was found. Returns the runner that advances the scan.
+    with _runners_lock:
+        runner = _get_runner(token)
+        if runner is not None and runner is not runner_previous and \
+                isinstance(runner, ScanRunner) and not _can_restart(runner):
+            # That runner finished and released the lock in the meantime.
+            # Its scan is the latest one.
+            scan.close()
+            lock.release()
+            return runner
+        runner = _runners[_token_key(token)] = ScanRunner(
+            token,
+            scan,
+            profile_dir=settings_loader.settings["PROFILE_DIR"] or None,
+            lock=lock
+        )
+        runner.start()
+    return runner
+
+def remove_runner(token):
+    '''
+    Cancels the scan with the given token, discards its saved copy even if it
+    is finished, and forgets its runner.
+    '''
+    with _runners_lock:
+        runner = _get_runner(token)
+        _runners.pop(_token_key(token), None)
+    if runner is not None:
+        runner.forget()
+    # If no process is advancing the scan, nothing else will discard it.
+    lock = acquire_lock(token)
+    if lock is not None:
+        file_tree.DuplicateFileScan.delete_save(token)
+        lock.release()
+
+def _get_runner(token):
+    # This must be called with _runners_lock held.
+    runner = _runners.get(_token_key(token))
+    if runner is not None and runner.is_current():
+        return runner
+    if os.path.exists(_get_filename(token, ".status")):
+        return RemoteScanRunner(token)
+    return None
+
+def _can_restart(runner):
+    # Returns True if start_runner() may resume the scan of the given runner.
+    state = runner.state
+    if state == STOPPED:
+        return True
+    if state == ERROR:
+        time_finished = runner.status().get("timeFinished")
+        return time_finished is not None and \
+            time.time() - time_finished >= ScanRunner.ERROR_RETRY_INTERVAL
+    if state == CANCELLED:
+        # Its save is deleted by the time it finishes.
+        return runner.status().get("timeFinished") is not None
+    # The process that owns a scan that seems to be running may have exited,
+    # which the lock tells.
+    return isinstance(runner, RemoteScanRunner) and state in (RUNNING, PAUSED)
+
+def _get_filename(token, extension):
+    return file_tree.DuplicateFileScan.get_save_filename(token, extension)
+
+def _get_save_signature(token):
+    # This changes whenever the saved scan changes.
+    try:
+        stat = os.stat(_get_filename(token, ".journal"))
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+def _write_json(filename, value):
+    # Write to a temporary file first so that readers never see part of it.
+    filename_temp = filename + ".tmp"
+    with open(filename_temp, "w") as f:
+        json.dump(value, f)
+    scan_store.replace_file(filename_temp, filename)
+
+def _read_json(filename):
+    try:
+        with open(filename) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+def _remove_file(filename):
+    try:
+        os.remove(filename)
+    except FileNotFoundError:
+        pass
+
+def _take_json(filename):
+    # Rename the file before reading it so that it is only taken once.
+    filename_taken = filename + ".taken"
+    try:
+        scan_store.replace_file(filename, filename_taken)
+    except FileNotFoundError:
+        return None
+    result = _read_json(filename_taken)
+    os.remove(filename_taken)
+    return result
+
+def _wait_for(function):
+    # Calls the function until it returns something other than None, but
+    # gives up after RemoteScanRunner.WAIT_TIMEOUT seconds. This covers the
+    # moment after another process takes over a scan and before it shares
+    # the scan.
+    time_end = time.monotonic() + RemoteScanRunner.WAIT_TIMEOUT
+    while True:
+        result = function()
+        if result is not None or time.monotonic() >= time_end:
+            return result
+        time.sleep(RemoteScanRunner.WAIT_INTERVAL)
+
+def _token_key(token):
+    # Tokens may be unhashable (e.g. a dictionary), so use their hash instead.
+    return file_tree.DuplicateFileScan.token_to_key(token)
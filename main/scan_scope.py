@@ -0,0 +1,101 @@
+import attr, fnmatch, re
+
+def _to_tuple(values):
+    # Drop empty values (e.g. blank lines in a form).
+    return tuple(value.strip() for value in values if value.strip())
+
+def _to_folder_paths(values):
+    # Make every path start with a slash and not end with one. The root of
+    # the drive itself is the same as no path.
+    paths = []
+    for value in values:
+        path = "".join(
+            "/" + name for name in value.strip().split("/") if name
+        )
+        if path:
+            paths.append(path)
+    # Leave out the paths that repeat others or are under them, which would
+    # otherwise be listed twice. OneDrive compares paths without regard to
+    # case.
+    paths_folded = [path.casefold() for path in paths]
+    return tuple(
+        path for index, path in enumerate(paths)
+        if not any(
+            paths_folded[index].startswith(path_other + "/") or
+            paths_folded[index] == path_other and index_other < index
+            for index_other, path_other in enumerate(paths_folded)
+        )
+    )
+
+def _relative_path(path):
+    # Paths from the API look like /drive/root:/Pictures. Return only the
+    # part after the colon, which is empty for the root of the drive.
+    return path.partition(":")[2]
+
+def _matches(path, globs):
+    # Paths are compared without regard to case, as OneDrive does.
+    return any(
+        re.match(fnmatch.translate(glob), path, re.IGNORECASE)
+        for glob in globs
+    )
+
+@attr.s(frozen=True)
+class ScanScope:
+    # These are the paths of the folders to scan, relative to the root of the
+    # drive (e.g. /Pictures). If there are none, the whole drive is scanned.
+    folder_paths = attr.ib(default=(), converter=_to_folder_paths)
+    # Files smaller than this many bytes are skipped.
+    min_size = attr.ib(default=0, converter=int)
+    # If there are any of these, only files whose paths (e.g.
+    # /Pictures/IMG_0001.jpg) match one of them are scanned. A * also matches
+    # slashes.
+    include_globs = attr.ib(default=(), converter=_to_tuple)
+    # Files and folders whose paths match any of these are skipped, along with
+    # everything in those folders.
+    exclude_globs = attr.ib(default=(), converter=_to_tuple)
+    # If there are any of these, only files whose MIME types start with one of
+    # them are scanned (e.g. image/ or video/mp4).
+    mime_types = attr.ib(default=(), converter=_to_tuple)
+    def includes_folder(self, folder):
+        '''
+        Returns False if nothing in the given file_tree.Folder object can be
+        in the scope, so it does not need to be listed.
+        '''
+        if folder.size < self.min_size:
+            return False
+        return not self._is_excluded(
+            _relative_path(folder.parent_path) + "/" + folder.name
+        )
+    def includes_file(self, file):
+        '''
+        Returns True if the given file_tree.File object is in the scope.
+        '''
+        if file.size < self.min_size:
+            return False
+        if self.mime_types and not file.mime_type.startswith(self.mime_types):
+            return False
+        if not self.folder_paths and not self.include_globs and \
+                not self.exclude_globs:
+            return True
+        parent_path = _relative_path(file.parent_path)
+        if self.folder_paths and not any(
+            parent_path.casefold() == folder_path.casefold() or
+            parent_path.casefold().startswith(folder_path.casefold() + "/")
+            for folder_path in self.folder_paths
+        ):
+            return False
+        path = parent_path + "/" + file.name
+        if self.include_globs and not _matches(path, self.include_globs):
+            return False
+        return not self._is_excluded(path)
+    def _is_excluded(self, path):
+        # Check the path and the paths of the folders above it so that
+        # everything in an excluded folder is excluded, too.
+        if not self.exclude_globs:
+            return False
+        while path:
+            if _matches(path, self.exclude_globs) or \
+                    _matches(path + "/", self.exclude_globs):
+                return True
+            path = path.rpartition("/")[0]
+        return False
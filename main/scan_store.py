@@ -0,0 +1,195 @@
+import os, pickle, time
+try:
+    import fcntl
+except ImportError:
+    # This is Windows, where files are locked with msvcrt instead.
+    fcntl = None
+    import msvcrt
+
+# On Windows, a file cannot be replaced while another process is reading it,
+# so replacing it is retried this many times, this many seconds apart.
+_REPLACE_ATTEMPTS = 20
+_REPLACE_RETRY_DELAY = 0.05
+
+def replace_file(source, destination):
+    '''
+    Renames the source file to the destination, replacing it atomically.
+    '''
+    for attempt in range(_REPLACE_ATTEMPTS):
+        try:
+            os.replace(source, destination)
+            return
+        except PermissionError:
+            if attempt == _REPLACE_ATTEMPTS - 1:
+                raise
+            time.sleep(_REPLACE_RETRY_DELAY)
+
+class ScanJournal:
+    class Replaced(Exception): pass
+    # A snapshot is rewritten when the journal grows to this many times the
+    # size that it had just after the last snapshot.
+    COMPACTION_RATIO = 2
+    # Journals smaller than this many bytes are never compacted.
+    COMPACTION_MIN_SIZE = 1 << 20
+    def __init__(self, filename):
+        '''
+        An append-only file that stores the state of a scan. The file starts
+        with one snapshot record, which holds the whole state of the scan at
+        some point. It is followed by checkpoint records, each of which holds
+        only what changed since the record before it. Every record is one
+        pickle, so a record that was cut short by a crash is detected and
+        discarded as a unit.
+        
+        Arguments:
+            filename: the path to the journal file
+        '''
+        self._filename = filename
+        self._snapshot_size = None
+        # These identify the file that was read last and how far.
+        self._file_id = None
+        self._offset_read = None
+    @property
+    def filename(self):
+        return self._filename
+    def read(self, repair=True):
+        '''
+        Yields the records in the journal in order. The first record is the
+        snapshot. If the last record is incomplete, it is removed from the
+        file so that later records can be appended after the good ones.
+        
+        Arguments:
+            repair:
+                whether to remove an incomplete last record; pass False if
+                another process may be appending to the journal
+        
+        Raises FileNotFoundError if the journal does not exist.
+        '''
+        with open(self._filename, "r+b" if repair else "rb") as f:
+            stat = os.fstat(f.fileno())
+            self._file_id = (stat.st_dev, stat.st_ino)
+            yield from self._read_records(f, repair)
+    def read_appended(self):
+        '''
+        Yields the records that were appended to the journal since it was
+        last read with read() or this method. The file is not repaired.
+        
+        Raises FileNotFoundError if the journal no longer exists, or Replaced
+        if a new snapshot has replaced it since then.
+        '''
+        with open(self._filename, "rb") as f:
+            stat = os.fstat(f.fileno())
+            if self._offset_read is None or \
+                    (stat.st_dev, stat.st_ino) != self._file_id or \
+                    stat.st_size < self._offset_read:
+                raise self.Replaced
+            f.seek(self._offset_read)
+            yield from self._read_records(f, False)
+    def write_snapshot(self, record):
+        '''
+        Replaces the whole journal with one snapshot record. The old journal
+        stays intact until the new one has been written completely.
+        '''
+        filename_temp = self._filename + ".tmp"
+        with open(filename_temp, "wb") as f:
+            pickle.dump(record, f, pickle.HIGHEST_PROTOCOL)
+            self._snapshot_size = f.tell()
+            f.flush()
+            os.fsync(f.fileno())
+        replace_file(filename_temp, self._filename)
+    def append(self, record):
+        '''
+        Appends a checkpoint record to the journal.
+        '''
+        with open(self._filename, "ab") as f:
+            pickle.dump(record, f, pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+    def _read_records(self, f, repair):
+        offset_good = f.tell()
+        while True:
+            try:
+                record = pickle.load(f)
+            except (
+                EOFError,
+                pickle.UnpicklingError,
+                ValueError,
+                AttributeError
+            ):
+                # If the last record is incomplete, truncate the file after
+                # the last complete record.
+                if repair and offset_good < os.fstat(f.fileno()).st_size:
+                    f.truncate(offset_good)
+                break
+            offset_good = self._offset_read = f.tell()
+            if self._snapshot_size is None:
+                self._snapshot_size = offset_good
+            yield record
+    def needs_compaction(self):
+        '''
+        Returns True if the journal has grown enough since the last snapshot
+        that it should be replaced with a new snapshot.
+        '''
+        if self._snapshot_size is None:
+            return True
+        try:
+            size = os.path.getsize(self._filename)
+        except FileNotFoundError:
+            return True
+        return size >= self.COMPACTION_MIN_SIZE and \
+            size >= self._snapshot_size * self.COMPACTION_RATIO
+    def delete(self):
+        '''
+        Deletes the journal if it exists.
+        '''
+        try:
+            os.remove(self._filename)
+        except FileNotFoundError:
+            pass
+
+class ScanLock:
+    def __init__(self, filename):
+        '''
+        An exclusive lock on a scan that is shared by the processes on this
+        computer, so that only one of them advances and saves the scan. The
+        operating system releases the lock when the process that holds it
+        exits, even if it crashes, so that another process can take over.
+        
+        Arguments:
+            filename: the path to the lock file, which is created if needed
+        '''
+        self._filename = filename
+        self._file = None
+    @property
+    def held(self):
+        return self._file is not None
+    def try_acquire(self):
+        '''
+        Acquires the lock if no other process or ScanLock object holds it,
+        without waiting. Returns True if this object holds the lock now.
+        '''
+        if self._file is not None:
+            return True
+        f = open(self._filename, "a+b")
+        try:
+            f.seek(0)
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+        except OSError:
+            f.close()
+            return False
+        self._file = f
+        return True
+    def release(self):
+        '''
+        Releases the lock if this object holds it.
+        '''
+        if self._file is None:
+            return
+        if fcntl is None:
+            self._file.seek(0)
+            msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+        # Closing the file releases a lock from flock().
+        self._file.close()
+        self._file = None
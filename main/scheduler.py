@@ -0,0 +1,204 @@
+import collections, threading, time
+from . import metrics, settings_loader
+
+_QUEUE_SECONDS = metrics.Histogram(
+    "duplicate_finder_scheduler_queue_seconds",
+    "Seconds that a piece of scan work waited for a worker thread."
+)
+_TASKS = metrics.Counter(
+    "duplicate_finder_scheduler_tasks_total",
+    "Pieces of scan work that worker threads ran."
+)
+
+class _Result:
+    def __init__(self):
+        # This is the part of multiprocessing.pool.AsyncResult that the app
+        # uses.
+        self._event = threading.Event()
+        self._value = None
+        self._error = None
+    def get(self):
+        '''
+        Waits until the work is done and returns its result, or raises the
+        exception that it raised.
+        '''
+        self._event.wait()
+        if self._error is not None:
+            raise self._error
+        return self._value
+    def _set(self, value, error):
+        self._value = value
+        self._error = error
+        self._event.set()
+
+class FairScheduler:
+    def __init__(self, max_workers, max_workers_per_tenant):
+        '''
+        Runs the work of every scan in this process in one set of worker
+        threads. A tenant (e.g. the user who owns a scan) that has work
+        waiting gets a worker in turn with the other such tenants, so a scan
+        of a huge drive cannot hold up a scan of a small one. Each piece of
+        work makes at most one API call at a time, so the caps on workers
+        also cap the API calls in flight.
+        
+        Arguments:
+            max_workers:
+                the highest number of worker threads, and so of pieces of
+                work running at once for all tenants
+            max_workers_per_tenant:
+                the highest number of pieces of work running at once for one
+                tenant
+        '''
+        self._condition = threading.Condition()
+        self._max_workers = max_workers
+        self._max_workers_per_tenant = max_workers_per_tenant
+        # This maps tenants that have work waiting to deques of it, in the
+        # order in which they get their next turn.
+        self._queues = collections.OrderedDict()
+        self._num_running = collections.Counter()
+        self._num_workers = 0
+        self._num_idle_workers = 0
+    @property
+    def max_workers(self):
+        return self._max_workers
+    @property
+    def max_workers_per_tenant(self):
+        return self._max_workers_per_tenant
+    def submit(self, tenant, function, args=()):
+        '''
+        Queues a call of the given function with the given arguments for the
+        given tenant, and returns an object whose get() method waits for the
+        result.
+        '''
+        result = _Result()
+        with self._condition:
+            self._queues.setdefault(tenant, collections.deque()).append(
+                (time.monotonic(), function, args, result)
+            )
+            if self._num_idle_workers == 0 and \
+                    self._num_workers < self._max_workers:
+                # Start worker threads only as they are needed.
+                self._num_workers += 1
+                threading.Thread(target=self._work, daemon=True).start()
+            else:
+                self._condition.notify_all()
+        return result
+    def get_queue_position(self, tenant):
+        '''
+        Returns the number of other tenants that will get a worker before the
+        given tenant's next piece of work does, or None if the tenant has no
+        work waiting.
+        '''
+        with self._condition:
+            if tenant not in self._queues:
+                return None
+            position = 0
+            for other in self._queues:
+                if other == tenant:
+                    return position
+                if self._num_running[other] < self._max_workers_per_tenant:
+                    position += 1
+    def wait_until_idle(self, tenant):
+        '''
+        Waits until the given tenant has no work waiting or running.
+        '''
+        with self._condition:
+            while tenant in self._queues or self._num_running[tenant]:
+                self._condition.wait()
+    def _take_next(self):
+        # Take the first piece of work of the first tenant in turn that is
+        # not at its cap, and send that tenant to the back of the line. The
+        # condition must be held.
+        for tenant, queue in self._queues.items():
+            if self._num_running[tenant] < self._max_workers_per_tenant:
+                break
+        else:
+            return None
+        task = queue.popleft()
+        if queue:
+            self._queues.move_to_end(tenant)
+        else:
+            del self._queues[tenant]
+        self._num_running[tenant] += 1
+        return (tenant,) + task
+    def _work(self):
+        while True:
+            with self._condition:
+                while True:
+                    task = self._take_next()
+                    if task is not None:
+                        break
+                    self._num_idle_workers += 1
+                    self._condition.wait()
+                    self._num_idle_workers -= 1
+            tenant, time_queued, function, args, result = task
+            _QUEUE_SECONDS.observe(time.monotonic() - time_queued)
+            _TASKS.inc()
+            try:
+                value = function(*args)
+            except Exception as e:
+                result._set(None, e)
+            else:
+                result._set(value, None)
+            with self._condition:
+                self._num_running[tenant] -= 1
+                if not self._num_running[tenant]:
+                    del self._num_running[tenant]
+                self._condition.notify_all()
+
+class TenantPool:
+    def __init__(self, scheduler, tenant):
+        '''
+        Runs one tenant's work in a FairScheduler. It has the methods of
+        multiprocessing.pool.ThreadPool that DuplicateFileScan uses, so it can
+        be passed as its pool.
+        
+        Arguments:
+            scheduler: the FairScheduler
+            tenant: a hashable value that identifies the tenant
+        '''
+        self._scheduler = scheduler
+        self._tenant = tenant
+    @property
+    def queue_position(self):
+        return self._scheduler.get_queue_position(self._tenant)
+    def apply_async(self, function, args=()):
+        return self._scheduler.submit(self._tenant, function, args)
+    def map(self, function, iterable):
+        results = [
+            self._scheduler.submit(self._tenant, function, (item,))
+            for item in iterable
+        ]
+        return [result.get() for result in results]
+    def close(self):
+        # The worker threads are shared, so they keep running.
+        pass
+    def join(self):
+        self._scheduler.wait_until_idle(self._tenant)
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+def configure(max_workers, max_workers_per_tenant):
+    '''
+    Replaces the FairScheduler that is shared by this process with one that
+    has the given caps instead of the ones from the settings. The pools that
+    get_pool() returned before keep using the previous one.
+    '''
+    global _scheduler
+    with _scheduler_lock:
+        _scheduler = FairScheduler(max_workers, max_workers_per_tenant)
+
+def get_pool(tenant):
+    '''
+    Returns a TenantPool for the given tenant in the FairScheduler that is
+    shared by this process. The caps come from the settings.
+    '''
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = FairScheduler(
+                settings_loader.settings["GLOBAL_MAX_CONCURRENCY"],
+                settings_loader.settings["MAX_CONCURRENCY"]
+            )
+    return TenantPool(_scheduler, tenant)
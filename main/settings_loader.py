@@ -19,6 +19,29 @@ def _load():
                 "The {!r} key was not found in the settings.".format(key)
             )
         settings[key] = value
+    # These settings have default values.
+    OPTIONAL_KEYS = (
+        # The highest number of API requests that a scan may have in flight.
+        ("MAX_CONCURRENCY", int, 16),
+        # The highest number of API requests that all the scans in this
+        # process may have in flight together.
+        ("GLOBAL_MAX_CONCURRENCY", int, 64),
+        # If not 0, the number of bytes of files without a known duplicate
+        # that a scan may keep in memory before it writes them to disk. The
+        # names, URLs, and hashes of the files are written to disk, too.
+        ("MEMORY_BUDGET", int, 0),
+        # If not 0, files without a hash are compared by their content.
+        ("VERIFY_CONTENT", int, 0),
+        # If not empty, a folder to which profiles of some scan steps are
+        # written.
+        ("PROFILE_DIR", str, ""),
+        # The root of the Microsoft Graph API. Only change this to run against
+        # a fake server (e.g. in benchmarks).
+        ("GRAPH_API_URL", str, "https://graph.microsoft.com/v1.0"),
+    )
+    for key, type, default in OPTIONAL_KEYS:
+        value = os.environ.get(key, None)
+        settings[key] = default if value is None else type(value)
 
 def get_oauth_callback_path():
     '''
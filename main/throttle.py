@@ -0,0 +1,135 @@
+import contextlib, email.utils, random, threading, time
+
+class AdaptiveLimiter:
+    # When the API throttles a request, the limit is multiplied by this.
+    DECREASE_FACTOR = 0.5
+    # After the limit is decreased, it is not decreased again for this many
+    # seconds, so that one burst of throttled requests only counts once.
+    DECREASE_COOLDOWN = 1.0
+    # The limit is not increased while the average latency is more than this
+    # many times the lowest latency that has been seen.
+    LATENCY_TOLERANCE = 2.0
+    # The weight of the newest latency in the moving average of latencies.
+    LATENCY_SMOOTHING = 0.2
+    def __init__(self, max_limit, initial_limit=None):
+        '''
+        Limits how many requests are in flight at once. The limit is adjusted
+        by additive increase and multiplicative decrease (AIMD): it grows by
+        one for every limit's worth of fast responses, and it shrinks by half
+        when the API throttles a request. While the API has asked for requests
+        to stop (e.g. with a Retry-After header), no requests are let through.
+        
+        Arguments:
+            max_limit:
+                the highest number of requests that may be in flight at once
+            initial_limit:
+                the number of requests that may be in flight at first; by
+                default, a quarter of max_limit
+        '''
+        self._condition = threading.Condition()
+        self._max_limit = max_limit
+        self._limit = float(initial_limit or max(1, max_limit // 4))
+        self._in_flight = 0
+        self._blocked_until = 0.0
+        self._time_last_decrease = float("-inf")
+        self._latency_min = None
+        self._latency_average = None
+    @property
+    def limit(self):
+        return int(self._limit)
+    @property
+    def max_limit(self):
+        return self._max_limit
+    @property
+    def in_flight(self):
+        return self._in_flight
+    def acquire(self):
+        '''
+        Blocks until another request may be sent.
+        '''
+        with self._condition:
+            while True:
+                time_remaining = self._blocked_until - time.monotonic()
+                if time_remaining > 0:
+                    self._condition.wait(time_remaining)
+                elif self._in_flight < int(self._limit):
+                    break
+                else:
+                    self._condition.wait()
+            self._in_flight += 1
+    def release(self):
+        '''
+        Records that a request that was let through by acquire() is done.
+        '''
+        with self._condition:
+            self._in_flight -= 1
+            self._condition.notify()
+    @contextlib.contextmanager
+    def slot(self):
+        self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+    def report_success(self, latency):
+        '''
+        Records that a request succeeded after the given number of seconds.
+        '''
+        with self._condition:
+            if self._latency_average is None:
+                self._latency_average = latency
+                self._latency_min = latency
+            else:
+                self._latency_average += \
+                    (latency - self._latency_average) * self.LATENCY_SMOOTHING
+                self._latency_min = min(self._latency_min, latency)
+            if self._latency_average <= \
+                    self._latency_min * self.LATENCY_TOLERANCE:
+                limit_old = int(self._limit)
+                self._limit = \
+                    min(self._max_limit, self._limit + 1 / self._limit)
+                if int(self._limit) > limit_old:
+                    self._condition.notify_all()
+    def report_throttle(self, retry_after=None):
+        '''
+        Records that the API throttled a request.
+        
+        Arguments:
+            retry_after:
+                the number of seconds for which the API asked for requests to
+                stop, or None
+        '''
+        with self._condition:
+            now = time.monotonic()
+            if now - self._time_last_decrease >= self.DECREASE_COOLDOWN:
+                self._limit = max(1.0, self._limit * self.DECREASE_FACTOR)
+                self._time_last_decrease = now
+            if retry_after:
+                self._blocked_until = \
+                    max(self._blocked_until, now + retry_after)
+
+def backoff_delay(attempt, base=0.5, cap=60.0):
+    '''
+    Returns a random number of seconds to wait before retrying a request, given
+    the number of times that it has been retried before. The delay grows
+    exponentially with the attempt number, and it is spread out evenly ("full
+    jitter") so that many clients do not retry at the same moment.
+    '''
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+def parse_retry_after(value):
+    '''
+    Returns the number of seconds that a Retry-After header value asks for, or
+    None if the value is missing or cannot be parsed.
+    '''
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, date.timestamp() - time.time())
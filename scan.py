@@ -0,0 +1,407 @@
+#!/usr/bin/env python3
+'''
+Scans a OneDrive account for duplicate files without the web app, so that big
+scans can be run as batch jobs. The scan is saved periodically. If it is
+interrupted (e.g. with Ctrl+C), it is saved, and running this script again
+with the same --name resumes it. When the scan is complete, the groups of
+duplicates are written to a file or to standard output as they are encoded.
+
+The OAUTH_APP_ID environment variable must be set unless --access-token is
+given. The other settings of the web app (e.g. MAX_CONCURRENCY) apply, too.
+
+Usage: python scan.py --help
+'''
+import argparse, functools, humanfriendly, json, os, signal, sys
+# These settings are only used by the web app, which refuses to load without
+# them.
+for key, value in (
+    ("APP_SECRET_KEY", "unused"),
+    ("OAUTH_APP_SECRET", "unused"),
+    ("OAUTH_CALLBACK", "http://localhost:5000/callback"),
+):
+    os.environ.setdefault(key, value)
+from main import file_tree, graph_cassette, metrics, onedrive, \
+    results_export, scan_merge, scan_runner, scan_scope, scheduler, \
+    settings_loader
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Finds duplicate files in a OneDrive account."
+    )
+    auth = parser.add_argument_group("sign-in")
+    auth.add_argument(
+        "--access-token",
+        default=os.environ.get("ONEDRIVE_ACCESS_TOKEN"),
+        help="an OAuth access token to use instead of signing in; by "
+            "default, the ONEDRIVE_ACCESS_TOKEN environment variable"
+    )
+    auth.add_argument(
+        "--token-file",
+        help="a JSON file with an OAuth token to use; if it does not exist, "
+            "the token from signing in with a device code is saved to it, "
+            "and it is updated whenever the token is refreshed"
+    )
+    scan = parser.add_argument_group("scan")
+    scan.add_argument(
+        "--name",
+        default="default",
+        help="the name under which the scan is saved and resumed"
+    )
+    scan.add_argument(
+        "--method",
+        choices=("folders", "delta"),
+        default="folders",
+        help="list the drive folder by folder or all at once from the delta "
+            "feed (default: %(default)s)"
+    )
+    scan.add_argument(
+        "--order",
+        choices=sorted(file_tree.DuplicateFileScan.FOLDER_SCORES) + ["found"],
+        default="size",
+        help="the order in which to list folders (default: %(default)s)"
+    )
+    scan.add_argument(
+        "--folder",
+        action="append",
+        default=[],
+        help="a folder to scan (e.g. /Pictures); may be repeated"
+    )
+    scan.add_argument(
+        "--min-size",
+        type=lambda value: humanfriendly.parse_size(value, binary=True),
+        default=0,
+        help="skip files smaller than this (e.g. 1MB)"
+    )
+    scan.add_argument(
+        "--include",
+        action="append",
+        default=[],
+        help="only scan files whose paths match this pattern; may be repeated"
+    )
+    scan.add_argument(
+        "--exclude",
+        action="append",
+        default=[],
+        help="skip files and folders whose paths match this pattern; may be "
+            "repeated"
+    )
+    scan.add_argument(
+        "--mime-type",
+        action="append",
+        default=[],
+        help="only scan files whose MIME types start with this; may be "
+            "repeated"
+    )
+    scan.add_argument(
+        "--rescan",
+        action="store_true",
+        help="if the saved scan is complete, bring it up to date"
+    )
+    scan.add_argument(
+        "--concurrency",
+        type=int,
+        default=settings_loader.settings["MAX_CONCURRENCY"],
+        help="the highest number of API calls in flight (default: "
+            "%(default)s)"
+    )
+    scan.add_argument(
+        "--checkpoint-interval",
+        type=float,
+        default=scan_runner.ScanRunner.CHECKPOINT_INTERVAL,
+        help="the minimum number of seconds between saves (default: "
+            "%(default)s)"
+    )
+    scan.add_argument(
+        "--profile-dir",
+        default=settings_loader.settings["PROFILE_DIR"] or None,
+        help="write a profile of one in every {} steps to this folder".format(
+            scan_runner.ScanRunner.PROFILE_INTERVAL
+        )
+    )
+    recording = parser.add_argument_group("recording")
+    cassette = recording.add_mutually_exclusive_group()
+    cassette.add_argument(
+        "--record",
+        help="write anonymized copies of the API responses to this cassette "
+            "file, in which names and ids are hashed"
+    )
+    cassette.add_argument(
+        "--replay",
+        help="instead of signing in, serve the API responses from this "
+            "cassette file; folders to scan cannot be given, because their "
+            "names were hashed"
+    )
+    recording.add_argument(
+        "--replay-speed",
+        type=float,
+        default=0.0,
+        help="how many times faster than recorded to serve the responses "
+            "with --replay; 0 serves them without waiting (default: "
+            "%(default)s)"
+    )
+    merging = parser.add_argument_group("merging")
+    merging.add_argument(
+        "--merge",
+        action="append",
+        default=[],
+        metavar="NAME",
+        help="instead of scanning, find the duplicates across the saved, "
+            "complete scans with this name (e.g. of a personal and a work "
+            "account) without listing the drives again; give it once for "
+            "each scan"
+    )
+    merging.add_argument(
+        "--cross-drive-only",
+        action="store_true",
+        help="with --merge, only write the sets of duplicates that have files "
+            "from more than one scan"
+    )
+    output = parser.add_argument_group("output")
+    output.add_argument(
+        "--format",
+        choices=sorted(results_export.FORMATS),
+        default="ndjson",
+        help="the format of the results (default: %(default)s)"
+    )
+    output.add_argument(
+        "--output",
+        default="-",
+        help="the file to which to write the results (default: standard "
+            "output)"
+    )
+    output.add_argument(
+        "--progress-interval",
+        type=float,
+        default=10.0,
+        help="the number of seconds between progress reports on standard "
+            "error (default: %(default)s)"
+    )
+    output.add_argument(
+        "--metrics-file",
+        help="write the counters and latencies of the run to this file in "
+            "the Prometheus text format when it ends"
+    )
+    args = parser.parse_args()
+    if args.replay and args.folder:
+        parser.error("--folder cannot be used with --replay")
+    if args.merge and (args.record or args.replay):
+        parser.error("--merge cannot be used with --record or --replay")
+    return args
+
+def get_token(args):
+    if args.access_token:
+        return {"access_token": args.access_token, "token_type": "Bearer"}
+    if args.token_file and os.path.exists(args.token_file):
+        with open(args.token_file) as f:
+            return json.load(f)
+    token = onedrive.get_token_by_device_code(
+        lambda message: print(message, file=sys.stderr)
+    )
+    if args.token_file:
+        write_token_file(args.token_file, token)
+    return token
+
+def write_token_file(filename, token):
+    # Write to another file first so that the refresh token is never lost
+    # to a half-written file.
+    with open(filename + ".tmp", "w") as f:
+        json.dump(token, f)
+    os.replace(filename + ".tmp", filename)
+
+def print_progress(status):
+    print(
+        "{}: {} folder(s) discovered, {} waiting; {} file(s) scanned "
+        "totaling {}; {} set(s) of duplicates; {:,.0f} file(s) per "
+        "second".format(
+            status["state"],
+            humanfriendly.format_number(status["numDiscoveredFolders"]),
+            humanfriendly.format_number(status["numQueuedFolders"]),
+            humanfriendly.format_number(status["numScannedFiles"]),
+            humanfriendly.format_size(
+                status["totalBytesScannedFiles"],
+                binary=True
+            ),
+            humanfriendly.format_number(status["numDuplicateGroups"]),
+            status["filesPerSecond"]
+        ),
+        file=sys.stderr
+    )
+
+def write_results(format, filename, duplicates, hash_type, duplicate_folders):
+    iter_export = results_export.FORMATS[format][1]
+    if filename == "-":
+        f = sys.stdout
+    else:
+        f = open(filename, "w", newline="", encoding="UTF-8")
+    try:
+        for chunk in results_export.iter_timed(
+            format,
+            iter_export(duplicates, hash_type, duplicate_folders)
+        ):
+            f.write(chunk)
+    finally:
+        if f is not sys.stdout:
+            f.close()
+
+def write_metrics(filename):
+    # Write to another file first so that a collector never reads half of it.
+    with open(filename + ".tmp", "w", encoding="UTF-8") as f:
+        f.write(metrics.render())
+    os.replace(filename + ".tmp", filename)
+
+def main():
+    args = parse_args()
+    try:
+        return run(args)
+    finally:
+        if args.metrics_file:
+            write_metrics(args.metrics_file)
+
+def get_client(args):
+    if args.replay:
+        return graph_cassette.ReplayClient(
+            args.replay,
+            args.concurrency,
+            args.replay_speed
+        )
+    client = onedrive.GraphClient(
+        get_token(args),
+        args.concurrency,
+        # Keep the refreshed token for the next run.
+        token_updater=functools.partial(write_token_file, args.token_file)
+            if args.token_file else None
+    )
+    if args.record:
+        return graph_cassette.RecordingClient(client, args.record)
+    return client
+
+def merge(args):
+    scans = []
+    for name in args.merge:
+        # The scans are only read, so they may be merged while running.
+        try:
+            scan = file_tree.DuplicateFileScan.load(
+                ("scan.py", name),
+                None,
+                None,
+                read_only=True
+            )
+        except file_tree.DuplicateFileScan.NoSuchSave:
+            print(
+                "There is no saved scan named {}.".format(name),
+                file=sys.stderr
+            )
+            return 1
+        if not scan.complete:
+            print(
+                "The scan named {0} is not complete. Run it with --name {0} "
+                "first.".format(name),
+                file=sys.stderr
+            )
+            return 1
+        scans.append(scan)
+    merged = scan_merge.MergedDuplicateIndex(scans)
+    print(
+        "{} set(s) of duplicates in {} scan(s), containing {} file(s); {} "
+        "could be freed".format(
+            humanfriendly.format_number(merged.num_groups),
+            len(scans),
+            humanfriendly.format_number(merged.num_duplicate_files),
+            humanfriendly.format_size(merged.reclaimable_bytes, binary=True)
+        ),
+        file=sys.stderr
+    )
+    write_results(
+        args.format,
+        args.output,
+        merged.get_duplicates(args.cross_drive_only),
+        merged.hash_type,
+        ()
+    )
+    return 0
+
+def run(args):
+    if args.merge:
+        return merge(args)
+    # This is the only scan in the process, so it may use every worker.
+    scheduler.configure(args.concurrency, args.concurrency)
+    try:
+        client = get_client(args)
+    except onedrive.DeviceCodeError as e:
+        print("The sign-in failed: {}".format(e), file=sys.stderr)
+        return 1
+    # The access token changes from one sign-in to the next, so save the scan
+    # under its name instead. Keep replays apart from real scans.
+    if args.replay:
+        save_token = ("scan.py", "replay", args.name)
+    else:
+        save_token = ("scan.py", args.name)
+    # Make sure that no other process (e.g. the web app or another run of
+    # this script) is advancing the same scan.
+    lock = scan_runner.acquire_lock(save_token)
+    if lock is None:
+        print(
+            "Another process is running the scan named {}.".format(args.name),
+            file=sys.stderr
+        )
+        client.close()
+        return 1
+    scan = scan_runner.load_or_create_scan(
+        save_token,
+        client,
+        args.method,
+        args.order,
+        scan_scope.ScanScope(
+            folder_paths=args.folder,
+            min_size=args.min_size,
+            include_globs=args.include,
+            exclude_globs=args.exclude,
+            mime_types=args.mime_type
+        )
+    )
+    if args.rescan:
+        scan.rescan()
+    runner = scan_runner.ScanRunner(
+        save_token,
+        scan,
+        args.checkpoint_interval,
+        args.profile_dir,
+        lock
+    )
+    # Stop and save the scan between steps rather than in the middle of one.
+    signal.signal(signal.SIGINT, lambda signum, frame: runner.stop())
+    runner.start()
+    while not runner.join(args.progress_interval):
+        print_progress(runner.status())
+    print_progress(runner.status())
+    client.close()
+    if args.replay and client.num_misses:
+        print(
+            "{} API call(s) had no recorded response.".format(
+                client.num_misses
+            ),
+            file=sys.stderr
+        )
+    if runner.state == scan_runner.ERROR:
+        print(runner.error, file=sys.stderr)
+        if runner.error_api_url is not None:
+            print("API URL: {}".format(runner.error_api_url), file=sys.stderr)
+        return 1
+    if runner.state != scan_runner.COMPLETE:
+        print(
+            "The scan was saved. Run this again with --name {} to resume "
+            "it.".format(args.name),
+            file=sys.stderr
+        )
+        return 130
+    write_results(
+        args.format,
+        args.output,
+        scan.get_duplicates(collapse_folders=True),
+        scan.hash_type,
+        scan.get_duplicate_folders()
+    )
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,9 @@
+import os
+# The app refuses to load without these settings.
+for key, value in (
+    ("APP_SECRET_KEY", "test"),
+    ("OAUTH_APP_ID", "test"),
+    ("OAUTH_APP_SECRET", "test"),
+    ("OAUTH_CALLBACK", "http://localhost:5000/callback"),
+):
+    os.environ.setdefault(key, value)
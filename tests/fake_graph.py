@@ -0,0 +1,482 @@
+import base64, contextlib, hashlib, io, itertools, json, requests, \
+    requests.adapters, tempfile, threading, unittest, unittest.mock, \
+    urllib.parse
+from main import onedrive, settings_loader, throttle
+
+# The fake drive answers requests for this part of the URL of the API.
+_API_PATH = "/v1.0"
+_ROOT_PATH = "/me/drive/root"
+_ITEMS_PATH = "/me/drive/items/"
+_TOKEN_PATH = "/common/oauth2/v2.0/token"
+_API_URL = "https://graph.microsoft.com" + _API_PATH
+
+# These are the error codes that the API gives with some status codes.
+_ERROR_CODES = {
+    403: "accessDenied",
+    404: "itemNotFound",
+    429: "activityLimitReached",
+    503: "serviceNotAvailable",
+}
+
+def get_hashes(content, personal=True):
+    '''
+    Returns the hashes that the fake drive gives a file with the given
+    content. Personal drives have SHA-1 hashes and QuickXorHashes, and other
+    drives only have QuickXorHashes. The QuickXorHash is not the real one,
+    but it is as unique.
+    '''
+    hashes = {
+        "quickXorHash": base64.b64encode(
+            hashlib.sha1(b"quickXor" + content).digest()
+        ).decode("ASCII"),
+    }
+    if personal:
+        hashes["sha1Hash"] = hashlib.sha1(content).hexdigest().upper()
+    return hashes
+
+class _CountingReader(io.BytesIO):
+    def __init__(self, content, drive):
+        # This counts the bytes of the response that the client reads.
+        super().__init__(content)
+        self._drive = drive
+    def read(self, *args):
+        data = super().read(*args)
+        with self._drive.lock:
+            self._drive.num_bytes_read += len(data)
+        return data
+
+class FakeDrive:
+    def __init__(self, personal=True, page_size=3, delta_page_size=5):
+        '''
+        Stands in for a OneDrive and the parts of the Microsoft Graph API that
+        the app uses. Use serve() to send the app's requests to it instead of
+        the network.
+
+        Arguments:
+            personal:
+                whether the drive is a personal one, which determines the
+                hashes that files have
+            page_size:
+                the largest number of children in each page of a folder
+            delta_page_size:
+                the largest number of items in each page of the delta feed
+        '''
+        self.lock = threading.RLock()
+        self.personal = personal
+        self.page_size = page_size
+        self.delta_page_size = delta_page_size
+        self.drive_id = "drive"
+        # Whether downloads honor the Range header.
+        self.honor_range = True
+        # Delta tokens below this number have expired.
+        self.oldest_delta_token = 0
+        # These record the requests that were made.
+        self.urls = []
+        self.num_bytes_read = 0
+        self.refreshes = []
+        # Requests with these access tokens are rejected with a 401.
+        self.rejected_tokens = set()
+        self._failures = []
+        self._items = {}
+        self._next_ids = itertools.count(1)
+        self._children = {}
+        # This lists the ids of the items in the order in which they changed,
+        # for the delta feed.
+        self._changes = []
+        self._items["root"] = {"id": "root", "name": "root", "folder": True}
+        self._children["root"] = []
+    def add_folder(self, parent_id, name, id=None):
+        '''
+        Adds a folder and returns its id.
+        '''
+        with self.lock:
+            id = id or self._new_id()
+            self._items[id] = {
+                "id": id,
+                "name": name,
+                "parent_id": parent_id,
+                "folder": True,
+            }
+            self._children[id] = []
+            self._children[parent_id].append(id)
+            self._changes.append(id)
+            return id
+    def add_file(
+        self,
+        parent_id,
+        name,
+        content=b"",
+        id=None,
+        hashes=None,
+        mime_type="application/octet-stream"
+    ):
+        '''
+        Adds a file and returns its id. By default, it has the hashes from
+        get_hashes(). Pass an empty dictionary for a file without hashes.
+        '''
+        with self.lock:
+            id = id or self._new_id()
+            self._items[id] = {
+                "id": id,
+                "name": name,
+                "parent_id": parent_id,
+                "folder": False,
+                "content": content,
+                "hashes": get_hashes(content, self.personal)
+                    if hashes is None else hashes,
+                "mime_type": mime_type,
+            }
+            self._children[parent_id].append(id)
+            self._changes.append(id)
+            return id
+    def set_content(self, id, content):
+        '''
+        Changes the content of a file, and its hashes.
+        '''
+        with self.lock:
+            item = self._items[id]
+            item["content"] = content
+            if item["hashes"]:
+                item["hashes"] = get_hashes(content, self.personal)
+            self._changes.append(id)
+    def move(self, id, parent_id=None, name=None):
+        '''
+        Moves or renames a file or folder.
+        '''
+        with self.lock:
+            item = self._items[id]
+            if parent_id is not None:
+                self._children[item["parent_id"]].remove(id)
+                self._children[parent_id].append(id)
+                item["parent_id"] = parent_id
+            if name is not None:
+                item["name"] = name
+            self._changes.append(id)
+    def delete(self, id):
+        '''
+        Deletes a file, or a folder and everything in it.
+        '''
+        with self.lock:
+            self._children[self._items[id]["parent_id"]].remove(id)
+            self._delete(id)
+    def get_path(self, id):
+        '''
+        Returns the path of the item with the given id as the API gives it
+        (e.g. /drive/root:/Pictures/a.jpg).
+        '''
+        with self.lock:
+            parts = []
+            while id != "root":
+                item = self._items[id]
+                parts.append(item["name"])
+                id = item["parent_id"]
+            return "/drive/root:" + "".join(
+                "/" + part for part in reversed(parts)
+            )
+    def fail(self, url_part, status, count=1, headers=None):
+        '''
+        Makes the next count requests whose URLs contain url_part, including
+        requests within batches, fail with the given status code. If the
+        status is an exception instead, it is raised (e.g. to act as if the
+        connection failed).
+        '''
+        with self.lock:
+            self._failures.append([url_part, status, count, headers or {}])
+    def expire_delta_tokens(self):
+        '''
+        Makes every delta link that was given out so far expire.
+        '''
+        with self.lock:
+            # A token is the number of changes before it, so count a change
+            # that sets the new tokens apart from the old ones.
+            self._changes.append(None)
+            self.oldest_delta_token = len(self._changes)
+    @contextlib.contextmanager
+    def serve(self):
+        '''
+        Sends every request that is made with the requests library to this
+        drive until the context is exited.
+        '''
+        drive = self
+        def send(adapter, request, **kwargs):
+            return drive._send(request)
+        with unittest.mock.patch.object(
+            requests.adapters.HTTPAdapter,
+            "send",
+            send
+        ):
+            yield self
+    def _send(self, request):
+        status, headers, content = self._handle(
+            request.method,
+            request.url,
+            request.headers,
+            request.body
+        )
+        response = requests.Response()
+        response.status_code = status
+        response.headers.update(headers)
+        response.raw = _CountingReader(content, self)
+        response.url = request.url
+        response.request = request
+        response.encoding = "UTF-8"
+        return response
+    def _handle(self, method, url, headers, body):
+        with self.lock:
+            self.urls.append(url)
+            parsed = urllib.parse.urlparse(url)
+            if parsed.path == _TOKEN_PATH:
+                return self._refresh(body)
+            authorization = headers.get("Authorization", "")
+            if authorization.rpartition(" ")[2] in self.rejected_tokens:
+                return self._json(401, {"error": {"code": "unauthenticated"}})
+            if method == "POST" and parsed.path == _API_PATH + "/$batch":
+                return self._batch(json.loads(body))
+            return self._get(url, headers)
+    def _get(self, url, headers):
+        for failure in self._failures:
+            if failure[0] in url and failure[2] > 0:
+                failure[2] -= 1
+                if isinstance(failure[1], Exception):
+                    raise failure[1]
+                return self._json(
+                    failure[1],
+                    {"error": {"code": _ERROR_CODES.get(
+                        failure[1],
+                        "generalException"
+                    )}},
+                    failure[3]
+                )
+        parsed = urllib.parse.urlparse(url)
+        path = urllib.parse.unquote(parsed.path)
+        if path.startswith(_API_PATH):
+            path = path[len(_API_PATH):]
+        query = urllib.parse.parse_qs(parsed.query)
+        if path == "/organization":
+            return self._json(
+                200,
+                {"value": [] if self.personal else [{"id": "organization"}]}
+            )
+        if path == "/me/drive":
+            return self._json(200, {"id": self.drive_id})
+        if path == _ROOT_PATH + "/delta":
+            return self._delta(query)
+        if path.startswith(_ROOT_PATH + ":") and path.endswith(":/children"):
+            folder_id = self._find_path(
+                path[len(_ROOT_PATH) + 1:-len(":/children")]
+            )
+            return self._list_children(folder_id, url, query)
+        if path == _ROOT_PATH + "/children":
+            return self._list_children("root", url, query)
+        if path.startswith(_ITEMS_PATH) and path.endswith("/children"):
+            folder_id = path[len(_ITEMS_PATH):-len("/children")]
+            return self._list_children(folder_id, url, query)
+        if path.startswith(_ITEMS_PATH) and path.endswith("/content"):
+            file_id = path[len(_ITEMS_PATH):-len("/content")]
+            return self._download(file_id, headers)
+        return self._json(400, {"error": {"code": "invalidRequest"}})
+    def _batch(self, body):
+        responses = []
+        for request in body["requests"]:
+            status, headers, content = \
+                self._get(_API_PATH + request["url"], {})
+            responses.append({
+                "id": request["id"],
+                "status": status,
+                "headers": headers,
+                "body": json.loads(content.decode("UTF-8")),
+            })
+        return self._json(200, {"responses": responses})
+    def _refresh(self, body):
+        self.refreshes.append(body)
+        number = len(self.refreshes)
+        return self._json(200, {
+            "access_token": "refreshed-{}".format(number),
+            "refresh_token": "refresh-{}".format(number),
+            "token_type": "Bearer",
+            "expires_in": 3600,
+            "scope": "User.Read Files.Read offline_access",
+        })
+    def _find_path(self, path):
+        # OneDrive compares paths without regard to case.
+        folder_id = "root"
+        for name in path.strip("/").split("/"):
+            if not name:
+                continue
+            for child_id in self._children.get(folder_id, ()):
+                if self._items[child_id]["name"].casefold() == \
+                        name.casefold():
+                    folder_id = child_id
+                    break
+            else:
+                return None
+        return folder_id
+    def _list_children(self, folder_id, url, query):
+        if folder_id not in self._children:
+            return self._json(404, {"error": {"code": "itemNotFound"}})
+        children = self._children[folder_id]
+        start = int(query.get("$skiptoken", ["0"])[0])
+        end = start + self.page_size
+        body = {
+            "value": [
+                self._to_json(self._items[child_id], True)
+                for child_id in children[start:end]
+            ]
+        }
+        if end < len(children):
+            body["@odata.nextLink"] = "{}&$skiptoken={}".format(
+                _API_URL + url.partition(_API_PATH)[2].partition(
+                    "&$skiptoken="
+                )[0],
+                end
+            )
+        return self._json(200, body)
+    def _delta(self, query):
+        url = _API_URL + _ROOT_PATH + "/delta?"
+        token = query.get("token", [None])[0]
+        if token == "latest":
+            return self._json(200, {
+                "value": [],
+                "@odata.deltaLink":
+                    url + "token={}".format(len(self._changes)),
+            })
+        if token is None:
+            # List the whole drive, parents before their children.
+            ids = ["root"]
+            for id in ids:
+                ids.extend(self._children.get(id, ()))
+        else:
+            token = int(token)
+            if token < self.oldest_delta_token:
+                return self._json(410, {"error": {"code": "resyncRequired"}})
+            # Give the latest state of each item that changed.
+            ids = list(dict.fromkeys(self._changes[token:]))
+        start = int(query.get("skip", ["0"])[0])
+        end = start + self.delta_page_size
+        body = {
+            "value": [
+                self._to_json(self._items[id], False)
+                if id in self._items else {"id": id, "deleted": {}}
+                for id in ids[start:end]
+            ]
+        }
+        if end < len(ids):
+            body["@odata.nextLink"] = url + urllib.parse.urlencode(
+                dict(
+                    [("token", token)] if token is not None else [],
+                    skip=end
+                )
+            )
+        else:
+            body["@odata.deltaLink"] = \
+                url + "token={}".format(len(self._changes))
+        return self._json(200, body)
+    def _download(self, file_id, headers):
+        item = self._items.get(file_id)
+        if item is None or item["folder"]:
+            return self._json(404, {"error": {"code": "itemNotFound"}})
+        content = item["content"]
+        range = headers.get("Range")
+        if range and self.honor_range:
+            start, _, end = range.partition("=")[2].partition("-")
+            return 206, {}, content[int(start):int(end) + 1]
+        return 200, {}, content
+    def _delete(self, id):
+        for child_id in self._children.pop(id, ()):
+            self._delete(child_id)
+        del self._items[id]
+        self._changes.append(id)
+    def _new_id(self):
+        return "item{}".format(next(self._next_ids))
+    def _get_size(self, id):
+        item = self._items[id]
+        if not item["folder"]:
+            return len(item["content"])
+        return sum(self._get_size(child_id) for child_id in self._children[id])
+    def _to_json(self, item, with_path):
+        if item["id"] == "root":
+            return {
+                "id": "root",
+                "name": "root",
+                "size": self._get_size("root"),
+                "webUrl": "https://onedrive.example.com/root",
+                "root": {},
+                "folder": {"childCount": len(self._children["root"])},
+            }
+        parent_reference = {"id": item["parent_id"]}
+        if with_path:
+            parent_reference["path"] = urllib.parse.quote(
+                self.get_path(item["parent_id"])
+            )
+        result = {
+            "id": item["id"],
+            "name": item["name"],
+            "size": self._get_size(item["id"]),
+            "webUrl": "https://onedrive.example.com/" + item["id"],
+            "parentReference": parent_reference,
+        }
+        if item["folder"]:
+            result["folder"] = {"childCount": len(self._children[item["id"]])}
+        else:
+            result["file"] = {
+                "mimeType": item["mime_type"],
+                "hashes": item["hashes"],
+            }
+        return result
+    @staticmethod
+    def _json(status, body, headers=None):
+        headers = dict(headers or {})
+        headers["Content-Type"] = "application/json"
+        return status, headers, json.dumps(body).encode("UTF-8")
+
+class DriveTestCase(unittest.TestCase):
+    '''
+    Runs each test against a new FakeDrive, with the saved scans in a
+    temporary folder and without waiting between retries.
+    '''
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self._patch(unittest.mock.patch.object(
+            tempfile,
+            "tempdir",
+            temp_dir.name
+        ))
+        self._patch(unittest.mock.patch.object(
+            throttle,
+            "backoff_delay",
+            lambda attempt: 0.0
+        ))
+        self._patch(unittest.mock.patch.dict(settings_loader.settings))
+        self.drive = self.make_drive()
+        self._patch(self.drive.serve())
+        self.client = onedrive.GraphClient(
+            {"access_token": "token", "token_type": "Bearer"},
+            4
+        )
+        self.addCleanup(self.client.close)
+    def make_drive(self):
+        return FakeDrive()
+    def scan_until_complete(self, scan, max_steps=1000):
+        '''
+        Steps the scan until it is complete, and fails if it takes more than
+        the given number of steps.
+        '''
+        for _ in range(max_steps):
+            if scan.complete:
+                return scan
+            scan.step()
+        self.fail("The scan did not complete.")
+    @staticmethod
+    def get_groups(scan):
+        '''
+        Returns the groups of duplicates of the scan as a sorted list of
+        sorted lists of file ids.
+        '''
+        return sorted(
+            sorted(file.id for file in group)
+            for group in scan.get_duplicates()
+        )
+    def _patch(self, context):
+        context.__enter__()
+        self.addCleanup(context.__exit__, None, None, None)
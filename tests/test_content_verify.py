@@ -0,0 +1,119 @@
+import unittest
+from main import content_verify, scan_runner, settings_loader
+from . import fake_graph
+
+class GetContentDigestsTest(unittest.TestCase):
+    def get_digests(self, contents, **kwargs):
+        reads = []
+        def read_range(file_id, start, end):
+            reads.append((file_id, start, end))
+            content = contents[file_id]
+            if content is None:
+                raise KeyError(file_id)
+            return content[start:end]
+        digests = content_verify.get_content_digests(
+            list(contents),
+            len(next(content for content in contents.values() if content)),
+            read_range,
+            **kwargs
+        )
+        return digests, reads
+    def test_difference_in_first_range(self):
+        size = content_verify.FIRST_RANGE_SIZE * 4
+        digests, reads = self.get_digests({
+            "a": b"a" * size,
+            "b": b"b" + b"a" * (size - 1),
+            "c": b"a" * size,
+        })
+        self.assertEqual(digests["a"], digests["c"])
+        self.assertNotEqual(digests["a"], digests["b"])
+        # The file that differs is only read once.
+        self.assertEqual(len([read for read in reads if read[0] == "b"]), 1)
+    def test_difference_in_later_range(self):
+        first = content_verify.FIRST_RANGE_SIZE
+        size = first * 4
+        digests, reads = self.get_digests({
+            "a": b"a" * size,
+            "b": b"a" * (size - 1) + b"b",
+        })
+        self.assertNotEqual(digests["a"], digests["b"])
+        # Each range is twice as large as the one before it, and the last
+        # one stops at the end of the file.
+        self.assertEqual(
+            [(start, end) for file_id, start, end in reads if file_id == "a"],
+            [(0, first), (first, first * 3), (first * 3, size)]
+        )
+    def test_unreadable_file(self):
+        digests, reads = self.get_digests(
+            {"a": b"same", "b": None, "c": b"same"},
+            errors=(KeyError,)
+        )
+        self.assertIsNone(digests["b"])
+        self.assertEqual(digests["a"], digests["c"])
+        with self.assertRaises(KeyError):
+            self.get_digests({"a": b"same", "b": None})
+
+class ContentVerificationTest(fake_graph.DriveTestCase):
+    def make_drive(self):
+        return fake_graph.FakeDrive(personal=False)
+    def setUp(self):
+        super().setUp()
+        settings_loader.settings["VERIFY_CONTENT"] = 1
+        # These files have no hash, so they are compared by their content.
+        self.same_ids = [
+            self.drive.add_file("root", name, b"same", hashes={})
+            for name in ("a", "b", "c")
+        ]
+        self.other_id = self.drive.add_file("root", "d", b"diff", hashes={})
+    def scan_until_verifying(self):
+        scan = scan_runner.load_or_create_scan("token", self.client)
+        self.addCleanup(scan.close)
+        while not scan.verifying:
+            scan.step()
+        return scan
+    def test_verify(self):
+        scan = self.scan_until_verifying()
+        # Until then, the files are grouped by size.
+        self.assertEqual(
+            self.get_groups(scan),
+            [sorted(self.same_ids + [self.other_id])]
+        )
+        self.scan_until_complete(scan)
+        self.assertEqual(self.get_groups(scan), [sorted(self.same_ids)])
+    def test_deleted_file(self):
+        scan = self.scan_until_verifying()
+        self.drive.delete(self.same_ids[0])
+        self.scan_until_complete(scan)
+        self.assertEqual(self.get_groups(scan), [sorted(self.same_ids[1:])])
+        self.assertEqual(scan.num_scanned_files, 4)
+    def test_forbidden_file(self):
+        scan = self.scan_until_verifying()
+        self.drive.fail(self.same_ids[2] + "/content", 403, 100)
+        self.scan_until_complete(scan)
+        self.assertEqual(self.get_groups(scan), [sorted(self.same_ids[:2])])
+        # The file that could not be read is not compared again after a
+        # save.
+        scan.save("token")
+        loaded = scan_runner.load_or_create_scan("token", self.client)
+        self.addCleanup(loaded.close)
+        self.assertTrue(loaded.complete)
+        self.assertEqual(self.get_groups(loaded), self.get_groups(scan))
+    def test_range_ignored(self):
+        # The files differ only near their ends.
+        content = b"x" * (content_verify.FIRST_RANGE_SIZE * 5)
+        file_ids = [
+            self.drive.add_file(
+                "root",
+                "large {}".format(number),
+                content + str(number // 2).encode("ASCII"),
+                hashes={}
+            )
+            for number in range(3)
+        ]
+        self.drive.honor_range = False
+        scan = self.scan_until_verifying()
+        self.scan_until_complete(scan)
+        self.assertEqual(
+            self.get_groups(scan),
+            sorted([sorted(self.same_ids), sorted(file_ids[:2])])
+        )
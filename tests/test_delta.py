@@ -0,0 +1,133 @@
+from main import file_tree, onedrive, scan_runner
+from . import fake_graph
+
+class RescanTest(fake_graph.DriveTestCase):
+    # This is how the drive is first listed.
+    METHOD = "folders"
+    TOKEN = "token"
+    def setUp(self):
+        super().setUp()
+        self.folder_id = self.drive.add_folder("root", "Pictures")
+        self.photo_ids = [
+            self.drive.add_file("root", "a.jpg", b"photo"),
+            self.drive.add_file(self.folder_id, "b.jpg", b"photo"),
+        ]
+        self.text_id = self.drive.add_file("root", "c.txt", b"text")
+        self.scan = scan_runner.load_or_create_scan(
+            self.TOKEN,
+            self.client,
+            self.METHOD
+        )
+        self.addCleanup(self.scan.close)
+        self.scan_until_complete(self.scan)
+        self.assertEqual(self.get_groups(self.scan), [sorted(self.photo_ids)])
+    def rescan(self):
+        self.assertTrue(self.scan.rescan())
+        self.scan_until_complete(self.scan)
+    def get_paths(self):
+        return sorted(
+            "{}/{}".format(file.parent_path, file.name)
+            for group in self.scan.get_duplicates()
+            for file in group
+        )
+    def test_add(self):
+        text_id = self.drive.add_file(self.folder_id, "d.txt", b"text")
+        self.rescan()
+        self.assertEqual(
+            self.get_groups(self.scan),
+            sorted([sorted(self.photo_ids), sorted([self.text_id, text_id])])
+        )
+        self.assertEqual(self.scan.num_scanned_files, 4)
+    def test_change(self):
+        self.drive.set_content(self.text_id, b"photo")
+        self.rescan()
+        self.assertEqual(
+            self.get_groups(self.scan),
+            [sorted(self.photo_ids + [self.text_id])]
+        )
+        self.assertEqual(self.scan.num_scanned_files, 3)
+    def test_move(self):
+        folder_id = self.drive.add_folder("root", "Old")
+        self.drive.move(self.folder_id, folder_id)
+        self.drive.move(self.photo_ids[0], name="c.jpg")
+        self.rescan()
+        self.assertEqual(self.get_paths(), [
+            "/drive/root:/Old/Pictures/b.jpg",
+            "/drive/root:/c.jpg",
+        ])
+    def test_delete(self):
+        self.drive.delete(self.photo_ids[0])
+        self.rescan()
+        self.assertEqual(self.get_groups(self.scan), [])
+        self.assertEqual(self.scan.num_scanned_files, 2)
+    def test_delete_folder(self):
+        self.drive.add_file("root", "e.jpg", b"photo")
+        self.drive.delete(self.folder_id)
+        self.rescan()
+        self.assertEqual(self.get_paths(), [
+            "/drive/root:/a.jpg",
+            "/drive/root:/e.jpg",
+        ])
+        self.assertEqual(self.scan.num_scanned_files, 3)
+    def test_delete_folders(self):
+        folder_id = self.drive.add_folder("root", "Old")
+        self.drive.add_file(folder_id, "d.jpg", b"photo")
+        # Only the folders that were deleted are removed, not others whose
+        # names start the same.
+        folder_id_kept = self.drive.add_folder("root", "Pictures 2")
+        self.drive.add_file(folder_id_kept, "e.jpg", b"photo")
+        self.rescan()
+        self.scan.save(self.TOKEN)
+        self.drive.delete(self.folder_id)
+        self.drive.delete(folder_id)
+        self.rescan()
+        self.assertEqual(self.get_paths(), [
+            "/drive/root:/Pictures 2/e.jpg",
+            "/drive/root:/a.jpg",
+        ])
+        # The removal was saved.
+        self.scan.save(self.TOKEN)
+        loaded = file_tree.DuplicateFileScan.load(self.TOKEN, None, None)
+        self.addCleanup(loaded.close)
+        self.assertEqual(self.get_groups(loaded), self.get_groups(self.scan))
+    def test_resync(self):
+        # The changes since the scan are no longer available, so the whole
+        # drive is listed again.
+        self.drive.expire_delta_tokens()
+        self.drive.delete(self.photo_ids[0])
+        text_id = self.drive.add_file(self.folder_id, "d.txt", b"text")
+        self.assertTrue(self.scan.rescan())
+        with self.assertRaises(file_tree.DuplicateFileScan.DeltaExpired):
+            self.scan.step()
+        self.scan.resync(onedrive.get_root_delta_url())
+        self.scan_until_complete(self.scan)
+        self.assertEqual(
+            self.get_groups(self.scan),
+            [sorted([self.text_id, text_id])]
+        )
+        self.assertEqual(self.scan.num_scanned_files, 3)
+        # The new delta link is used for the next rescan.
+        self.drive.add_file("root", "f.jpg", b"photo")
+        self.rescan()
+        self.assertEqual(self.scan.num_scanned_files, 4)
+        self.assertEqual(len(self.get_groups(self.scan)), 2)
+        # The resync was saved.
+        self.scan.save(self.TOKEN)
+        loaded = file_tree.DuplicateFileScan.load(self.TOKEN, None, None)
+        self.addCleanup(loaded.close)
+        self.assertEqual(self.get_groups(loaded), self.get_groups(self.scan))
+    def test_resync_in_runner(self):
+        self.addCleanup(scan_runner._runners.clear)
+        self.scan.save(self.TOKEN)
+        runner = scan_runner.start_runner(self.TOKEN, lambda: self.scan)
+        self.assertTrue(runner.join(10))
+        self.drive.expire_delta_tokens()
+        self.drive.delete(self.photo_ids[0])
+        runner = scan_runner.rescan_runner(self.TOKEN, lambda: self.scan)
+        self.assertIsNotNone(runner)
+        self.assertTrue(runner.join(10))
+        self.assertEqual(runner.state, scan_runner.COMPLETE)
+        self.assertEqual(runner.scan.num_scanned_files, 2)
+
+class DeltaRescanTest(RescanTest):
+    METHOD = "delta"
@@ -0,0 +1,74 @@
+import unittest
+from main import duplicate_index
+
+def make_key(size, hash):
+    return size.to_bytes(8, "little") + hash
+
+class DuplicateIndexTest(unittest.TestCase):
+    def make_index(self):
+        return duplicate_index.DuplicateIndex()
+    def get_groups(self, index):
+        index.merge()
+        return {key: sorted(group) for key, group in index.groups.items()}
+    def test_totals(self):
+        index = self.make_index()
+        key = make_key(10, b"a")
+        for file_index in range(3):
+            index.add(key, file_index)
+        index.add(make_key(10, b"b"), 3)
+        self.assertEqual(self.get_groups(index), {key: [0, 1, 2]})
+        self.assertEqual(index.num_groups, 1)
+        self.assertEqual(index.num_duplicate_files, 3)
+        self.assertEqual(index.reclaimable_bytes, 20)
+        index.remove(key, 1)
+        self.assertEqual(index.num_duplicate_files, 2)
+        self.assertEqual(index.reclaimable_bytes, 10)
+        index.remove(key, 0)
+        self.assertEqual(self.get_groups(index), {})
+        self.assertEqual(index.num_groups, 0)
+        self.assertEqual(index.num_duplicate_files, 0)
+        self.assertEqual(index.reclaimable_bytes, 0)
+        # The file that is left forms a group with the next one.
+        index.add(key, 4)
+        self.assertEqual(self.get_groups(index), {key: [2, 4]})
+    def test_many_files(self):
+        index = self.make_index()
+        for file_index in range(1000):
+            index.add(make_key(file_index % 300, b"h"), file_index)
+        index.remove(make_key(0, b"h"), 0)
+        groups = self.get_groups(index)
+        self.assertEqual(len(groups), 300)
+        self.assertEqual(groups[make_key(0, b"h")], [300, 600, 900])
+        self.assertEqual(groups[make_key(299, b"h")], [299, 599, 899])
+        self.assertEqual(index.num_duplicate_files, 999)
+    def test_remove_and_add_again(self):
+        index = self.make_index()
+        for file_index in range(1000):
+            index.add(make_key(file_index, b"h"), file_index)
+        # The file is the same before and after; it is not counted twice.
+        for file_index in (5, 999):
+            index.remove(make_key(file_index, b"h"), file_index)
+            index.add(make_key(file_index, b"h"), file_index)
+        index.add(make_key(5, b"h"), 1000)
+        index.add(make_key(999, b"h"), 1001)
+        self.assertEqual(self.get_groups(index), {
+            make_key(5, b"h"): [5, 1000],
+            make_key(999, b"h"): [999, 1001],
+        })
+        self.assertEqual(index.num_duplicate_files, 4)
+
+class SpillingDuplicateIndexTest(DuplicateIndexTest):
+    def make_index(self):
+        return duplicate_index.SpillingDuplicateIndex(1000)
+    def test_spill(self):
+        index = self.make_index()
+        for file_index in range(1000):
+            index.add(make_key(file_index, b"h"), file_index)
+        self.assertGreater(index.num_runs, 1)
+        # A file whose duplicate was written to disk is found by merge().
+        index.add(make_key(5, b"h"), 1000)
+        self.assertEqual(
+            self.get_groups(index),
+            {make_key(5, b"h"): [5, 1000]}
+        )
+        self.assertEqual(index.num_runs, 1)
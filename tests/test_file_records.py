@@ -0,0 +1,81 @@
+import pickle, unittest
+from main import file_records, file_tree, settings_loader, scan_runner
+from . import fake_graph
+
+def make_file(number):
+    content = str(number % 7).encode("ASCII")
+    return file_tree.File(
+        id="file{}".format(number),
+        name="IMG_{:04d}.jpg".format(number),
+        size=len(content) * 1000,
+        url="https://onedrive.example.com/file{}".format(number),
+        parent_id="folder{}".format(number // 10),
+        parent_path="/drive/root:/Pictures/{}".format(number // 10),
+        mime_type="image/jpeg",
+        # Some files have no SHA-1 hash or a hash that is not hexadecimal.
+        hashes=dict(
+            (
+                (hash_type, hash)
+                for hash_type, hash in fake_graph.get_hashes(content).items()
+                if hash_type != "sha1Hash" or number % 5
+            ),
+            **({"crc32Hash": "not hex"} if number % 11 == 0 else {})
+        )
+    )
+
+class FileRecordStoreTest(unittest.TestCase):
+    FILES = [make_file(number) for number in range(300)]
+    def check(self, records):
+        self.assertEqual(len(records), len(self.FILES))
+        for index, file in enumerate(self.FILES):
+            self.assertEqual(records.get(index), file)
+            self.assertEqual(
+                records.get_bucket_key(index, "sha1Hash"),
+                self.records.get_bucket_key(index, "sha1Hash")
+            )
+    def setUp(self):
+        self.records = file_records.FileRecordStore()
+        for file in self.FILES:
+            self.records.add(file)
+    def test_in_memory(self):
+        self.check(self.records)
+        self.check(pickle.loads(pickle.dumps(self.records)))
+    def test_memory_budget(self):
+        records = file_records.FileRecordStore(1000)
+        for file in self.FILES:
+            records.add(file)
+        # Little of the strings and hashes is left in memory.
+        for column in (records._ids, records._names, records._urls):
+            self.assertLessEqual(len(column._data._tail), 200)
+        self.check(records)
+        loaded = pickle.loads(pickle.dumps(records))
+        self.check(loaded)
+        # More files can be added after it is loaded.
+        index = loaded.add(make_file(300))
+        self.assertEqual(loaded.get(index), make_file(300))
+
+class MemoryBudgetScanTest(fake_graph.DriveTestCase):
+    def test_scan(self):
+        for number in range(40):
+            folder_id = "root" if number % 3 else \
+                self.drive.add_folder("root", "Folder {}".format(number))
+            self.drive.add_file(
+                folder_id,
+                "{}.txt".format(number),
+                str(number % 13).encode("ASCII") * 100
+            )
+        scan = scan_runner.load_or_create_scan("in memory", self.client)
+        self.addCleanup(scan.close)
+        self.scan_until_complete(scan)
+        settings_loader.settings["MEMORY_BUDGET"] = 500
+        scan_on_disk = scan_runner.load_or_create_scan("on disk", self.client)
+        self.addCleanup(scan_on_disk.close)
+        self.scan_until_complete(scan_on_disk)
+        self.assertEqual(self.get_groups(scan_on_disk), self.get_groups(scan))
+        scan_on_disk.save("on disk")
+        loaded = scan_runner.load_or_create_scan("on disk", self.client)
+        self.addCleanup(loaded.close)
+        self.assertEqual(
+            list(loaded.get_duplicates()),
+            list(scan_on_disk.get_duplicates())
+        )
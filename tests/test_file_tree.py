@@ -0,0 +1,154 @@
+import requests, unittest, unittest.mock
+from main import file_tree, scan_runner
+from . import fake_graph
+
+class FolderListingTest(fake_graph.DriveTestCase):
+    def setUp(self):
+        super().setUp()
+        # The folders have more children than fit on one page.
+        self.folder_ids = []
+        for number in range(3):
+            folder_id = \
+                self.drive.add_folder("root", "Folder {}".format(number))
+            self.folder_ids.append(folder_id)
+            for name in range(7):
+                self.drive.add_file(
+                    folder_id,
+                    "{}.txt".format(name),
+                    str(name).encode("ASCII")
+                )
+    def test_failed_listing_is_retried(self):
+        scan = scan_runner.load_or_create_scan("token", self.client)
+        self.addCleanup(scan.close)
+        self.drive.fail("children", requests.ConnectionError("reset"))
+        with self.assertRaises(requests.ConnectionError):
+            scan.step()
+        # The root was put back, so the whole drive is scanned, and each page
+        # is scanned once.
+        self.scan_until_complete(scan)
+        self.assertEqual(scan.num_scanned_files, 21)
+        self.assertEqual(len(self.get_groups(scan)), 7)
+    def test_snapshot_includes_folders_being_listed(self):
+        def child_yielder(url, add_folder_url):
+            # Save the scan while this folder is being listed.
+            scan.save("token")
+            yield file_tree.File(
+                id="file",
+                name="file.txt",
+                size=1,
+                url="",
+                parent_id="root",
+                parent_path="/drive/root:",
+                mime_type="text/plain",
+                hashes={"sha1Hash": "0"}
+            )
+        scan = file_tree.DuplicateFileScan("sha1Hash", child_yielder, str)
+        self.addCleanup(scan.close)
+        scan.add_folder_url("root")
+        scan.step()
+        self.assertTrue(scan.complete)
+        loaded = file_tree.DuplicateFileScan.load("token", child_yielder, str)
+        self.addCleanup(loaded.close)
+        self.assertEqual(loaded.num_queued_folders, 1)
+
+class SaveTest(fake_graph.DriveTestCase):
+    def setUp(self):
+        super().setUp()
+        for number in range(4):
+            folder_id = \
+                self.drive.add_folder("root", "Folder {}".format(number))
+            self.drive.add_file(folder_id, "a.txt", b"same")
+            self.drive.add_file(folder_id, "b.txt", b"other")
+    def load_read_only(self):
+        scan = file_tree.DuplicateFileScan.load(
+            "token",
+            None,
+            None,
+            read_only=True
+        )
+        self.addCleanup(scan.close)
+        return scan
+    def test_load(self):
+        scan = scan_runner.load_or_create_scan("token", self.client)
+        self.addCleanup(scan.close)
+        scan.step()
+        scan.save("token")
+        self.scan_until_complete(scan)
+        scan.save("token")
+        loaded = scan_runner.load_or_create_scan("token", self.client)
+        self.addCleanup(loaded.close)
+        self.assertTrue(loaded.complete)
+        self.assertEqual(self.get_groups(loaded), self.get_groups(scan))
+        self.assertEqual(loaded.num_scanned_files, 8)
+    def test_load_appended(self):
+        scan = scan_runner.load_or_create_scan("token", self.client)
+        self.addCleanup(scan.close)
+        scan.save("token")
+        loaded = self.load_read_only()
+        self.assertEqual(loaded.num_queued_folders, 1)
+        self.scan_until_complete(scan)
+        scan.save("token")
+        # Only the checkpoint is read.
+        self.assertTrue(loaded.load_appended())
+        self.assertTrue(loaded.complete)
+        self.assertEqual(self.get_groups(loaded), self.get_groups(scan))
+        self.assertEqual(loaded.num_scanned_files, 8)
+        self.assertTrue(loaded.load_appended())
+    def test_load_appended_after_snapshot(self):
+        scan = scan_runner.load_or_create_scan("token", self.client)
+        self.addCleanup(scan.close)
+        scan.save("token")
+        loaded = self.load_read_only()
+        self.scan_until_complete(scan)
+        # A save to another token writes a new snapshot.
+        scan.save("other")
+        scan.save("token")
+        self.assertFalse(loaded.load_appended())
+        self.assertFalse(loaded.complete)
+        file_tree.DuplicateFileScan.delete_save("token")
+        self.assertFalse(loaded.load_appended())
+
+class DuplicatesPageTest(unittest.TestCase):
+    def setUp(self):
+        # Each folder has a file of each size up to its number, so the
+        # larger files have fewer copies.
+        def child_yielder(url, add_folder_url):
+            for size in range(1, int(url) + 1):
+                yield file_tree.File(
+                    id="{}-{}".format(url, size),
+                    name="{}.txt".format(size),
+                    size=size,
+                    url="",
+                    parent_id=url,
+                    parent_path="/drive/root:/" + url,
+                    mime_type="text/plain",
+                    hashes={"sha1Hash": str(size)}
+                )
+        self.scan = file_tree.DuplicateFileScan("sha1Hash", child_yielder, str)
+        self.addCleanup(self.scan.close)
+        for number in range(1, 6):
+            self.scan.add_folder_url(str(number))
+        self.scan.step()
+        self.sort_key = unittest.mock.Mock(
+            side_effect=file_tree.DuplicateFileScan.SORT_KEYS["size"]
+        )
+        patch = unittest.mock.patch.dict(
+            file_tree.DuplicateFileScan.SORT_KEYS,
+            {"size": self.sort_key}
+        )
+        patch.start()
+        self.addCleanup(patch.stop)
+    def get_sizes(self, offset, limit, sort="size"):
+        num_groups, page = self.scan.get_duplicates_page(offset, limit, sort)
+        return num_groups, [group[0].size for group in page]
+    def test_pages(self):
+        self.assertEqual(self.get_sizes(0, 2), (4, [4, 3]))
+        self.assertEqual(self.get_sizes(2, 2), (4, [2, 1]))
+        self.assertEqual(self.get_sizes(0, 2, "count"), (4, [1, 2]))
+        # The order was only found once.
+        self.assertEqual(self.sort_key.call_count, 4)
+    def test_order_changes_with_groups(self):
+        self.assertEqual(self.get_sizes(0, 1), (4, [4]))
+        self.scan.add_folder_url("6")
+        self.scan.step()
+        self.assertEqual(self.get_sizes(0, 1), (5, [5]))
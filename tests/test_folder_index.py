@@ -0,0 +1,119 @@
+import unittest
+from main import folder_index, scan_runner, scan_scope
+from . import fake_graph
+
+class FolderDuplicateIndexTest(unittest.TestCase):
+    def make_index(self, files, incomplete_paths=()):
+        # Each file is a tuple of a parent path and a key, and has size 1.
+        paths = set()
+        for parent_path, _ in files:
+            while parent_path:
+                paths.add(parent_path)
+                parent_path = parent_path.rpartition("/")[0]
+        return folder_index.FolderDuplicateIndex(
+            {"id " + path: path for path in paths},
+            set(incomplete_paths),
+            [(parent_path, key, 1) for parent_path, key in files]
+        )
+    def test_copies(self):
+        index = self.make_index([
+            ("/r/a", b"1"),
+            ("/r/a/sub", b"2"),
+            # The names differ, but the content is the same.
+            ("/r/b", b"1"),
+            ("/r/b/other", b"2"),
+            ("/r/c", b"1"),
+        ])
+        # The subfolders are covered by their parents.
+        self.assertEqual(index.groups, [["/r/a", "/r/b"]])
+        self.assertEqual(index.get_num_files("/r/a"), 2)
+        self.assertEqual(index.get_size("/r"), 5)
+        self.assertEqual(index.get_folder_id("/r/b"), "id /r/b")
+        self.assertTrue(index.covers(["/r/a/sub", "/r/b/other"]))
+        self.assertFalse(index.covers(["/r/a", "/r/c"]))
+        self.assertFalse(index.covers(["/r/a/sub", "/r/a/sub"]))
+    def test_unknown_content(self):
+        index = self.make_index([
+            ("/r/a", b"1"),
+            ("/r/a", None),
+            ("/r/b", b"1"),
+            ("/r/b", None),
+        ])
+        self.assertEqual(index.groups, [])
+
+    def test_incomplete(self):
+        files = [
+            ("/r/a/sub", b"1"),
+            ("/r/b/sub", b"1"),
+            ("/r/c/sub", b"1"),
+        ]
+        # Something was left out of /r/b/sub, which therefore may differ,
+        # and so may /r/b.
+        index = self.make_index(files, ["/r/b/sub"])
+        self.assertEqual(index.groups, [["/r/a", "/r/c"]])
+
+class DuplicateFoldersTest(fake_graph.DriveTestCase):
+    def get_folder_groups(self, scope=None):
+        scan = scan_runner.load_or_create_scan(
+            "token",
+            self.client,
+            scope=scope
+        )
+        self.addCleanup(scan.close)
+        self.scan_until_complete(scan)
+        return [
+            sorted(folder.name for folder in group)
+            for group in scan.get_duplicate_folders()
+        ]
+    def test_file_below_min_size(self):
+        for name in ("A", "B"):
+            folder_id = self.drive.add_folder("root", name)
+            self.drive.add_file(folder_id, "large.bin", b"large" * 100)
+        self.drive.add_file(folder_id, "small.txt", b"unique")
+        self.assertEqual(self.get_folder_groups(), [])
+        self.assertEqual(
+            self.get_folder_groups(scan_scope.ScanScope(min_size=100)),
+            []
+        )
+    def test_excluded_subfolder(self):
+        for name in ("A", "B"):
+            folder_id = self.drive.add_folder("root", name)
+            self.drive.add_file(folder_id, "index.js", b"code")
+            subfolder_id = self.drive.add_folder(folder_id, "node_modules")
+        for number in range(5):
+            self.drive.add_file(
+                subfolder_id,
+                "{}.js".format(number),
+                str(number).encode("ASCII")
+            )
+        self.assertEqual(
+            self.get_folder_groups(
+                scan_scope.ScanScope(exclude_globs=["*/node_modules"])
+            ),
+            []
+        )
+    def test_collapse(self):
+        for name in ("Photos", "Photos (copy)"):
+            folder_id = self.drive.add_folder("root", name)
+            self.drive.add_file(folder_id, "a.jpg", b"a")
+            self.drive.add_file(folder_id, "b.jpg", b"b")
+        self.drive.add_file("root", "c.jpg", b"a")
+        scan = scan_runner.load_or_create_scan("token", self.client)
+        self.addCleanup(scan.close)
+        self.scan_until_complete(scan)
+        self.assertEqual(
+            [
+                [folder.name for folder in group]
+                for group in scan.get_duplicate_folders()
+            ],
+            [["Photos", "Photos (copy)"]]
+        )
+        self.assertEqual(len(list(scan.get_duplicates())), 2)
+        # Only the file that has another copy outside the folders is left.
+        self.assertEqual(
+            [
+                sorted(file.name for file in group)
+                for group in scan.get_duplicates(collapse_folders=True)
+            ],
+            [["a.jpg", "a.jpg", "c.jpg"]]
+        )
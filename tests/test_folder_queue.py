@@ -0,0 +1,16 @@
+import unittest
+from main import folder_queue
+
+class FolderQueueTest(unittest.TestCase):
+    def pop_all(self, queue):
+        return [queue.popleft()[0] for _ in range(len(queue))]
+    def test_order_added(self):
+        queue = folder_queue.FolderQueue()
+        queue.extend([("a", 1), ("b", 3), ("c", None)])
+        self.assertEqual(self.pop_all(queue), ["a", "b", "c"])
+    def test_priority(self):
+        queue = folder_queue.PriorityFolderQueue()
+        queue.extend([("a", 1), ("b", 3), ("c", None), ("d", 3), ("e", 2)])
+        self.assertEqual(list(queue)[0], ("c", None))
+        # Entries without a score come first, and ties keep their order.
+        self.assertEqual(self.pop_all(queue), ["c", "b", "d", "e", "a"])
@@ -0,0 +1,39 @@
+import unittest
+from main import metrics
+
+class MetricsTest(unittest.TestCase):
+    def add(self, metric):
+        self.addCleanup(metrics._metrics.remove, metric)
+        return metric
+    def test_counter(self):
+        counter = self.add(metrics.Counter(
+            "test_calls_total",
+            "Calls.",
+            ("status",)
+        ))
+        counter.inc(status="200")
+        counter.inc(2, status='a"b')
+        self.assertEqual(counter.get(status="200"), 1)
+        self.assertEqual(list(counter.render()), [
+            "# HELP test_calls_total Calls.",
+            "# TYPE test_calls_total counter",
+            'test_calls_total{status="200"} 1',
+            'test_calls_total{status="a\\"b"} 2',
+        ])
+        self.assertIn('test_calls_total{status="200"} 1\n', metrics.render())
+    def test_histogram(self):
+        histogram = self.add(metrics.Histogram(
+            "test_seconds",
+            "Seconds.",
+            buckets=(0.1, 1.0)
+        ))
+        histogram.observe(0.05)
+        histogram.observe(0.5)
+        histogram.observe(5.0)
+        self.assertEqual(list(histogram.render())[2:], [
+            'test_seconds_bucket{le="0.1"} 1',
+            'test_seconds_bucket{le="1.0"} 2',
+            'test_seconds_bucket{le="+Inf"} 3',
+            "test_seconds_sum 5.55",
+            "test_seconds_count 3",
+        ])
@@ -0,0 +1,180 @@
+import time, unittest, unittest.mock
+from main import onedrive
+from . import fake_graph
+
+class GraphClientTest(fake_graph.DriveTestCase):
+    def setUp(self):
+        super().setUp()
+        self.url = onedrive.get_root_folder_url()
+        self.limiter = unittest.mock.Mock(wraps=self.client._limiter)
+        self.client._limiter = self.limiter
+    def test_retry(self):
+        self.drive.fail("children", 503, 2)
+        self.assertEqual(self.client.fetch(self.url).status_code, 200)
+        self.assertEqual(self.limiter.report_throttle.call_count, 2)
+        self.assertEqual(self.limiter.report_success.call_count, 1)
+    def test_retries_exhausted(self):
+        # Giving up on a throttled request is not a success.
+        self.drive.fail("children", 429, onedrive.GraphClient.MAX_RETRIES + 1)
+        self.assertEqual(self.client.fetch(self.url).status_code, 429)
+        self.assertEqual(
+            self.limiter.report_throttle.call_count,
+            onedrive.GraphClient.MAX_RETRIES + 1
+        )
+        self.limiter.report_success.assert_not_called()
+
+class SharedClientTest(unittest.TestCase):
+    def setUp(self):
+        patch = unittest.mock.patch.dict(onedrive._clients, clear=True)
+        patch.start()
+        self.addCleanup(patch.stop)
+    def get_client(self, access_token):
+        client = onedrive.get_client(
+            {"access_token": access_token, "token_type": "Bearer"}
+        )
+        self.addCleanup(client.close)
+        return client
+    def test_shared_client(self):
+        # Every thread that works for a user shares one pool of connections.
+        client = self.get_client("token")
+        self.assertIs(self.get_client("token"), client)
+        self.assertIsNot(self.get_client("other"), client)
+
+class TokenRefreshTest(fake_graph.DriveTestCase):
+    def setUp(self):
+        super().setUp()
+        self.url = onedrive.get_root_folder_url()
+        self.tokens = []
+        self._patch(unittest.mock.patch.dict(onedrive._clients, clear=True))
+    def make_client(self, expires_in=3600):
+        client = onedrive.GraphClient(
+            {
+                "access_token": "token",
+                "refresh_token": "refresh",
+                "token_type": "Bearer",
+                "expires_at": time.time() + expires_in,
+            },
+            4,
+            token_updater=self.tokens.append
+        )
+        self.addCleanup(client.close)
+        return client
+    def test_rejected_token(self):
+        # The token was revoked early, so it is refreshed once.
+        self.drive.rejected_tokens.add("token")
+        client = self.make_client()
+        self.assertEqual(client.fetch(self.url).status_code, 200)
+        self.assertEqual(len(self.drive.refreshes), 1)
+        self.assertEqual(
+            [token["access_token"] for token in self.tokens],
+            ["refreshed-1"]
+        )
+        self.assertEqual(client.fetch(self.url).status_code, 200)
+        self.assertEqual(len(self.drive.refreshes), 1)
+    def test_expiring_token(self):
+        client = self.make_client(60)
+        client.fetch(self.url)
+        self.assertEqual(len(self.drive.refreshes), 1)
+        self.assertEqual(client.token["access_token"], "refreshed-1")
+        client.refresh_token()
+        self.assertEqual(len(self.drive.refreshes), 1)
+    def test_expired_token_without_refresh_token(self):
+        self.drive.rejected_tokens.add("token")
+        client = onedrive.GraphClient(
+            {"access_token": "token", "token_type": "Bearer"},
+            4
+        )
+        self.addCleanup(client.close)
+        self.assertEqual(client.fetch(self.url).status_code, 401)
+        self.assertEqual(self.drive.refreshes, [])
+    def test_refreshed_token_finds_client(self):
+        token = {
+            "access_token": "token",
+            "refresh_token": "refresh",
+            "token_type": "Bearer",
+            "expires_at": time.time() + 60,
+        }
+        client = onedrive.get_client(token)
+        self.addCleanup(client.close)
+        client.fetch(self.url)
+        # The refreshed token finds the same client.
+        self.assertIs(onedrive.get_client(client.token), client)
+
+class GetContentRangeTest(fake_graph.DriveTestCase):
+    CONTENT = bytes(range(256)) * 2000
+    def setUp(self):
+        super().setUp()
+        self.file_id = self.drive.add_file("root", "a.bin", self.CONTENT)
+    def get_content_range(self, start, end):
+        return onedrive.get_content_range(
+            self.file_id,
+            start,
+            end,
+            client=self.client
+        )
+    def test_range(self):
+        self.assertEqual(
+            self.get_content_range(1000, 3000),
+            self.CONTENT[1000:3000]
+        )
+        self.assertEqual(self.drive.num_bytes_read, 2000)
+    def test_range_ignored(self):
+        # The server sends the whole file, but only as much of it as the
+        # range needs is read.
+        self.drive.honor_range = False
+        self.assertEqual(
+            self.get_content_range(1000, 3000),
+            self.CONTENT[1000:3000]
+        )
+        self.assertLess(self.drive.num_bytes_read, len(self.CONTENT) // 4)
+        start = len(self.CONTENT) - 100000
+        self.assertEqual(
+            self.get_content_range(start, len(self.CONTENT)),
+            self.CONTENT[start:]
+        )
+    def test_deleted_file(self):
+        self.drive.delete(self.file_id)
+        with self.assertRaises(onedrive.DownloadError) as context:
+            self.get_content_range(0, 100)
+        self.assertEqual(context.exception.args[1], 404)
+class GetChildrenBatchTest(fake_graph.DriveTestCase):
+    def setUp(self):
+        super().setUp()
+        self.folder_ids = [
+            self.drive.add_folder("root", name) for name in ("a", "b", "c")
+        ]
+        for folder_id in self.folder_ids:
+            self.drive.add_file(folder_id, "x.txt", folder_id.encode())
+        self.urls = [
+            onedrive.get_folder_url(folder_id)
+            for folder_id in self.folder_ids
+        ]
+        self.folder_urls_added = []
+    def get_names(self):
+        return sorted(
+            child.name for child in onedrive.get_children_batch(
+                self.urls,
+                self.folder_urls_added.append,
+                client=self.client
+            )
+        )
+    def test_retry(self):
+        self.drive.fail(
+            self.folder_ids[1] + "/",
+            503,
+            onedrive.GraphClient.MAX_RETRIES
+        )
+        self.assertEqual(self.get_names(), ["x.txt"] * 3)
+        self.assertEqual(self.folder_urls_added, [])
+    def test_retries_exhausted(self):
+        self.drive.fail(
+            self.folder_ids[1] + "/",
+            503,
+            onedrive.GraphClient.MAX_RETRIES + 1
+        )
+        with self.assertRaises(onedrive.APIKeyError):
+            self.get_names()
+    def test_access_denied(self):
+        # Only the folder that cannot be listed is skipped.
+        self.drive.fail(self.folder_ids[1] + "/", 403)
+        self.assertEqual(self.get_names(), ["x.txt"] * 2)
@@ -0,0 +1,61 @@
+import csv, io, json, unittest
+from main import file_tree, results_export
+
+def make_file(id, parent_path="/drive/root:"):
+    return file_tree.File(
+        id=id,
+        name=id + ".txt",
+        size=4,
+        url="https://example.com/" + id,
+        parent_id="root",
+        parent_path=parent_path,
+        mime_type="text/plain",
+        hashes={"sha1Hash": "ABCD"}
+    )
+
+class ExportTest(unittest.TestCase):
+    def setUp(self):
+        self.duplicates = [[make_file("a"), make_file("b")]]
+        self.folders = [[
+            file_tree.Subtree("x", "X", 8, "/drive/root:", 2),
+            file_tree.Subtree("y", "Y", 8, "/drive/root:", 2),
+        ]]
+    def export(self, format):
+        return "".join(results_export.iter_timed(
+            format,
+            results_export.FORMATS[format][1](
+                iter(self.duplicates),
+                "sha1Hash",
+                iter(self.folders)
+            )
+        ))
+    def test_json(self):
+        document = json.loads(self.export("json"))
+        self.assertEqual(
+            [folder["id"] for folder in document["duplicateFolders"][0]],
+            ["x", "y"]
+        )
+        file = document["duplicates"][0][1]
+        self.assertEqual(file["parentPath"], "/drive/root:")
+        self.assertEqual(file["mimeType"], "text/plain")
+    def test_json_empty(self):
+        self.duplicates = []
+        self.folders = []
+        self.assertEqual(
+            json.loads(self.export("json")),
+            {"duplicateFolders": [], "duplicates": []}
+        )
+    def test_ndjson(self):
+        lines = [
+            json.loads(line) for line in self.export("ndjson").splitlines()
+        ]
+        self.assertEqual(len(lines), 2)
+        self.assertEqual(lines[0][0]["numFiles"], 2)
+        self.assertEqual([file["id"] for file in lines[1]], ["a", "b"])
+    def test_csv(self):
+        rows = list(csv.DictReader(io.StringIO(self.export("csv"))))
+        self.assertEqual([row["group"] for row in rows], ["0", "0", "1", "1"])
+        self.assertEqual([row["id"] for row in rows], ["x", "y", "a", "b"])
+        self.assertEqual(rows[0]["numFiles"], "2")
+        self.assertEqual(rows[2]["sha1Hash"], "ABCD")
+        self.assertEqual(rows[2]["numFiles"], "")
@@ -0,0 +1,53 @@
+import csv, io, unittest.mock
+from main import app, onedrive, scan_runner
+from . import fake_graph
+
+class RoutesTest(fake_graph.DriveTestCase):
+    def setUp(self):
+        super().setUp()
+        # The test client does not use HTTPS.
+        self._patch(unittest.mock.patch.dict(
+            app.config,
+            {"SESSION_COOKIE_SECURE": False, "TESTING": True}
+        ))
+        self._patch(unittest.mock.patch.dict(onedrive._clients, clear=True))
+        self.addCleanup(scan_runner._runners.clear)
+        folder_id = self.drive.add_folder("root", "Pictures")
+        self.drive.add_file("root", "a.jpg", b"photo")
+        self.drive.add_file(folder_id, "b.jpg", b"photo")
+        self.app = app.test_client()
+    def sign_in(self):
+        with self.app.session_transaction() as session:
+            session["oauth_token"] = {
+                "access_token": "token",
+                "token_type": "Bearer",
+            }
+    def test_signed_out(self):
+        self.assertEqual(self.app.get("/status.json").status_code, 403)
+        self.assertEqual(self.app.get("/results.json").status_code, 403)
+        self.assertEqual(self.app.get("/").status_code, 200)
+    def test_scan(self):
+        self.sign_in()
+        self.assertEqual(self.app.get("/status.json").status_code, 404)
+        # The page starts the scan.
+        self.assertEqual(self.app.get("/").status_code, 200)
+        runner, = scan_runner._runners.values()
+        for client in onedrive._clients.values():
+            self.addCleanup(client.close)
+        self.assertTrue(runner.join(10))
+        status = self.app.get("/status.json").get_json()
+        self.assertEqual(status["state"], scan_runner.COMPLETE)
+        self.assertEqual(status["numDuplicateGroups"], 1)
+        page = self.app.get("/?sort=size&path=pictures").get_data(True)
+        self.assertIn("b.jpg", page)
+        rows = list(csv.DictReader(io.StringIO(
+            self.app.get("/results.csv").get_data(True)
+        )))
+        self.assertEqual(
+            sorted(row["name"] for row in rows),
+            ["a.jpg", "b.jpg"]
+        )
+        self.assertIn(
+            "duplicate_finder_graph_responses_total",
+            self.app.get("/metrics").get_data(True)
+        )
@@ -0,0 +1,88 @@
+import contextlib, gzip, io, json, os.path, signal, sys, tempfile, \
+    unittest.mock
+import scan
+from main import scheduler
+from . import fake_graph
+
+class ScanCLITest(fake_graph.DriveTestCase):
+    def setUp(self):
+        super().setUp()
+        # The scanner configures the shared workers and handles Ctrl+C.
+        self._patch(unittest.mock.patch.object(scheduler, "_scheduler", None))
+        self._patch(unittest.mock.patch.object(signal, "signal"))
+        folder_id = self.drive.add_folder("root", "Secret Pictures")
+        self.drive.add_file("root", "holiday.jpg", b"photo")
+        self.drive.add_file(folder_id, "holiday copy.jpg", b"photo")
+        self.drive.add_file(folder_id, "notes.txt", b"text")
+    def get_filename(self, name):
+        return os.path.join(tempfile.gettempdir(), name)
+    def run_scan(self, *arguments):
+        '''
+        Runs the scanner with the given arguments and returns the lines of
+        its NDJSON output.
+        '''
+        output = self.get_filename("output.ndjson")
+        stderr = io.StringIO()
+        with unittest.mock.patch.object(
+            sys,
+            "argv",
+            ["scan.py", "--output", output] + list(arguments)
+        ), contextlib.redirect_stderr(stderr):
+            self.assertEqual(scan.main(), 0, stderr.getvalue())
+        with open(output, encoding="UTF-8") as f:
+            return [json.loads(line) for line in f]
+    def get_names(self, lines):
+        return [sorted(file["name"] for file in group) for group in lines]
+    def test_scan(self):
+        metrics_file = self.get_filename("metrics.txt")
+        lines = self.run_scan(
+            "--access-token",
+            "token",
+            "--metrics-file",
+            metrics_file
+        )
+        self.assertEqual(
+            self.get_names(lines),
+            [["holiday copy.jpg", "holiday.jpg"]]
+        )
+        with open(metrics_file) as f:
+            self.assertIn("duplicate_finder_graph_responses_total", f.read())
+        # A complete scan is written again without listing the drive.
+        num_requests = len(self.drive.urls)
+        self.assertEqual(self.run_scan("--access-token", "token"), lines)
+        self.assertEqual(len(self.drive.urls), num_requests)
+    def test_record_and_replay(self):
+        cassette = self.get_filename("cassette.gz")
+        lines = self.run_scan(
+            "--access-token",
+            "token",
+            "--name",
+            "recorded",
+            "--record",
+            cassette
+        )
+        with gzip.open(cassette, "rt", encoding="UTF-8") as f:
+            recording = f.read()
+        # Names are not recorded.
+        self.assertNotIn("holiday", recording)
+        self.assertNotIn("Secret", recording)
+        num_requests = len(self.drive.urls)
+        replayed = self.run_scan("--replay", cassette)
+        self.assertEqual(len(self.drive.urls), num_requests)
+        self.assertEqual(
+            [[file["size"] for file in group] for group in replayed],
+            [[file["size"] for file in group] for group in lines]
+        )
+    def test_merge(self):
+        self.run_scan("--access-token", "token", "--name", "first")
+        self.drive.add_file("root", "other.txt", b"text")
+        self.run_scan("--access-token", "token", "--name", "second")
+        lines = self.run_scan(
+            "--merge",
+            "first",
+            "--merge",
+            "second",
+            "--cross-drive-only"
+        )
+        # Each file of the first scan matches itself in the second.
+        self.assertEqual(sorted(len(group) for group in lines), [3, 4])
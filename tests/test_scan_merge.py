@@ -0,0 +1,68 @@
+import unittest
+from main import file_tree, scan_merge
+
+def make_scan(hash_type, files):
+    # Returns a complete scan of a drive whose root has the given files, as
+    # tuples of an id, a size, and a dictionary of hashes.
+    def child_yielder(url, add_folder_url):
+        for file_id, size, hashes in files:
+            yield file_tree.File(
+                id=file_id,
+                name=file_id,
+                size=size,
+                url="",
+                parent_id="root",
+                parent_path="/drive/root:",
+                mime_type="text/plain",
+                hashes=hashes
+            )
+    scan = file_tree.DuplicateFileScan(hash_type, child_yielder, str)
+    scan.add_folder_url("root")
+    scan.step()
+    return scan
+
+class MergedDuplicateIndexTest(unittest.TestCase):
+    def get_groups(self, scans, **kwargs):
+        for scan in scans:
+            self.addCleanup(scan.close)
+        index = scan_merge.MergedDuplicateIndex(scans)
+        return sorted(
+            sorted(file.id for file in group)
+            for group in index.get_duplicates(**kwargs)
+        )
+    def test_match_on_shared_hash(self):
+        personal = make_scan("sha1Hash", [
+            ("a", 4, {"sha1Hash": "1", "quickXorHash": "x"}),
+            ("b", 4, {"sha1Hash": "2", "quickXorHash": "y"}),
+        ])
+        work = make_scan("quickXorHash", [
+            ("c", 4, {"quickXorHash": "x"}),
+            ("d", 5, {"quickXorHash": "y"}),
+        ])
+        self.assertEqual(self.get_groups([personal, work]), [["a", "c"]])
+    def test_size_only_groups_are_left_out(self):
+        # Neither file has the hash type of the scan, so the scan grouped
+        # them by their size alone, but only one of them has the same
+        # content as the file in the other scan.
+        work = make_scan("quickXorHash", [
+            ("a", 4, {"sha1Hash": "1"}),
+            ("b", 4, {}),
+        ])
+        personal = make_scan("sha1Hash", [("c", 4, {"sha1Hash": "1"})])
+        self.assertEqual(len(list(work.get_duplicates())), 1)
+        self.assertEqual(self.get_groups([work, personal]), [["a", "c"]])
+    def test_cross_scan_only(self):
+        first = make_scan("sha1Hash", [
+            ("a", 4, {"sha1Hash": "1"}),
+            ("b", 4, {"sha1Hash": "1"}),
+            ("c", 5, {"sha1Hash": "2"}),
+        ])
+        second = make_scan("sha1Hash", [("d", 5, {"sha1Hash": "2"})])
+        self.assertEqual(
+            self.get_groups([first, second]),
+            [["a", "b"], ["c", "d"]]
+        )
+        self.assertEqual(
+            self.get_groups([first, second], cross_scan_only=True),
+            [["c", "d"]]
+        )
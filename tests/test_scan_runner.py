@@ -0,0 +1,125 @@
+import requests, threading, unittest, unittest.mock
+from main import file_tree, scan_runner
+from . import fake_graph
+
+class ScanRunnerTest(fake_graph.DriveTestCase):
+    TOKEN = "token"
+    def setUp(self):
+        super().setUp()
+        folder_id = self.drive.add_folder("root", "Pictures")
+        self.drive.add_file("root", "a.jpg", b"photo")
+        self.drive.add_file(folder_id, "b.jpg", b"photo")
+        self.addCleanup(scan_runner._runners.clear)
+    def start(self):
+        runner = scan_runner.start_runner(
+            self.TOKEN,
+            lambda: scan_runner.load_or_create_scan(self.TOKEN, self.client)
+        )
+        self.assertTrue(runner.join(10))
+        return runner
+    def assert_released(self):
+        lock = scan_runner.acquire_lock(self.TOKEN)
+        self.assertIsNotNone(lock)
+        lock.release()
+    def test_complete(self):
+        runner = self.start()
+        self.assertEqual(runner.state, scan_runner.COMPLETE)
+        self.assertEqual(runner.scan.num_duplicate_files, 2)
+        self.assert_released()
+    def test_unexpected_error(self):
+        self.drive.fail("children", requests.ConnectionError("reset"), 100)
+        runner = self.start()
+        self.assertEqual(runner.state, scan_runner.ERROR)
+        self.assertIn("reset", runner.error)
+        # The scan is saved, and another runner may take it over.
+        self.assertEqual(
+            scan_runner.get_runner(self.TOKEN).status()["state"],
+            scan_runner.ERROR
+        )
+        file_tree.DuplicateFileScan.load(self.TOKEN, None, None).close()
+        self.assert_released()
+    def test_error_is_shown_before_retry(self):
+        self.drive.fail("children", requests.ConnectionError("reset"))
+        runner = self.start()
+        self.assertIs(self.start(), runner)
+        self.assertEqual(runner.state, scan_runner.ERROR)
+    def test_error_is_retried_from_save(self):
+        self.drive.fail("children", requests.ConnectionError("reset"))
+        runner = self.start()
+        self.assertEqual(runner.state, scan_runner.ERROR)
+        with unittest.mock.patch.object(
+            scan_runner.ScanRunner,
+            "ERROR_RETRY_INTERVAL",
+            0.0
+        ):
+            runner_new = self.start()
+        self.assertIsNot(runner_new, runner)
+        self.assertEqual(runner_new.state, scan_runner.COMPLETE)
+        self.assertEqual(runner_new.scan.num_duplicate_files, 2)
+    def test_cancelled_scan_starts_over(self):
+        scan = scan_runner.load_or_create_scan(self.TOKEN, self.client)
+        # Hold the runner up until it is cancelled.
+        with scan._lock:
+            runner = scan_runner.start_runner(self.TOKEN, lambda: scan)
+            runner.cancel()
+        self.assertTrue(runner.join(10))
+        self.assertEqual(runner.state, scan_runner.CANCELLED)
+        runner_new = self.start()
+        self.assertIsNot(runner_new, runner)
+        self.assertEqual(runner_new.state, scan_runner.COMPLETE)
+        self.assertEqual(runner_new.scan.num_duplicate_files, 2)
+    def test_take_over_from_exited_process(self):
+        # The owner saved the scan and shared its status, and then it exited
+        # without releasing the lock file.
+        scan = scan_runner.load_or_create_scan(self.TOKEN, self.client)
+        scan.step()
+        scan.save(self.TOKEN)
+        scan.close()
+        scan_runner._write_json(
+            scan_runner._get_filename(self.TOKEN, ".status"),
+            {
+                "status": {"state": scan_runner.RUNNING, "error": None},
+                "errorApiUrl": None,
+                "errorApiResponse": None,
+            }
+        )
+        self.assertIsInstance(
+            scan_runner.get_runner(self.TOKEN),
+            scan_runner.RemoteScanRunner
+        )
+        runner = self.start()
+        self.assertIsInstance(runner, scan_runner.ScanRunner)
+        self.assertEqual(runner.state, scan_runner.COMPLETE)
+        self.assertEqual(runner.scan.num_duplicate_files, 2)
+    def test_loading_does_not_block_other_scans(self):
+        loading = threading.Event()
+        loaded = threading.Event()
+        def get_scan():
+            loading.set()
+            self.assertTrue(loaded.wait(10))
+            return scan_runner.load_or_create_scan(self.TOKEN, self.client)
+        thread = threading.Thread(
+            target=scan_runner.start_runner,
+            args=(self.TOKEN, get_scan)
+        )
+        thread.start()
+        self.assertTrue(loading.wait(10))
+        try:
+            other = threading.Thread(
+                target=scan_runner.get_runner,
+                args=("other",)
+            )
+            other.start()
+            other.join(10)
+            self.assertFalse(other.is_alive())
+            # Another thread already holds the lock for the same scan.
+            self.assertIsInstance(
+                scan_runner.start_runner(self.TOKEN, get_scan),
+                scan_runner.RemoteScanRunner
+            )
+        finally:
+            loaded.set()
+            thread.join(10)
+        runner = scan_runner.get_runner(self.TOKEN)
+        self.assertTrue(runner.join(10))
+        self.assertEqual(runner.state, scan_runner.COMPLETE)
@@ -0,0 +1,54 @@
+import unittest
+from main import scan_runner, scan_scope
+from . import fake_graph
+
+class FolderPathsTest(unittest.TestCase):
+    def test_normalize(self):
+        scope = scan_scope.ScanScope(
+            folder_paths=["Pictures/", " /Music ", "//Documents//Work", ""]
+        )
+        self.assertEqual(
+            scope.folder_paths,
+            ("/Pictures", "/Music", "/Documents/Work")
+        )
+    def test_nested_paths(self):
+        scope = scan_scope.ScanScope(
+            folder_paths=["/pictures/2020", "/Pictures", "/PICTURES", "/Pic"]
+        )
+        self.assertEqual(scope.folder_paths, ("/Pictures", "/Pic"))
+    def test_root(self):
+        self.assertEqual(
+            scan_scope.ScanScope(folder_paths=["/"]),
+            scan_scope.ScanScope()
+        )
+
+class ScopedScanTest(fake_graph.DriveTestCase):
+    def setUp(self):
+        super().setUp()
+        pictures_id = self.drive.add_folder("root", "Pictures")
+        self.drive.add_file(pictures_id, "a.jpg", b"a")
+        album_id = self.drive.add_folder(pictures_id, "Album")
+        self.drive.add_file(album_id, "b.jpg", b"b")
+        self.copy_id = self.drive.add_file(album_id, "b copy.jpg", b"b")
+        self.music_id = self.drive.add_folder("root", "Music")
+        self.drive.add_file(self.music_id, "a.mp3", b"a")
+    def scan(self, *folder_paths):
+        scan = scan_runner.load_or_create_scan(
+            "token",
+            self.client,
+            scope=scan_scope.ScanScope(folder_paths=folder_paths)
+        )
+        self.addCleanup(scan.close)
+        return self.scan_until_complete(scan)
+    def test_nested_folders(self):
+        scan = self.scan("/Pictures", "/pictures/Album")
+        self.assertEqual(scan.num_scanned_files, 3)
+        self.assertEqual(len(self.get_groups(scan)), 1)
+    def test_file_listed_twice(self):
+        # Two folders of the scope list the same file, as they can if it is
+        # moved between them during the scan.
+        self.drive.add_file(self.music_id, "b copy.jpg", b"b", id=self.copy_id)
+        scan = self.scan("/Pictures", "/Music")
+        self.assertEqual(scan.num_scanned_files, 4)
+        for group in self.get_groups(scan):
+            self.assertEqual(len(group), len(set(group)))
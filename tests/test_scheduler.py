@@ -0,0 +1,59 @@
+import threading, unittest
+from main import scheduler
+
+class FairSchedulerTest(unittest.TestCase):
+    def setUp(self):
+        self.scheduler = scheduler.FairScheduler(1, 1)
+        # The first piece of work holds the only worker until it is released.
+        self.release = threading.Event()
+        self.order = []
+        started = threading.Event()
+        def hold():
+            started.set()
+            self.release.wait(5)
+        self.scheduler.submit("a", hold)
+        started.wait(5)
+    def submit(self, tenant, name):
+        return self.scheduler.submit(tenant, self.order.append, (name,))
+    def test_turns(self):
+        results = [
+            self.submit("a", "a1"),
+            self.submit("a", "a2"),
+            self.submit("b", "b1"),
+        ]
+        self.assertEqual(self.scheduler.get_queue_position("a"), 0)
+        self.assertIsNone(self.scheduler.get_queue_position("c"))
+        self.release.set()
+        for result in results:
+            result.get()
+        # The tenants take turns.
+        self.assertEqual(self.order, ["a1", "b1", "a2"])
+    def test_error(self):
+        self.release.set()
+        result = self.scheduler.submit("a", int, ("x",))
+        with self.assertRaises(ValueError):
+            result.get()
+    def test_tenant_cap(self):
+        fair = scheduler.FairScheduler(4, 2)
+        lock = threading.Lock()
+        running = [0, 0]
+        release = threading.Event()
+        def work():
+            with lock:
+                running[0] += 1
+                running[1] = max(running)
+            release.wait(5)
+            with lock:
+                running[0] -= 1
+        pool = scheduler.TenantPool(fair, "a")
+        results = [pool.apply_async(work) for _ in range(4)]
+        # Another tenant still gets a worker.
+        self.assertEqual(
+            scheduler.TenantPool(fair, "b").map(abs, [-1, -2]),
+            [1, 2]
+        )
+        release.set()
+        pool.join()
+        for result in results:
+            result.get()
+        self.assertEqual(running[1], 2)
@@ -0,0 +1,62 @@
+import email.utils, threading, time, unittest
+from main import throttle
+
+class AdaptiveLimiterTest(unittest.TestCase):
+    def test_increase(self):
+        limiter = throttle.AdaptiveLimiter(4, 1)
+        for _ in range(20):
+            limiter.report_success(0.1)
+        # The limit grows by one for each limit's worth of responses, up to
+        # the highest limit.
+        self.assertEqual(limiter.limit, 4)
+    def test_no_increase_while_slow(self):
+        limiter = throttle.AdaptiveLimiter(4, 1)
+        limiter.report_success(0.1)
+        limiter.report_success(0.1)
+        self.assertEqual(limiter.limit, 2)
+        for _ in range(20):
+            limiter.report_success(1.0)
+        self.assertEqual(limiter.limit, 2)
+    def test_throttle(self):
+        limiter = throttle.AdaptiveLimiter(16, 8)
+        limiter.report_throttle()
+        # A burst of throttled requests only counts once.
+        limiter.report_throttle()
+        self.assertEqual(limiter.limit, 4)
+        limiter._time_last_decrease -= limiter.DECREASE_COOLDOWN
+        limiter.report_throttle()
+        self.assertEqual(limiter.limit, 2)
+    def test_limit(self):
+        limiter = throttle.AdaptiveLimiter(2, 2)
+        limiter.acquire()
+        limiter.acquire()
+        acquired = threading.Event()
+        def acquire():
+            with limiter.slot():
+                acquired.set()
+        thread = threading.Thread(target=acquire)
+        thread.start()
+        self.assertFalse(acquired.wait(0.05))
+        limiter.release()
+        self.assertTrue(acquired.wait(5))
+        thread.join()
+        self.assertEqual(limiter.in_flight, 1)
+    def test_retry_after(self):
+        limiter = throttle.AdaptiveLimiter(2, 2)
+        limiter.report_throttle(0.1)
+        time_start = time.monotonic()
+        with limiter.slot():
+            self.assertGreaterEqual(time.monotonic() - time_start, 0.09)
+
+class RetryTest(unittest.TestCase):
+    def test_backoff_delay(self):
+        for attempt in range(10):
+            delay = throttle.backoff_delay(attempt, 0.5, 4.0)
+            self.assertGreaterEqual(delay, 0.0)
+            self.assertLessEqual(delay, min(4.0, 0.5 * 2 ** attempt))
+    def test_parse_retry_after(self):
+        self.assertEqual(throttle.parse_retry_after("5"), 5.0)
+        self.assertIsNone(throttle.parse_retry_after(None))
+        self.assertIsNone(throttle.parse_retry_after("soon"))
+        date = email.utils.formatdate(time.time() + 60, usegmt=True)
+        self.assertAlmostEqual(throttle.parse_retry_after(date), 60, delta=2)